@@ -0,0 +1,64 @@
+'''
+Benchmarks EcsTaskManager.bulk_describe_tasks against a stubbed ECS client.
+
+Usage: python benchmarks/bench_describe_tasks.py [tasks] [clusters] [latency_ms]
+'''
+import os
+import sys
+import time
+import threading
+import mock
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib import EcsTaskManager
+
+class StubEcsClient:
+  """Stubbed ECS client with a fixed per-request latency"""
+  def __init__(self, latency):
+    self.latency = latency
+    self.calls = 0
+    self.lock = threading.Lock()
+
+  def describe_tasks(self, cluster, tasks):
+    if len(tasks) > 100:
+      raise ValueError('DescribeTasks accepts at most 100 tasks')
+    with self.lock:
+      self.calls += 1
+    time.sleep(self.latency)
+    return {
+      'tasks': [{'taskArn': t, 'clusterArn': cluster, 'lastStatus': 'RUNNING'} for t in tasks],
+      'failures': []
+    }
+
+# Sequential baseline with one DescribeTasks request per cluster batch
+def describe_sequential(client, pairs):
+  clusters = {}
+  for cluster, task in pairs:
+    clusters.setdefault(cluster, []).append(task)
+  result = {'tasks': [], 'failures': []}
+  for cluster, tasks in clusters.items():
+    for i in range(0, len(tasks), 100):
+      response = client.describe_tasks(cluster=cluster, tasks=tasks[i:i + 100])
+      result['tasks'] += response['tasks']
+      result['failures'] += response['failures']
+  return result
+
+def run(name, func, client, pairs):
+  start = time.time()
+  result = func(pairs)
+  elapsed = time.time() - start
+  assert len(result['tasks']) == len(pairs)
+  print('%-12s tasks=%-6d calls=%-5d wall=%.3fs' % (name, len(pairs), client.calls, elapsed))
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+  clusters = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+  latency = float(sys.argv[3] if len(sys.argv) > 3 else 50) / 1000
+  pairs = [('cluster-%d' % (i % clusters), 'arn:aws:ecs:us-west-2:123456789012:task/%06d' % i) for i in range(count)]
+  with mock.patch('boto3.client'):
+    task_mgr = EcsTaskManager()
+  client = StubEcsClient(latency)
+  run('sequential', lambda p: describe_sequential(client, p), client, pairs)
+  client = StubEcsClient(latency)
+  task_mgr.client = client
+  run('bulk', task_mgr.bulk_describe_tasks, client, pairs)
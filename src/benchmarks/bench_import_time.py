@@ -0,0 +1,84 @@
+'''
+Reports the cold start import cost of each Lambda handler module.
+
+Each handler is imported in a fresh interpreter.  On Python 3.7+ the output of -X importtime is parsed to report
+the cumulative import time and the heaviest nested imports, otherwise the import is timed directly.
+Exits with a non-zero status if any handler exceeds the import budget.
+
+Usage: python benchmarks/bench_import_time.py [--python PATH] [--budget-ms 100] [--runs 5]
+'''
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HANDLERS = ['ecs_tasks', 'create_task', 'check_task']
+
+# Modules that should only be imported on first use
+HEAVY_MODULES = ['boto3', 'botocore.session', 'voluptuous', 'requests', 'cfn_lambda_handler', 'dateutil.parser', 'concurrent.futures']
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$')
+
+SNIPPET = '''
+import sys, time
+start = time.time()
+import %s
+elapsed = (time.time() - start) * 1000
+sys.stdout.write('%%.1f %%s' %% (elapsed, ','.join(m for m in %r if m in sys.modules)))
+'''
+
+def supports_importtime(python):
+  output = subprocess.check_output([python, '-c', 'import sys; print(sys.version_info[:2] >= (3, 7))'])
+  return output.strip() == b'True'
+
+# Returns the elapsed import time in milliseconds, the heavy modules loaded and the heaviest nested imports
+def measure(python, handler, importtime):
+  args = [python] + (['-X', 'importtime'] if importtime else []) + ['-c', SNIPPET % (handler, HEAVY_MODULES)]
+  env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+  process = subprocess.Popen(args, cwd=SRC_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  stdout, stderr = process.communicate()
+  if process.returncode:
+    raise RuntimeError('Failed to import %s: %s' % (handler, stderr.decode('utf-8')))
+  elapsed, loaded = stdout.decode('utf-8').split(' ', 1)
+  imports = []
+  for line in stderr.decode('utf-8').splitlines():
+    match = IMPORT_TIME.match(line)
+    if match:
+      imports.append((int(match.group(2)) / 1000.0, len(match.group(3)), match.group(4)))
+  return float(elapsed), [m for m in loaded.split(',') if m], nested_imports(imports, handler)[:5]
+
+# Children are reported before their parent, so the direct imports of a module precede it at one deeper level
+def nested_imports(imports, module):
+  index = next((i for i, m in enumerate(imports) if m[2] == module), None)
+  if index is None:
+    return []
+  level = imports[index][1]
+  nested = []
+  for cumulative, depth, name in reversed(imports[:index]):
+    if depth <= level:
+      break
+    if depth == level + 2:
+      nested.append((cumulative, depth, name))
+  return sorted(nested, reverse=True)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Handler cold start import benchmark')
+  parser.add_argument('--python', default=sys.executable)
+  parser.add_argument('--budget-ms', type=float, default=100)
+  parser.add_argument('--runs', type=int, default=5)
+  args = parser.parse_args()
+  importtime = supports_importtime(args.python)
+  exceeded = []
+  for handler in HANDLERS:
+    results = [measure(args.python, handler, importtime) for _ in range(args.runs)]
+    best = min(results, key=lambda r: r[0])
+    print('%-12s import=%7.1fms heavy=[%s]' % (handler, best[0], ', '.join(best[1])))
+    for cumulative, _, module in best[2]:
+      print('  %-40s %7.1fms' % (module, cumulative))
+    if best[0] > args.budget_ms:
+      exceeded.append(handler)
+  if exceeded:
+    print('Import budget of %.0fms exceeded by: %s' % (args.budget_ms, ', '.join(exceeded)))
+    sys.exit(1)
@@ -0,0 +1,197 @@
+'''
+Load tests the handlers against the simulated ECS and CloudFormation backends in virtual time.
+
+Drives ecs_tasks with concurrent CloudFormation stacks, re-invoking the function on each CfnLambdaExecutionTimeout,
+create_task and check_task with concurrent Step Functions executions that wait NextPoll seconds between checks,
+and create_task followed by a single check_task supervisor invocation every 10 seconds checking all task sets.
+Invocations run one at a time in order of their virtual start time, each advancing the virtual clock as it sleeps
+and makes requests.  Reports the API requests made, the Lambda seconds used and the end to end completion latency.
+
+Usage: python benchmarks/bench_load.py [--stacks 200] [--executions 200] [--count 1] [--capacity N] [--throttle-rate 0.02]
+'''
+import os
+import sys
+import heapq
+import timeit
+import logging
+import argparse
+import mock
+from collections import Counter
+from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from simulator import VirtualClock, SimulatedEcs, SimulatedCloudFormation
+
+# Maximum execution time of each Lambda invocation in seconds
+LAMBDA_TIMEOUT = 900
+
+class LambdaContext(object):
+  """Lambda context reporting the remaining execution time in virtual time"""
+  def __init__(self, clock):
+    self.clock = clock
+    self.deadline = clock.time() + LAMBDA_TIMEOUT
+
+  def get_remaining_time_in_millis(self):
+    return int((self.deadline - self.clock.time()) * 1000)
+
+class Simulation(object):
+  """Runs scheduled invocations in order of virtual start time, recording Lambda usage and completion latency"""
+  def __init__(self, clock):
+    self.clock = clock
+    self.queue = []
+    self.sequence = 0
+    self.invocations = 0
+    self.seconds = 0.0
+    self.latencies = []
+    self.results = Counter()
+
+  def schedule(self, at, func, *args):
+    self.sequence += 1
+    heapq.heappush(self.queue, (at, self.sequence, func, args))
+
+  def invoke(self, func, *args):
+    start = self.clock.time()
+    try:
+      return func(*args)
+    finally:
+      self.invocations += 1
+      self.seconds += self.clock.time() - start
+
+  def complete(self, submitted, status):
+    self.latencies.append(self.clock.time() - submitted)
+    self.results[status] += 1
+
+  def run(self):
+    while self.queue:
+      at, _, func, args = heapq.heappop(self.queue)
+      self.clock.now = at
+      func(*args)
+
+# Datetime class whose utcnow is the virtual time
+def virtual_datetime(clock):
+  class VirtualDatetime(datetime):
+    @classmethod
+    def utcnow(cls):
+      return clock.utcnow()
+  return VirtualDatetime
+
+def stack_event(index, clock, args):
+  import ecs_tasks
+  stack_id = 'arn:aws:cloudformation:us-west-2:123456789012:stack/stack-%d/%d' % (index, index)
+  return {
+    'StackId': stack_id,
+    'RequestId': 'request-%d' % index,
+    'RequestType': 'Create',
+    'LogicalResourceId': 'MigrateTask',
+    'PhysicalResourceId': ecs_tasks.get_task_id(stack_id, 'MigrateTask'),
+    'CreationTime': int(clock.time()),
+    'ResourceProperties': {
+      'Cluster': 'cluster',
+      'TaskDefinition': 'migrate',
+      'Count': args.count,
+      'Timeout': 3600,
+      'PollStrategy': args.poll_strategy
+    }
+  }
+
+# Runs a CloudFormation stack create, re-invoking the function with the event state until the task completes
+def run_stack(sim, event, submitted, state=None):
+  import ecs_tasks
+  from cfn_lambda_handler import CfnLambdaExecutionTimeout
+  context = LambdaContext(sim.clock)
+  try:
+    if state is None:
+      response = sim.invoke(ecs_tasks.handle_create, event, context)
+    else:
+      response = sim.invoke(ecs_tasks.handle_poll, dict(event, EventState=state), context)
+  except CfnLambdaExecutionTimeout as e:
+    sim.schedule(sim.clock.time(), run_stack, sim, event, submitted, e.state)
+  else:
+    sim.complete(submitted, response.get('Status', 'SUCCESS'))
+
+# Runs a Step Functions execution of create_task followed by check_task every NextPoll seconds until complete
+def run_execution(sim, event, submitted):
+  import create_task, check_task
+  handler = check_task.handler if 'CreateTimestamp' in event else create_task.handler
+  event = sim.invoke(handler, event, None)
+  if event['Status'] in ['STOPPED', 'FAILED']:
+    sim.complete(submitted, 'SUCCESS' if event['Status'] == 'STOPPED' else 'FAILED')
+  else:
+    sim.schedule(sim.clock.time() + event['NextPoll'], run_execution, sim, event, submitted)
+
+# Runs create_task for an execution, leaving its task set to be checked by the supervisor
+def run_supervised(sim, event, submitted, task_sets):
+  import create_task
+  event = sim.invoke(create_task.handler, event, None)
+  if event['Status'] in ['STOPPED', 'FAILED']:
+    sim.complete(submitted, 'SUCCESS' if event['Status'] == 'STOPPED' else 'FAILED')
+  else:
+    task_sets.append((event, submitted))
+
+# Checks all task sets with one supervisor invocation every interval, until all executions complete
+def run_supervisor(sim, task_sets, interval):
+  import check_task
+  if task_sets:
+    result = sim.invoke(check_task.supervise, {'TaskSets': [s for s, _ in task_sets]}, None)
+    tracked = []
+    for task_set, (_, submitted) in zip(result['TaskSets'], task_sets):
+      if task_set['Status'] in ['STOPPED', 'FAILED']:
+        sim.complete(submitted, 'SUCCESS' if task_set['Status'] == 'STOPPED' else 'FAILED')
+      else:
+        tracked.append((task_set, submitted))
+    task_sets[:] = tracked
+  if task_sets or sim.queue:
+    sim.schedule(sim.clock.time() + interval, run_supervisor, sim, task_sets, interval)
+
+def simulate(name, runs, start, args, supervisor=None):
+  import ecs_tasks, create_task, check_task
+  clock = VirtualClock()
+  ecs = SimulatedEcs(clock, capacity=args.capacity, failure_rate=args.failure_rate, latency=args.latency, throttle_rate=args.throttle_rate, seed=args.seed)
+  cfn = SimulatedCloudFormation(clock, latency=args.latency, throttle_rate=args.throttle_rate, seed=args.seed)
+  for module in [ecs_tasks, create_task, check_task]:
+    module.task_mgr.client = ecs
+  ecs_tasks.cfn_mgr.client = cfn
+  sim = Simulation(clock)
+  for index in range(runs):
+    submitted = clock.time() + ecs.random.uniform(0, args.arrival)
+    sim.schedule(submitted, start, sim, index, submitted)
+  if supervisor is not None:
+    sim.schedule(clock.time(), run_supervisor, sim, supervisor, 10)
+  with mock.patch('time.time', clock.time), mock.patch('time.sleep', clock.sleep), \
+    mock.patch.object(create_task, 'datetime', virtual_datetime(clock)), mock.patch.object(check_task, 'datetime', virtual_datetime(clock)):
+    elapsed = timeit.default_timer()
+    sim.run()
+    elapsed = timeit.default_timer() - elapsed
+  latencies = sorted(sim.latencies) or [0]
+  percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+  print('%-12s runs=%-5d invocations=%-6d lambda-seconds=%-9.0f latency p50=%.0fs p95=%.0fs max=%.0fs results=%s real=%.2fs' % (
+    name, runs, sim.invocations, sim.seconds, percentile(0.5), percentile(0.95), latencies[-1], dict(sim.results), elapsed))
+  calls = ecs.calls + cfn.calls
+  print('%-12s requests=%d %s throttled=%d' % ('', sum(calls.values()), ' '.join('%s=%d' % c for c in sorted(calls.items())), sum((ecs.throttles + cfn.throttles).values())))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Handler load test against simulated ECS and CloudFormation backends')
+  parser.add_argument('--stacks', type=int, default=200)
+  parser.add_argument('--executions', type=int, default=200)
+  parser.add_argument('--count', type=int, default=1)
+  parser.add_argument('--capacity', type=int, default=None)
+  parser.add_argument('--latency', type=float, default=0.05)
+  parser.add_argument('--throttle-rate', type=float, default=0.02)
+  parser.add_argument('--failure-rate', type=float, default=0.0)
+  parser.add_argument('--arrival', type=float, default=60)
+  parser.add_argument('--poll-strategy', default='Fixed', choices=['Fixed', 'Exponential', 'Status'])
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+  os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+  logging.disable(logging.CRITICAL)
+  stack = lambda sim, index, submitted: run_stack(sim, stack_event(index, sim.clock, args), submitted)
+  execution = lambda sim, index, submitted: run_execution(sim, {
+    'Cluster': 'cluster', 'TaskDefinition': 'migrate', 'Count': args.count, 'PollStrategy': args.poll_strategy
+  }, submitted)
+  simulate('ecs_tasks', args.stacks, stack, args)
+  simulate('check_task', args.executions, execution, args)
+  task_sets = []
+  supervised = lambda sim, index, submitted: run_supervised(sim, {
+    'Cluster': 'cluster', 'TaskDefinition': 'migrate', 'Count': args.count, 'PollStrategy': args.poll_strategy
+  }, submitted, task_sets)
+  simulate('supervise', args.executions, supervised, args, task_sets)
@@ -0,0 +1,45 @@
+'''
+Benchmarks the overhead of metrics instrumentation on client calls.
+
+Compares calling a stub client directly, through instrument() with metrics disabled and with metrics enabled,
+including flushing the buffered metrics as Embedded Metric Format log lines.
+
+Usage: python benchmarks/bench_metrics.py [iterations]
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib import clients, metrics
+
+RESPONSE = {'tasks': [], 'failures': [], 'ResponseMetadata': {'RetryAttempts': 0, 'HTTPHeaders': {'content-length': '512'}}}
+
+class StubClient(object):
+  def describe_tasks(self, **kwargs):
+    return RESPONSE
+
+class NullStream(object):
+  def write(self, data):
+    pass
+
+  def flush(self):
+    pass
+
+def run(name, client, recorder, iterations):
+  def calls():
+    for _ in range(iterations):
+      client.describe_tasks(cluster='cluster', tasks=[])
+    recorder.flush()
+  elapsed = min(timeit.repeat(calls, number=1, repeat=3))
+  print('%-10s %8.2fus per call' % (name, elapsed / iterations * 1e6))
+
+if __name__ == '__main__':
+  iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  client = StubClient()
+  recorder = metrics.Metrics('EcsTasks', NullStream())
+  run('direct', client, metrics.NullMetrics(), iterations)
+  metrics.metrics = metrics.NullMetrics()
+  run('disabled', clients.instrument(client), metrics.NullMetrics(), iterations)
+  metrics.metrics = recorder
+  run('enabled', clients.instrument(client), recorder, iterations)
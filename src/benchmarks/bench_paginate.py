@@ -0,0 +1,61 @@
+'''
+Benchmarks paginated_response and the paginate generator over a synthetic paginated operation.
+
+Compares the previous recursive implementation, the iterative list and an early stop with max_items.
+
+Usage: python benchmarks/bench_paginate.py [items] [page_size] [iterations]
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.utils import paginate, paginated_response
+
+class StubOperation:
+  """Paginated operation returning synthetic task ARNs"""
+  def __init__(self, items, page_size):
+    self.items = ['arn:aws:ecs:us-west-2:123456789012:task/%06d' % i for i in range(items)]
+    self.page_size = page_size
+    self.calls = 0
+
+  def __call__(self, NextToken=None):
+    self.calls += 1
+    start = int(NextToken or 0)
+    end = start + self.page_size
+    response = {'taskArns': self.items[start:end]}
+    if end < len(self.items):
+      response['NextToken'] = str(end)
+    return response
+
+# Previous implementation that concatenates each page onto the result of a recursive call
+def recursive_response(func, result_key, next_token=None):
+  args=dict()
+  if next_token:
+      args['NextToken'] = next_token
+  response = func(**args)
+  result = response.get(result_key)
+  next_token = response.get('NextToken')
+  if not next_token:
+    return result
+  return result + recursive_response(func, result_key, next_token)
+
+def run(name, func, operation, iterations):
+  operation.calls = 0
+  try:
+    elapsed = min(timeit.repeat(lambda: func(operation), number=iterations, repeat=3))
+  except RuntimeError as e:
+    print('%-10s failed: %s' % (name, e))
+    return
+  print('%-10s %8.2fms per call  pages=%d' % (name, elapsed / iterations * 1000, operation.calls // (iterations * 3)))
+
+if __name__ == '__main__':
+  items = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+  iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+  operation = StubOperation(items, page_size)
+  print('%d items in pages of %d' % (items, page_size))
+  run('recursive', lambda o: recursive_response(o, 'taskArns'), operation, iterations)
+  run('iterative', lambda o: paginated_response(o, 'taskArns'), operation, iterations)
+  run('first', lambda o: next(paginate(o, 'taskArns')), operation, iterations)
+  run('max_items', lambda o: list(paginate(o, 'taskArns', max_items=250)), operation, iterations)
@@ -0,0 +1,89 @@
+'''
+Benchmarks the size and JSON round trip cost of the task state returned by create_task and check_task.
+
+Compares the full DescribeTasks output with the compact task state for tasks with ENI attachments.
+
+Usage: python benchmarks/bench_payload.py [containers] [iterations]
+'''
+import os
+import sys
+import json
+import timeit
+import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.ecs import compact_task
+
+# Maximum Step Functions state payload size
+PAYLOAD_LIMIT = 256 * 1024
+
+ARN = 'arn:aws:ecs:us-west-2:123456789012:%s/my-stack-ApplicationCluster/%032x'
+
+# Returns a stopped Fargate task as described by DescribeTasks
+def build_task(index, containers):
+  now = datetime.datetime.utcnow()
+  task_arn = ARN % ('task', index)
+  return {
+    'taskArn': task_arn,
+    'clusterArn': 'arn:aws:ecs:us-west-2:123456789012:cluster/my-stack-ApplicationCluster',
+    'taskDefinitionArn': 'arn:aws:ecs:us-west-2:123456789012:task-definition/my-stack-AdhocTaskDefinition:1',
+    'group': 'family:my-stack-AdhocTaskDefinition',
+    'launchType': 'FARGATE',
+    'platformVersion': '1.4.0',
+    'cpu': '256',
+    'memory': '512',
+    'lastStatus': 'STOPPED',
+    'desiredStatus': 'STOPPED',
+    'stopCode': 'EssentialContainerExited',
+    'stoppedReason': 'Essential container in task exited',
+    'createdAt': now,
+    'startedAt': now,
+    'stoppingAt': now,
+    'stoppedAt': now,
+    'version': 5,
+    'overrides': {'containerOverrides': [{'name': 'app-%d' % c, 'command': ['manage.py', 'migrate']} for c in range(containers)]},
+    'attachments': [{
+      'id': '%032x' % index,
+      'type': 'ElasticNetworkInterface',
+      'status': 'DELETED',
+      'details': [
+        {'name': 'subnetId', 'value': 'subnet-0123456789abcdef0'},
+        {'name': 'networkInterfaceId', 'value': 'eni-0123456789abcdef0'},
+        {'name': 'macAddress', 'value': '0a:1b:2c:3d:4e:5f'},
+        {'name': 'privateDnsName', 'value': 'ip-10-0-1-23.us-west-2.compute.internal'},
+        {'name': 'privateIPv4Address', 'value': '10.0.1.23'}
+      ]
+    }],
+    'containers': [{
+      'containerArn': ARN % ('container', index * 100 + c),
+      'taskArn': task_arn,
+      'name': 'app-%d' % c,
+      'image': '123456789012.dkr.ecr.us-west-2.amazonaws.com/org/my-app:latest',
+      'imageDigest': 'sha256:%064x' % c,
+      'runtimeId': '%032x-%d' % (index, c),
+      'lastStatus': 'STOPPED',
+      'exitCode': 0,
+      'networkBindings': [],
+      'networkInterfaces': [{'attachmentId': '%032x' % index, 'privateIpv4Address': '10.0.1.23'}],
+      'healthStatus': 'UNKNOWN',
+      'cpu': '0',
+      'memoryReservation': '100'
+    } for c in range(containers)]
+  }
+
+def default(value):
+  return value.isoformat() if isinstance(value, datetime.datetime) else str(value)
+
+def run(name, tasks, iterations):
+  payload = json.dumps({'Tasks': tasks}, default=default)
+  elapsed = min(timeit.repeat(lambda: json.loads(json.dumps({'Tasks': tasks}, default=default)), number=iterations, repeat=3))
+  print('%-8s tasks=%-4d size=%8d bytes%s  round trip=%7.2fms' % (
+    name, len(tasks), len(payload), ' (exceeds 256KB)' if len(payload) > PAYLOAD_LIMIT else '', elapsed / iterations * 1000))
+
+if __name__ == '__main__':
+  containers = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+  iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+  for count in [10, 100]:
+    tasks = [build_task(i, containers) for i in range(count)]
+    run('full', tasks, iterations)
+    run('compact', [compact_task(t) for t in tasks], iterations)
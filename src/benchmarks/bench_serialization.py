@@ -0,0 +1,36 @@
+'''
+Benchmarks serialization of large DescribeTasks payloads.
+
+Compares the previous JSON round trip in ecs_error_handler with the single pass normalize, the JSON backends
+available and eager versus deferred formatting of log lines that are not emitted.
+
+Usage: python benchmarks/bench_serialization.py [tasks] [containers] [iterations]
+'''
+import os
+import sys
+import json
+import timeit
+import logging
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_payload import build_task
+from lib import serialization
+
+def run(name, func, iterations):
+  elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+  print('%-14s %8.2fms' % (name, elapsed / iterations * 1000))
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+  containers = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+  iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+  event = {'Tasks': [build_task(i, containers) for i in range(count)]}
+  log = logging.getLogger('bench_serialization')
+  log.setLevel(logging.WARNING)
+  print('%d tasks with %d containers (%d bytes), %s backend' % (count, containers, len(serialization.dumps(event)), serialization.get_backend()[0]))
+  run('round trip', lambda: json.loads(json.dumps(event, default=serialization.default)), iterations)
+  run('normalize', lambda: serialization.normalize(event), iterations)
+  run('json dumps', lambda: json.dumps(event, default=serialization.default), iterations)
+  run('dumps', lambda: serialization.dumps(event), iterations)
+  run('eager log', lambda: log.info('Task result: %s' % serialization.dumps(event)), iterations)
+  run('deferred log', lambda: log.info('Task result: %s', serialization.JsonFormatter(event)), iterations)
@@ -0,0 +1,42 @@
+'''
+Benchmarks validation of check_task events with large Overrides payloads.
+
+Compares building the schema on every event, the compiled validator and the fast path for stamped events.
+
+Usage: python benchmarks/bench_validation.py [containers] [environment] [iterations]
+'''
+import os
+import sys
+import copy
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib import validation
+
+def build_event(containers, environment):
+  return {
+    'Cluster': 'my-stack-ApplicationCluster',
+    'TaskDefinition': 'my-stack-AdhocTaskDefinition',
+    'Count': 10,
+    'Overrides': {
+      'containerOverrides': [{
+        'name': 'app-%d' % c,
+        'command': ['manage.py', 'migrate', '--shard', str(c)],
+        'environment': [{'name': 'VAR_%d' % e, 'value': 'value-%d' % e} for e in range(environment)]
+      } for c in range(containers)]
+    }
+  }
+
+def run(name, func, event, iterations):
+  elapsed = min(timeit.repeat(lambda: func(copy.copy(event)), number=iterations, repeat=3))
+  print('%-10s %8.1fus per event' % (name, elapsed / iterations * 1e6))
+
+if __name__ == '__main__':
+  containers = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  environment = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+  iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+  event = build_event(containers, environment)
+  print('Overrides with %d containers and %d environment variables each' % (containers, environment))
+  run('rebuild', lambda e: validation.get_ecs_validator()(e), event, iterations)
+  run('compiled', lambda e: validation.get_validator('ecs')(e), event, iterations)
+  run('stamped', validation.validate_ecs, validation.validate_ecs(copy.deepcopy(event)), iterations)
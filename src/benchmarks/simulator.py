@@ -0,0 +1,157 @@
+'''
+Simulated ECS and CloudFormation backends for offline load testing.
+
+Tasks move from PENDING to RUNNING to STOPPED over virtual time, with the state of each task derived from the time it is
+described.  Requests add a configurable latency to the virtual clock and are throttled at a configurable rate, with
+throttled requests retried within the client as botocore does and reported in the RetryAttempts response metadata.
+RunTask launches at most the remaining cluster capacity, reporting the remaining tasks as RESOURCE:CPU failures.
+'''
+import random
+import threading
+from datetime import datetime
+from collections import Counter
+from botocore.exceptions import ClientError
+
+class VirtualClock(object):
+  """Virtual time that advances when slept on, rather than with wall clock time"""
+  def __init__(self, now=1500000000.0):
+    self.now = now
+    self.lock = threading.Lock()
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    with self.lock:
+      self.now += seconds
+
+  def utcnow(self):
+    return datetime.utcfromtimestamp(self.now)
+
+class SimulatedBackend(object):
+  """Counts requests, applying latency and throttling to each request"""
+  def __init__(self, clock, latency=0.05, throttle_rate=0.0, max_attempts=10, seed=None):
+    self.clock = clock
+    self.latency = latency
+    self.throttle_rate = throttle_rate
+    self.max_attempts = max_attempts
+    self.random = random.Random(seed)
+    self.calls = Counter()
+    self.throttles = Counter()
+    self.lock = threading.Lock()
+
+  def request(self, operation, func, *args):
+    with self.lock:
+      self.calls[operation] += 1
+      attempts = 0
+      while self.random.random() < self.throttle_rate:
+        self.throttles[operation] += 1
+        attempts += 1
+        if attempts == self.max_attempts:
+          break
+    self.clock.sleep(self.latency * (attempts + 1))
+    if attempts == self.max_attempts:
+      raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, operation)
+    with self.lock:
+      response = func(*args)
+    response['ResponseMetadata'] = {'RetryAttempts': attempts}
+    return response
+
+class SimulatedEcs(SimulatedBackend):
+  """ECS stand-in running tasks with random PENDING and RUNNING durations on a cluster with limited capacity"""
+  def __init__(self, clock, capacity=None, pending=(5, 15), running=(30, 120), failure_rate=0.0, **kwargs):
+    super(SimulatedEcs, self).__init__(clock, **kwargs)
+    self.capacity = capacity
+    self.pending = pending
+    self.running = running
+    self.failure_rate = failure_rate
+    self.tasks = dict()
+
+  # Returns the number of tasks of a cluster that have launched and not yet stopped
+  def active(self, cluster, now):
+    return sum(1 for t in self.tasks.values() if t['cluster'] == cluster and t['launched'] <= now < t['stopped'])
+
+  def launch(self, cluster, task_definition, overrides, started_by):
+    now = self.clock.time()
+    started = now + self.random.uniform(*self.pending)
+    arn = 'arn:aws:ecs:us-west-2:123456789012:task/%s/%032x' % (cluster, self.random.getrandbits(128))
+    self.tasks[arn] = {
+      'arn': arn,
+      'cluster': cluster,
+      'taskDefinition': task_definition,
+      'overrides': overrides,
+      'startedBy': started_by,
+      'launched': now,
+      'started': started,
+      'stopped': started + self.random.uniform(*self.running),
+      'exitCode': 1 if self.random.random() < self.failure_rate else 0,
+      'stopRequested': None
+    }
+    return self.describe(self.tasks[arn], now)
+
+  # Describes a task as of a given virtual time
+  def describe(self, task, now):
+    stopped = min(task['stopped'], task['stopRequested'] or task['stopped'])
+    status = 'STOPPED' if now >= stopped else 'RUNNING' if now >= task['started'] else 'PENDING'
+    container = {'name': 'app', 'lastStatus': status}
+    result = {
+      'taskArn': task['arn'],
+      'clusterArn': task['cluster'],
+      'taskDefinitionArn': task['taskDefinition'],
+      'overrides': task['overrides'],
+      'startedBy': task['startedBy'],
+      'lastStatus': status,
+      'desiredStatus': 'STOPPED' if status == 'STOPPED' or task['stopRequested'] else 'RUNNING',
+      'createdAt': datetime.utcfromtimestamp(task['launched']),
+      'containers': [container]
+    }
+    if status != 'PENDING':
+      result['startedAt'] = datetime.utcfromtimestamp(task['started'])
+    if status == 'STOPPED':
+      result['stoppedAt'] = datetime.utcfromtimestamp(stopped)
+      result['stopCode'] = 'UserInitiated' if task['stopRequested'] else 'EssentialContainerExited'
+      container['exitCode'] = task['exitCode']
+    return result
+
+  def run_task(self, cluster, taskDefinition, overrides=None, startedBy=None, count=1, **kwargs):
+    def run():
+      available = count if self.capacity is None else max(0, self.capacity - self.active(cluster, self.clock.time()))
+      tasks = [self.launch(cluster, taskDefinition, overrides, startedBy) for _ in range(min(count, available))]
+      failures = [{'reason': 'RESOURCE:CPU'} for _ in range(count - len(tasks))]
+      return {'tasks': tasks, 'failures': failures}
+    return self.request('RunTask', run)
+
+  def describe_tasks(self, cluster, tasks):
+    def describe():
+      now = self.clock.time()
+      found = [self.tasks[t] for t in tasks if t in self.tasks]
+      return {
+        'tasks': [self.describe(t, now) for t in found],
+        'failures': [{'arn': t, 'reason': 'MISSING'} for t in tasks if t not in self.tasks]
+      }
+    return self.request('DescribeTasks', describe)
+
+  def describe_task_definition(self, taskDefinition):
+    return self.request('DescribeTaskDefinition', lambda: {'taskDefinition': {
+      'taskDefinitionArn': taskDefinition,
+      'containerDefinitions': [{'name': 'app', 'cpu': 256, 'memory': 512, 'environment': []}]
+    }})
+
+  def list_tasks(self, cluster, startedBy=None, nextToken=None, **kwargs):
+    def list_tasks():
+      now = self.clock.time()
+      return {'taskArns': [t['arn'] for t in self.tasks.values()
+        if t['cluster'] == cluster and t['startedBy'] == startedBy and self.describe(t, now)['lastStatus'] != 'STOPPED']}
+    return self.request('ListTasks', list_tasks)
+
+  def stop_task(self, cluster, task, reason=None):
+    def stop():
+      now = self.clock.time()
+      self.tasks[task]['stopRequested'] = self.tasks[task]['stopRequested'] or now
+      return {'task': self.describe(self.tasks[task], now)}
+    return self.request('StopTask', stop)
+
+class SimulatedCloudFormation(SimulatedBackend):
+  """CloudFormation stand-in reporting every stack as in progress"""
+  def describe_stacks(self, StackName, NextToken=None):
+    return self.request('DescribeStacks', lambda: {'Stacks': [{'StackId': StackName, 'StackName': StackName, 'StackStatus': 'CREATE_IN_PROGRESS'}]})
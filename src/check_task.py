@@ -1,14 +1,22 @@
-import datetime
 import logging
 import sys, os
 parent_dir = os.path.abspath(os.path.dirname(__file__))
 vendor_dir = os.path.join(parent_dir, 'vendor')
 sys.path.append(vendor_dir)
 
-from dateutil.parser import parse
-from lib import EcsTaskManager, EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError
+import time
+from datetime import datetime, timedelta
+from lib import EcsTaskManager, EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError, merge_retries, task_state
 from lib import validate_ecs
-from lib import ecs_error_handler
+from lib import poll_interval, next_attempt
+from lib import ecs_error_handler, ecs_failure_reason, add_outcomes
+from lib import normalize, loads
+from lib import parse_timestamp, concurrent_map
+from lib import get_metrics
+from lib import get_run_store
+from lib import LogsManager, add_streams
+from lib import task_outcomes, failed_outcomes
+from lib import TaskSetQueue
 
 # Configure logging
 logging.basicConfig()
@@ -17,35 +25,193 @@ log.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
 # ECS Task Manager
 task_mgr = EcsTaskManager()
+run_store = get_run_store()
+logs_mgr = LogsManager()
+task_set_queue = TaskSetQueue()
+
+# Poll metrics, which are discarded unless METRICS_ENABLED is set
+metrics = get_metrics()
 
 # Checks if timeout has exceeded
-def check_timeout(event):
-  now = parse(datetime.datetime.utcnow().isoformat() + 'Z')
-  creation = parse(event['CreateTimestamp'])
-  if now > creation + datetime.timedelta(seconds=event['Timeout']):
-    raise EcsTaskTimeoutError(event['Tasks'], creation, event['Timeout'])
-
-# Checks ECS task exit codes
-def check_exit_codes(tasks):
-  non_zero = [c.get('taskArn') for t in tasks for c in t.get('containers') if c.get('exitCode') != 0]
-  if non_zero:
-    raise EcsTaskExitCodeError(tasks, non_zero)
+def check_timeout(event, tasks):
+  creation = parse_timestamp(event['CreateTimestamp'])
+  if datetime.utcnow() > creation + timedelta(seconds=event['Timeout']):
+    raise EcsTaskTimeoutError(tasks, creation, event['Timeout'])
 
-@ecs_error_handler
-def handler(event, context):
-  log.info('Received event %s' % str(event))
-  # Validate event and create task
+# Classifies the outcome of stopped ECS tasks, failing if any task did not succeed with the last log lines of failed tasks
+# if logs are streamed
+def check_exit_codes(tasks, task_definition=None, streams=None, lines=None):
+  outcomes = task_outcomes(tasks, task_definition)
+  failed = [o['TaskArn'] for o in failed_outcomes(outcomes)]
+  if failed:
+    raise EcsTaskExitCodeError(tasks, failed, logs_mgr.last_lines(streams, failed, lines), outcomes)
+  return outcomes
+
+# Tails the container log streams of the tasks of a task spec, with forward tokens persisted in the task spec
+def tail_logs(event, spec):
+  if event['StreamLogs']:
+    streams = spec.setdefault('LogStreams', [])
+    add_streams(streams, task_mgr.describe_task_definition(spec['TaskDefinition']), spec['Tasks'])
+    logs_mgr.tail_tasks(streams, spec['Tasks'], event['LogLines'])
+
+# Updates a task spec from its described tasks, which is the event itself unless a batch of task specs is given
+def check(event, spec, tasks):
+  spec['Tasks'] = task_state(tasks, event['FullTaskDetail'])
+  # Launch queued tasks that fit the remaining cluster capacity
+  if spec['Queued']:
+    launched = task_mgr.start_admitted_tasks(
+      cluster=event['Cluster'],
+      task_definition=spec['TaskDefinition'],
+      overrides=spec['Overrides'],
+      count=spec['Queued'],
+      started_by=event['StartedBy'],
+      network_configuration=spec['NetworkConfiguration'],
+      launch_type=spec['LaunchType']
+    )
+    spec['Tasks'] += task_state(launched['tasks'], event['FullTaskDetail'])
+    spec['LaunchFailures'] += launched['failures']
+    spec['Queued'] = launched['queued']
+    spec['LaunchRetries'] = merge_retries(spec['LaunchRetries'], launched.get('retries'))
+  tail_logs(event, spec)
+  spec['Status'] = 'QUEUED' if spec['Queued'] else task_mgr.check_status(spec['Tasks'])
+  if spec['Status'] == 'STOPPED':
+    spec['Outcomes'] = check_exit_codes(
+      spec['Tasks'], task_mgr.describe_task_definition(spec['TaskDefinition']), spec.get('LogStreams'), event['LogLines']
+    )
+    if spec['LaunchFailures']:
+      raise EcsTaskFailureError({'tasks': spec['Tasks'], 'failures': spec['LaunchFailures']})
+    # Successful runs of memoized task specs are recorded so that runs with the same inputs are skipped
+    if spec.get('Fingerprint') and not spec.get('Skipped'):
+      run_store.put_run(spec['Fingerprint'], {'TaskArn': spec['Tasks'][0]['taskArn'], 'CompletedAt': int(time.time())})
+
+# Checks a task spec of a batch, recording any failure in the task spec so that other task specs are still tracked
+def check_spec(event, spec, described):
+  spec.setdefault('LaunchType', event['LaunchType'])
+  spec.setdefault('NetworkConfiguration', event['NetworkConfiguration'])
+  try:
+    check(event, spec, [described[t['taskArn']] for t in spec['Tasks'] if t['taskArn'] in described])
+  except Exception as e:
+    spec['Status'] = 'FAILED'
+    spec['Reason'] = ecs_failure_reason(e)
+    add_outcomes(spec, e)
+    log.error("Task spec %s failed: %s" % (spec.get('Name') or spec['TaskDefinition'], spec['Reason']))
+
+# Returns the task specs of an event that are still tracked, which is the event itself unless a batch of task specs is given
+def active_specs(event):
+  specs = event['TaskSpecs']
+  return [s for s in specs if s['Status'] != 'FAILED'] if specs else [event]
+
+# Returns the (cluster, task) pairs described to check an event
+def describe_pairs(event):
+  return [(event['Cluster'], t.get('taskArn')) for s in active_specs(event) for t in s['Tasks']]
+
+# Validates an event and checks its timeout, before its tasks are described
+def prepare(event):
   event = validate_ecs(event)
-  check_timeout(event)
-  # Query task status
-  task_arns = [t.get('taskArn') for t in event['Tasks']]
-  result = task_mgr.describe_tasks(cluster=event['Cluster'], tasks=task_arns)
-  event['Tasks'] = result['tasks']
+  metrics.record('PollIterations', 1)
+  check_timeout(event, [t for s in active_specs(event) for t in s['Tasks']])
+  return event
+
+# Updates a validated event from the DescribeTasks result of its tasks
+def check_event(event, result):
+  specs = event['TaskSpecs']
   event['Failures'] = result['failures']
   if event['Failures']:
     raise EcsTaskFailureError(result)
   # Check if task is complete
-  event['Status'] = task_mgr.check_status(event['Tasks'])
+  previous_status = event['Status']
+  if specs:
+    described = dict((t['taskArn'], t) for t in result['tasks'])
+    concurrent_map(lambda spec: check_spec(event, spec, described), active_specs(event), task_mgr.max_workers)
+    event['Queued'] = sum(s['Queued'] for s in specs)
+    event['LaunchRetries'] = merge_retries(*[s.get('LaunchRetries') for s in specs])
+    event['Status'] = task_mgr.check_batch_status(specs)
+  else:
+    check(event, event, result['tasks'])
+  # Recommend the wait before the next check, for use with a Wait state SecondsPath
+  event['PollAttempt'] = next_attempt(event['PollAttempt'], previous_status, event['Status'])
+  event['NextPoll'] = poll_interval(event['PollStrategy'], event['PollAttempt'], event['Status'], event['Poll'], event['MaxPoll'])
   if event['Status'] == 'STOPPED':
-    check_exit_codes(event['Tasks'])
-  return event
\ No newline at end of file
+    elapsed = datetime.utcnow() - parse_timestamp(event['CreateTimestamp'])
+    metrics.record('TimeToStopped', elapsed.total_seconds(), 'Seconds')
+  # A batch fails once all task specs are complete if any task spec failed
+  failed = [s for s in specs if s['Status'] == 'FAILED']
+  if event['Status'] == 'STOPPED' and failed:
+    raise EcsTaskFailureError({'tasks': [], 'failures': [{'spec': s.get('Name') or s['TaskDefinition'], 'reason': s['Reason']} for s in failed]})
+  return event
+
+@ecs_error_handler
+def handler(event, context):
+  log.info('Received event %s', event)
+  event = prepare(event)
+  # Query task status, with the tasks of all task specs described together
+  return check_event(event, task_mgr.bulk_describe_tasks(describe_pairs(event)))
+
+# Records the failure of a supervised task set, which is returned as is if it could not be validated
+def fail_set(task_set, e):
+  task_set['Status'] = 'FAILED'
+  task_set['Reason'] = ecs_failure_reason(e)
+  add_outcomes(task_set, e)
+  log.error("Task set failed: %s" % task_set['Reason'])
+  return task_set
+
+# Sends a queued task set that has not stopped back to its queue, or delivers the result of a complete task set
+def forward(record, task_set):
+  if task_set['Status'] not in ['STOPPED', 'FAILED']:
+    task_set_queue.requeue(record, task_set)
+  elif task_set_queue.can_deliver(task_set):
+    try:
+      task_set_queue.deliver(task_set)
+    except Exception as e:
+      # Checking the updated task set again delivers its result without launching its tasks again
+      log.error("Failed to deliver task set result: %s" % e)
+      task_set_queue.requeue(record, task_set)
+
+# Entry point that checks a batch of task sets, each of which is a check_task event, with one describe pass
+def supervise(event, context):
+  '''
+  Checks task sets given as a 'TaskSets' list or as queue 'Records' with a JSON body, returning the updated task sets.
+  The tasks of all task sets are described together, grouped per cluster, so requests scale with clusters rather than task sets.
+  Updated task sets received from a queue are sent back to the queue until they stop, and the results of complete task sets
+  are delivered to their TaskToken or the result queue, with only records that could not be forwarded returned as failures.
+  '''
+  records = event.get('Records')
+  task_sets = [loads(r['body']) for r in records] if records is not None else event['TaskSets']
+  log.info('Received %d task sets', len(task_sets))
+  try:
+    prepared = []
+    for task_set in task_sets:
+      try:
+        # Queued task sets whose result cannot be delivered are not started, as their tasks would run unobserved
+        if records is not None and not task_set_queue.can_deliver(task_set):
+          raise ValueError('a queued task set requires a TaskToken or the SUPERVISOR_RESULT_QUEUE_URL environment variable')
+        prepared.append(prepare(task_set))
+      except Exception as e:
+        prepared.append(fail_set(task_set, e))
+    tracked = [s for s in prepared if s['Status'] != 'FAILED']
+    result = task_mgr.bulk_describe_tasks([p for s in tracked for p in describe_pairs(s)])
+    described = dict((t['taskArn'], t) for t in result['tasks'])
+    failures = dict((f.get('arn'), f) for f in result['failures'])
+    def check_set(task_set):
+      arns = [p[1] for p in describe_pairs(task_set)]
+      try:
+        return check_event(task_set, {
+          'tasks': [described[a] for a in arns if a in described],
+          'failures': [failures[a] for a in arns if a in failures]
+        })
+      except Exception as e:
+        return fail_set(task_set, e)
+    checked = dict(zip([id(s) for s in tracked], concurrent_map(check_set, tracked, task_mgr.max_workers)))
+    response = {'TaskSets': [normalize(checked.get(id(s), s)) for s in prepared]}
+    if records is not None:
+      def forward_record(pair):
+        try:
+          forward(*pair)
+        except Exception as e:
+          log.error("Failed to forward task set of message %s: %s" % (pair[0]['messageId'], e))
+          return {'itemIdentifier': pair[0]['messageId']}
+      forwarded = concurrent_map(forward_record, zip(records, response['TaskSets']), task_mgr.max_workers)
+      response['batchItemFailures'] = [f for f in forwarded if f]
+    return response
+  finally:
+    metrics.flush()
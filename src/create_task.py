@@ -5,9 +5,12 @@ vendor_dir = os.path.join(parent_dir, 'vendor')
 sys.path.append(vendor_dir)
 
 from datetime import datetime
-from lib import EcsTaskManager, EcsTaskFailureError
+from lib import EcsTaskManager, EcsTaskFailureError, merge_retries, task_state
 from lib import validate_ecs
-from lib import ecs_error_handler
+from lib import poll_interval
+from lib import ecs_error_handler, ecs_failure_reason
+from lib import concurrent_map
+from lib import ImageResolver, get_run_store, run_inputs, fingerprint
 
 # Configure logging
 logging.basicConfig()
@@ -16,26 +19,81 @@ log.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
 # ECS Task Manager
 task_mgr = EcsTaskManager()
+run_store = get_run_store()
+image_resolver = ImageResolver()
+
+# Starts the tasks of a task spec, which is the event itself unless a batch of task specs is given
+def start(event, spec):
+  # Memoized task specs are skipped if a previous run with the same inputs succeeded
+  if event['Memoize']:
+    task_definition = task_mgr.describe_task_definition(spec['TaskDefinition'])
+    spec['Fingerprint'] = fingerprint(run_inputs(task_definition, spec['Overrides'], spec['Count'], image_resolver.digests(task_definition)))
+    run = run_store.get_run(spec['Fingerprint'])
+    if run:
+      log.info("Skipping task with unchanged inputs that previously succeeded as %s" % run['TaskArn'])
+      spec.update(Tasks=[], Failures=[], LaunchFailures=[], LaunchRetries=merge_retries(), Queued=0, Skipped=True, Status='STOPPED')
+      return
+  if event['AdmissionMode'] == 'Capacity' and not spec['Instances']:
+    result = task_mgr.start_admitted_tasks(
+      cluster=event['Cluster'],
+      task_definition=spec['TaskDefinition'],
+      overrides=spec['Overrides'],
+      count=spec['Count'],
+      started_by=event['StartedBy'],
+      network_configuration=spec['NetworkConfiguration'],
+      launch_type=spec['LaunchType']
+    )
+  else:
+    result = task_mgr.start_task(
+      cluster=event['Cluster'],
+      task_definition=spec['TaskDefinition'],
+      overrides=spec['Overrides'],
+      count=spec['Count'],
+      started_by=event['StartedBy'],
+      network_configuration=spec['NetworkConfiguration'],
+      launch_type=spec['LaunchType'],
+      instances=spec['Instances']
+    )
+  spec['Tasks'] = task_state(result['tasks'], event['FullTaskDetail'])
+  spec['Failures'] = result['failures']
+  spec['LaunchRetries'] = merge_retries(result.get('retries'))
+  # Queued tasks are launched by check_task as capacity becomes available
+  spec['Queued'] = result.get('queued', 0)
+  if not spec['Tasks'] and not spec['Queued']:
+    raise EcsTaskFailureError(result)
+  # Tasks that did start are tracked by check_task, which fails once they stop
+  spec['LaunchFailures'] = result['failures']
+  spec['Status'] = 'QUEUED' if spec['Queued'] else task_mgr.check_status(spec['Tasks'])
+
+# Starts a task spec of a batch, recording any failure in the task spec so that other task specs are still run
+def start_spec(event, spec):
+  spec.setdefault('LaunchType', event['LaunchType'])
+  spec.setdefault('NetworkConfiguration', event['NetworkConfiguration'])
+  try:
+    start(event, spec)
+  except Exception as e:
+    spec['Status'] = 'FAILED'
+    spec['Reason'] = ecs_failure_reason(e)
+    log.error("Task spec %s failed: %s" % (spec.get('Name') or spec['TaskDefinition'], spec['Reason']))
 
 @ecs_error_handler
 def handler(event, context):
-  log.info('Received event %s' % str(event))
+  log.info('Received event %s', event)
   # Validate event
   event = validate_ecs(event)
   event['CreateTimestamp'] = datetime.utcnow().isoformat() + 'Z'
-  # Start task
-  result = task_mgr.start_task(
-    cluster=event['Cluster'],
-    task_definition=event['TaskDefinition'],
-    overrides=event['Overrides'],
-    count=event['Count'],
-    started_by=event['StartedBy'],
-    network_configuration=event['NetworkConfiguration'],
-    launch_type=event['LaunchType']
-  )
-  event['Tasks'] = result['tasks']
-  event['Failures'] = result['failures']
-  if event['Failures']:
-    raise EcsTaskFailureError(result)
-  event['Status'] = task_mgr.check_status(event['Tasks'])
-  return event
\ No newline at end of file
+  # Start tasks, with the task specs of a batch started concurrently
+  specs = event['TaskSpecs']
+  if specs:
+    concurrent_map(lambda spec: start_spec(event, spec), specs, task_mgr.max_workers)
+    failed = [s for s in specs if s['Status'] == 'FAILED']
+    if len(failed) == len(specs):
+      raise EcsTaskFailureError({'tasks': [], 'failures': [{'spec': s.get('Name') or s['TaskDefinition'], 'reason': s['Reason']} for s in failed]})
+    event['Queued'] = sum(s['Queued'] for s in specs)
+    event['LaunchRetries'] = merge_retries(*[s.get('LaunchRetries') for s in specs])
+    event['Status'] = task_mgr.check_batch_status(specs)
+  else:
+    start(event, event)
+  event['PollAttempt'] = 0
+  event['NextPoll'] = poll_interval(event['PollStrategy'], event['PollAttempt'], event['Status'], event['Poll'], event['MaxPoll'])
+  return event
@@ -4,21 +4,27 @@ vendor_dir = os.path.join(parent_dir, 'vendor')
 sys.path.append(vendor_dir)
 
 import time
+import copy
 import logging
-import json
-from datetime import datetime
-from cfn_lambda_handler import Handler, CfnLambdaExecutionTimeout
 from hashlib import md5
-from lib import CfnManager
-from lib import EcsTaskManager, EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError
+from lib import CfnManager, CfnResponseDeferred, send_response, deferrable_cfn_handler
+from lib import TaskStateManager
+from lib import ImageResolver, get_run_store, run_inputs, fingerprint
+from lib import LogsManager, add_streams
+from lib import task_outcomes, failed_outcomes
+from lib import poll_interval, next_attempt
+from lib import EcsTaskManager, EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError, task_state
 from lib import validate_cfn
 from lib import cfn_error_handler
+from lib import JsonFormatter
+from lib import concurrent_map
+from lib import get_metrics
 
 # Stack rollback states
 ROLLBACK_STATES = ['ROLLBACK_IN_PROGRESS','UPDATE_ROLLBACK_IN_PROGRESS']
 
-# Set handler as the entry point for Lambda
-handler = Handler()
+# Request attributes persisted for deferred CloudFormation responses
+RESPONSE_KEYS = ['StackId','RequestId','LogicalResourceId','PhysicalResourceId','ResponseURL','RequestType']
 
 # Configure logging
 logging.basicConfig()
@@ -28,22 +34,38 @@ log.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 # AWS services
 task_mgr = EcsTaskManager()
 cfn_mgr = CfnManager()
+state_mgr = TaskStateManager()
+run_store = get_run_store()
+image_resolver = ImageResolver()
+logs_mgr = LogsManager()
+
+# Poll metrics, which are discarded unless METRICS_ENABLED is set
+metrics = get_metrics()
+
+# CloudFormation request handler, built on first use
+request_handler = None
+
+# Returns the compact task state of an ECS response, which keeps the request state persisted across re-invocations
+# and deferred responses well within the async invoke and DynamoDB item size limits
+def compact_result(result):
+  return {'tasks': task_state(result['tasks']), 'failures': result['failures']}
 
 # Starts an ECS task
 def start(task):
-  return task_mgr.start_task(
+  return compact_result(task_mgr.start_task(
     cluster=task['Cluster'],
     task_definition=task['TaskDefinition'],
     overrides=task['Overrides'],
     count=task['Count'],
     started_by=task['StartedBy'],
     network_configuration=task['NetworkConfiguration'],
-    launch_type=task['LaunchType']
-  )
+    launch_type=task['LaunchType'],
+    instances=task['Instances']
+  ))
 
-# Outputs JSON
+# Outputs JSON when logged
 def format_json(data):
-  return json.dumps(data, default=lambda d: d.isoformat() if isinstance(d, datetime) else str(d))
+  return JsonFormatter(data)
 
 # Transforms a list of dicts into a keyed dictionary
 def to_dict(items, key, value):
@@ -55,6 +77,10 @@ def get_task_id(stack_id, resource_id):
   m.update(stack_id + resource_id)
   return m.hexdigest()
 
+# Returns the task definitions run by a task, which are those of its task graph if specified
+def task_definitions(task):
+  return [t['TaskDefinition'] for t in task['TaskGraph']] or [task['TaskDefinition']]
+
 # Gets ECS task definition and returns environment variable values for a given set of update criteria
 def get_task_definition_values(task_definition_arn, update_criteria):
   task_definition = task_mgr.describe_task_definition(task_definition_arn)
@@ -64,8 +90,7 @@ def get_task_definition_values(task_definition_arn, update_criteria):
 # Updates ECS task status
 def describe_tasks(cluster, task_result):
   tasks = task_result['tasks']
-  task_arns = [t.get('taskArn') for t in tasks]
-  return task_mgr.describe_tasks(cluster=cluster, tasks=task_arns)
+  return compact_result(task_mgr.bulk_describe_tasks([(cluster, t.get('taskArn')) for t in tasks]))
 
 # Checks ECS task completion
 def check_complete(task_result):
@@ -74,40 +99,206 @@ def check_complete(task_result):
   tasks = task_result.get('tasks')
   return all(t.get('lastStatus') == 'STOPPED' for t in tasks)
 
-# Checks ECS task exit codes
-def check_exit_codes(task_result):
+# Classifies the outcome of stopped ECS tasks of a task definition, failing if any task did not succeed with the last
+# log lines of failed tasks if logs are streamed
+def check_exit_codes(task_result, task_definition, streams=None, lines=None):
   tasks = task_result['tasks']
-  non_zero = [c.get('taskArn') for t in tasks for c in t.get('containers') if c.get('exitCode') != 0]
-  if non_zero:
-    raise EcsTaskExitCodeError(tasks, non_zero)
+  outcomes = task_outcomes(tasks, task_mgr.describe_task_definition(task_definition)) if tasks else []
+  failed = [o['TaskArn'] for o in failed_outcomes(outcomes)]
+  if failed:
+    raise EcsTaskExitCodeError(tasks, failed, logs_mgr.last_lines(streams, failed, lines), outcomes)
+  return outcomes
+
+# Tails the container log streams of the tasks of a task, or of each started task graph entry, if logs are streamed
+def tail_logs(task):
+  if not task.get('StreamLogs'):
+    return
+  streams = task.setdefault('LogStreams', [])
+  entries = [t for t in task['TaskGraph'] if t.get('TaskResult')] if task['TaskGraph'] else [task]
+  for entry in entries:
+    add_streams(streams, task_mgr.describe_task_definition(entry['TaskDefinition']), entry['TaskResult']['tasks'])
+  logs_mgr.tail_tasks(streams, [t for e in entries for t in e['TaskResult']['tasks']], task['LogLines'])
+
+# Checks ECS task absolute timeout
+def check_timeout(task):
+  if task['CreationTime'] + task['Timeout'] < int(time.time()):
+    raise EcsTaskTimeoutError(task['TaskResult']['tasks'], task['CreationTime'], task['Timeout'])
+
+# Gets the number of seconds to wait before the next poll using the task poll strategy
+def next_poll_interval(task):
+  status = task_mgr.check_status(task['TaskResult']['tasks'])
+  task['PollAttempt'] = next_attempt(task.get('PollAttempt', -1), task.get('PollStatus'), status)
+  task['PollStatus'] = status
+  return poll_interval(
+    task.get('PollStrategy') or 'Fixed',
+    task['PollAttempt'],
+    status,
+    task.get('PollInterval') or 10,
+    task.get('MaxPollInterval') or 60
+  )
+
+# Records the time from creation of a task until all of its tasks have stopped
+def record_stopped(task):
+  metrics.record('TimeToStopped', int(time.time()) - task['CreationTime'], 'Seconds')
 
 # Polls an ECS task for completion 
 def poll(task, remaining_time):
-  poll_interval = task.get('PollInterval') or 10
   while True:
+    metrics.record('PollIterations', 1)
     task_result = task['TaskResult']
-    if task['CreationTime'] + task['Timeout'] < int(time.time()):
-      raise EcsTaskTimeoutError(task['TaskResult']['tasks'], task['CreationTime'], task['Timeout'])
-    if remaining_time() < (poll_interval + 5) * 1000:
+    tail_logs(task)
+    check_timeout(task)
+    interval = next_poll_interval(task)
+    if remaining_time() < (interval + 5) * 1000:
+      from cfn_lambda_handler import CfnLambdaExecutionTimeout
       raise CfnLambdaExecutionTimeout(task)
     if task['StartAndForget']:
       task['TaskResult'] = describe_tasks(task['Cluster'], task_result)
       return
     if not check_complete(task_result):
-      log.info("Task(s) have not yet completed, checking again in %s seconds..." % poll_interval)
-      time.sleep(poll_interval)
+      log.info("Task(s) have not yet completed, checking again in %s seconds..." % interval)
+      metrics.record('PollSleep', interval, 'Seconds')
+      time.sleep(interval)
       task['TaskResult'] = describe_tasks(task['Cluster'], task_result)
     else:
-      check_exit_codes(task['TaskResult'])
+      record_stopped(task)
+      check_exit_codes(task['TaskResult'], task['TaskDefinition'], task.get('LogStreams'), task.get('LogLines'))
+      return
+
+# Waits for stopping ECS tasks to reach a STOPPED status
+def wait_for_stopped(task, remaining_time):
+  while True:
+    check_timeout(task)
+    if all(t.get('lastStatus') == 'STOPPED' for t in task['TaskResult']['tasks']):
+      return
+    interval = next_poll_interval(task)
+    if remaining_time() < (interval + 5) * 1000:
+      from cfn_lambda_handler import CfnLambdaExecutionTimeout
+      raise CfnLambdaExecutionTimeout(task)
+    log.info("Task(s) have not yet stopped, checking again in %s seconds..." % interval)
+    time.sleep(interval)
+    task['TaskResult'] = describe_tasks(task['Cluster'], task['TaskResult'])
+
+# Starts the task graph entries whose dependencies have all completed, failing on any launch failure
+def start_ready(task):
+  complete = [t['Name'] for t in task['TaskGraph'] if t['Status'] == 'COMPLETE']
+  ready = [t for t in task['TaskGraph'] if t['Status'] == 'WAITING' and all(d in complete for d in t['DependsOn'])]
+  def start_entry(entry):
+    entry['TaskResult'] = start(dict(task, TaskDefinition=entry['TaskDefinition'], Overrides=entry['Overrides'], Count=entry['Count']))
+    entry['Status'] = 'STARTED'
+    log.info("Started task graph entry %s", entry["Name"])
+  concurrent_map(start_entry, ready, task_mgr.max_workers)
+  for entry in ready:
+    if entry['TaskResult']['failures']:
+      raise EcsTaskFailureError(entry['TaskResult'])
+
+# Updates started task graph entries, failing on the first task that stops with a non-zero exit code
+def update_graph(task):
+  started = [t for t in task['TaskGraph'] if t['Status'] == 'STARTED']
+  result = task_mgr.bulk_describe_tasks([(task['Cluster'], r['taskArn']) for t in started for r in t['TaskResult']['tasks']])
+  if result['failures']:
+    raise EcsTaskFailureError(result)
+  described = dict((r['taskArn'], r) for r in task_state(result['tasks']))
+  for entry in started:
+    entry['TaskResult']['tasks'] = [described.get(r['taskArn'], r) for r in entry['TaskResult']['tasks']]
+  tail_logs(task)
+  for entry in started:
+    tasks = entry['TaskResult']['tasks']
+    stopped = {'tasks': [r for r in tasks if r.get('lastStatus') == 'STOPPED']}
+    check_exit_codes(stopped, entry['TaskDefinition'], task.get('LogStreams'), task.get('LogLines'))
+    if check_complete(entry['TaskResult']):
+      entry['Status'] = 'COMPLETE'
+      log.info("Completed task graph entry %s", entry["Name"])
+
+# Stops the tasks of started task graph entries that have not stopped, so that they do not keep running once the graph
+# has failed
+def stop_graph(task):
+  running = [(task['Cluster'], r['taskArn']) for t in task['TaskGraph'] if t['Status'] == 'STARTED'
+    for r in t['TaskResult']['tasks'] if r.get('lastStatus') != 'STOPPED']
+  if running:
+    log.info("Stopping %d running task(s) of failed task graph", len(running))
+    result = task_mgr.bulk_stop_tasks(running, reason='Task graph failed')
+    if result['failures']:
+      log.warning("Failed to stop task(s) of failed task graph: %s", result['failures'])
+
+# Runs a task graph, starting each entry as soon as its dependencies complete, until all entries complete
+def poll_graph(task, remaining_time):
+  for entry in task['TaskGraph']:
+    entry.setdefault('Status', 'WAITING')
+  while True:
+    metrics.record('PollIterations', 1)
+    check_timeout(task)
+    try:
+      update_graph(task)
+      start_ready(task)
+    except (EcsTaskFailureError, EcsTaskExitCodeError):
+      stop_graph(task)
+      raise
+    results = [t['TaskResult'] for t in task['TaskGraph'] if t.get('TaskResult')]
+    task['TaskResult'] = {'tasks': [r for t in results for r in t['tasks']], 'failures': []}
+    if all(t['Status'] == 'COMPLETE' for t in task['TaskGraph']):
+      record_stopped(task)
       return
+    interval = next_poll_interval(task)
+    if remaining_time() < (interval + 5) * 1000:
+      from cfn_lambda_handler import CfnLambdaExecutionTimeout
+      raise CfnLambdaExecutionTimeout(task)
+    log.info("Task graph has not yet completed, checking again in %s seconds...", interval)
+    metrics.record('PollSleep', interval, 'Seconds')
+    time.sleep(interval)
+
+# Returns the fingerprint of the effective inputs of a task, which for a task graph includes the inputs of every entry
+def get_fingerprint(task):
+  def inputs(t):
+    task_definition = task_mgr.describe_task_definition(t['TaskDefinition'])
+    return run_inputs(task_definition, t['Overrides'], t['Count'], image_resolver.digests(task_definition))
+  if task['TaskGraph']:
+    return fingerprint([dict(inputs(t), name=t['Name'], depends_on=t['DependsOn']) for t in task['TaskGraph']])
+  return fingerprint(inputs(task))
+
+# Records a successful run of a memoized task
+def record_run(task):
+  if task.get('Fingerprint'):
+    run_store.put_run(task['Fingerprint'], {
+      'TaskArn': next(t['taskArn'] for t in task['TaskResult']['tasks']),
+      'CompletedAt': int(time.time())
+    })
+
+# Persists the request and defers the CloudFormation response until the task stops
+def defer(task, event):
+  if task['TaskResult'].get('failures'):
+    raise EcsTaskFailureError(task['TaskResult'])
+  request = dict((k, event[k]) for k in RESPONSE_KEYS if k in event)
+  request['PhysicalResourceId'] = next(t['taskArn'] for t in task['TaskResult']['tasks'])
+  request['EventState'] = task
+  state_mgr.put_state(task['StartedBy'], request)
+  log.info("Task started, waiting for task state change events for %s" % task['StartedBy'])
+  raise CfnResponseDeferred(request)
 
 # Start and poll task
-def start_and_poll(task, context):
+def start_and_poll(task, event, context):
+  # Memoized tasks are skipped if a previous run with the same inputs succeeded
+  if task['Memoize']:
+    task['Fingerprint'] = get_fingerprint(task)
+    run = run_store.get_run(task['Fingerprint'])
+    if run:
+      log.info("Skipping task with unchanged inputs that previously succeeded as %s", run['TaskArn'])
+      return run['TaskArn']
+  if task['TaskGraph']:
+    task['TaskResult'] = {'tasks': [], 'failures': []}
+    poll_graph(task, context.get_remaining_time_in_millis)
+    log.info("Task graph completed successfully with result: %s", format_json(task['TaskResult']))
+    record_run(task)
+    return next(t['taskArn'] for t in task['TaskResult']['tasks'])
   task['TaskResult'] = start(task)
-  log.info("Task created successfully with result: %s" % format_json(task['TaskResult']))
+  log.info("Task created successfully with result: %s", format_json(task['TaskResult']))
+  if task['Timeout'] > 0 and task['CompletionMode'] == 'Event' and not task['StartAndForget']:
+    defer(task, event)
   if task['Timeout'] > 0:
     poll(task,context.get_remaining_time_in_millis)
-    log.info("Task completed successfully with result: %s" % format_json(task['TaskResult']))
+    log.info("Task completed successfully with result: %s", format_json(task['TaskResult']))
+    if not task['StartAndForget']:
+      record_run(task)
   return next(t['taskArn'] for t in task['TaskResult']['tasks'])
 
 # Create task
@@ -116,35 +307,44 @@ def create_task(event):
   task['StartedBy'] = get_task_id(event['StackId'],event['LogicalResourceId'])
   event['Timeout'] = task['Timeout']
   task['CreationTime'] = event['CreationTime']
-  log.info('Received task %s' % format_json(task))
+  log.info('Received task %s', format_json(task))
   return task
 
 # Event handlers
-@handler.poll
 @cfn_error_handler
 def handle_poll(event, context):
-  log.info('Received poll event %s' % str(event))
+  log.info('Received poll event %s', event)
   task = event.get('EventState')
-  poll(task, context.get_remaining_time_in_millis)
-  log.info("Task completed with result: %s" % task['TaskResult'])
+  if event['RequestType'] == 'Delete':
+    wait_for_stopped(task, context.get_remaining_time_in_millis)
+    log.info("Task(s) stopped with result: %s", task['TaskResult'])
+    return {
+      "Status": "SUCCESS",
+      "PhysicalResourceId": event['PhysicalResourceId']
+    }
+  if task.get('TaskGraph'):
+    poll_graph(task, context.get_remaining_time_in_millis)
+  else:
+    poll(task, context.get_remaining_time_in_millis)
+  log.info("Task completed with result: %s", task['TaskResult'])
+  if not task['StartAndForget']:
+    record_run(task)
   return {
     "Status": "SUCCESS", 
     "PhysicalResourceId": next(t['taskArn'] for t in task['TaskResult']['tasks'])
   }
 
-@handler.create
 @cfn_error_handler
 def handle_create(event, context):
-  log.info('Received create event %s' % str(event))
+  log.info('Received create event %s', event)
   task = create_task(event)
   if task['Count'] > 0:
-    event['PhysicalResourceId'] = start_and_poll(task, context)
+    event['PhysicalResourceId'] = start_and_poll(task, event, context)
   return event
 
-@handler.update
 @cfn_error_handler
 def handle_update(event, context):
-  log.info('Received update event %s' % str(event))
+  log.info('Received update event %s', event)
   task = create_task(event)
   update_criteria = task['UpdateCriteria']
   should_run = task['RunOnUpdate'] and task['Count'] > 0
@@ -154,20 +354,98 @@ def handle_update(event, context):
       stack_status = cfn_mgr.get_stack_status(event['StackId'])
       should_run = stack_status not in ROLLBACK_STATES
     if update_criteria and should_run:
-      old_values = get_task_definition_values(old_task['TaskDefinition'],update_criteria)
-      new_values = get_task_definition_values(task['TaskDefinition'],update_criteria)
+      old_values = [v for d in task_definitions(old_task) for v in get_task_definition_values(d,update_criteria)]
+      new_values = [v for d in task_definitions(task) for v in get_task_definition_values(d,update_criteria)]
       if old_values != new_values:
-        event['PhysicalResourceId'] = start_and_poll(task, context)
+        event['PhysicalResourceId'] = start_and_poll(task, event, context)
     elif should_run:
-      event['PhysicalResourceId'] = start_and_poll(task, context)
+      event['PhysicalResourceId'] = start_and_poll(task, event, context)
   return event
   
-@handler.delete
 @cfn_error_handler
 def handle_delete(event, context):
-  log.info('Received delete event %s' % str(event))
+  log.info('Received delete event %s', event)
   task = create_task(event)
-  tasks = task_mgr.list_tasks(cluster=task['Cluster'], startedBy=task['StartedBy'])
-  for t in tasks:
-    task_mgr.stop_task(cluster=task['Cluster'], task=t, reason='Delete requested for %s' % event['StackId'])
-  return event
\ No newline at end of file
+  task_arns = list(task_mgr.list_tasks(cluster=task['Cluster'], startedBy=task['StartedBy']))
+  # Skip tasks that are already stopping
+  tasks = task_mgr.bulk_describe_tasks([(task['Cluster'], t) for t in task_arns])['tasks'] if task_arns else []
+  running = [(task['Cluster'], t['taskArn']) for t in tasks if t.get('desiredStatus') != 'STOPPED']
+  result = task_mgr.bulk_stop_tasks(running, reason='Delete requested for %s' % event['StackId'])
+  if result['failures']:
+    raise EcsTaskFailureError(result)
+  if task['WaitOnDelete'] and task['Timeout'] > 0 and tasks:
+    task['TaskResult'] = {'tasks': task_state(tasks), 'failures': []}
+    wait_for_stopped(task, context.get_remaining_time_in_millis)
+  return event
+
+# Builds the CloudFormation request handler
+def get_handler():
+  global request_handler
+  if request_handler is None:
+    from cfn_lambda_handler import Handler
+    request_handler = Handler(decorator=deferrable_cfn_handler)
+    request_handler.poll(handle_poll)
+    request_handler.create(handle_create)
+    request_handler.update(handle_update)
+    request_handler.delete(handle_delete)
+  return request_handler
+
+# Entry point for CloudFormation custom resource requests
+def handler(event, context):
+  return get_handler()(event, context)
+
+# Completes a deferred request from its persisted state
+@cfn_error_handler
+def complete_task(request, context):
+  task = request['EventState']
+  check_timeout(task)
+  task['TaskResult'] = describe_tasks(task['Cluster'], task['TaskResult'])
+  tail_logs(task)
+  if check_complete(task['TaskResult']):
+    check_exit_codes(task['TaskResult'], task['TaskDefinition'], task.get('LogStreams'), task.get('LogLines'))
+    record_run(task)
+    request['Status'] = 'SUCCESS'
+  return request
+
+# Entry point for ECS task state change events of tasks run with an Event completion mode
+def handle_task_event(event, context):
+  detail = event.get('detail') or {}
+  if event.get('detail-type') != 'ECS Task State Change' or detail.get('lastStatus') != 'STOPPED':
+    return
+  started_by = detail.get('startedBy')
+  request = state_mgr.get_state(started_by) if started_by else None
+  if not request:
+    log.debug('Ignoring task state change event for %s' % detail.get('taskArn'))
+    return
+  log.info('Received task state change event %s', event)
+  complete_request(started_by, request, context)
+
+# Completes a deferred request if its tasks have stopped or it has timed out
+def complete_request(started_by, request, context):
+  streams = copy.deepcopy(request['EventState'].get('LogStreams'))
+  response = complete_task(request, context)
+  if not response.get('Status'):
+    log.info("Task(s) have not yet completed, waiting for further task state change events...")
+    # Log stream tokens are persisted so that the next event reads on from them
+    if request['EventState'].get('LogStreams') != streams:
+      state_mgr.update_state(started_by, request)
+    return
+  # Only the invocation that claims the persisted state sends the response, and the state is only removed once the
+  # response is sent so that a failed response is retried
+  if not state_mgr.claim_state(started_by):
+    return
+  try:
+    send_response(request, response)
+  except Exception:
+    state_mgr.release_state(started_by)
+    raise
+  state_mgr.delete_state(started_by)
+
+# Entry point for a scheduled sweep of deferred requests, which enforces the Timeout of tasks whose task state change
+# events are never received, such as tasks that fail to stop or events missed while the event handler is throttled
+def sweep_deferred(event, context):
+  for started_by, request in state_mgr.list_states():
+    try:
+      complete_request(started_by, request, context)
+    except Exception as e:
+      log.error("Failed to complete deferred request %s: %s" % (started_by, e))
@@ -1,4 +1,15 @@
-from .cfn import CfnManager
-from .ecs import EcsTaskManager, EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError
+from .clients import get_client, reset_clients
+from .metrics import get_metrics, reset_metrics
+from .cfn import CfnManager, CfnResponseDeferred, send_response, deferrable_cfn_handler
+from .ecs import EcsTaskManager, EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError, merge_retries, task_state
+from .state import TaskStateManager
+from .memo import ImageResolver, get_run_store, run_inputs, fingerprint
+from .logs import LogsManager, add_streams
+from .pool import EcsTaskPool
+from .queues import TaskSetQueue
+from .results import task_outcomes, failed_outcomes, RETRYABLE_OUTCOMES
+from .serialization import normalize, dumps, loads, JsonFormatter
+from .utils import parse_timestamp, paginate, paginated_response, concurrent_map
+from .scheduler import poll_interval, next_attempt
 from .validation import validate_ecs, validate_cfn
-from .errors import ecs_error_handler, cfn_error_handler
\ No newline at end of file
+from .errors import ecs_error_handler, cfn_error_handler, ecs_failure_reason, add_outcomes
\ No newline at end of file
@@ -0,0 +1,39 @@
+import time
+import threading
+from collections import OrderedDict
+
+class TtlLruCache:
+  """Least recently used cache with optional per-entry expiry"""
+  def __init__(self, capacity=128):
+    self.capacity = capacity
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is None or (entry[1] is not None and entry[1] < time.time()):
+        self.misses += 1
+        return None
+      self.entries[key] = entry
+      self.hits += 1
+      return entry[0]
+
+  # Entries without a ttl only leave the cache when evicted as least recently used
+  def put(self, key, value, ttl=None):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = (value, time.time() + ttl if ttl is not None else None)
+      while len(self.entries) > self.capacity:
+        self.entries.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
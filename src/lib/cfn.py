@@ -1,16 +1,122 @@
+import os
+import time
+import logging
+import threading
 from functools import partial
-from .utils import paginated_response
-import boto3
+from .utils import paginate
+from .cache import TtlLruCache
+from .clients import ServiceClient
+from .serialization import dumps
+
+log = logging.getLogger()
+
+# Stack status only changes between stack operations, so is cached briefly for custom resources of the same stack
+STACK_STATUS_TTL = int(os.environ.get('STACK_STATUS_CACHE_TTL', 5))
+
+class CfnResponseDeferred(Exception):
+  def __init__(self, state=None):
+    self.state = state or {}
 
 class CfnManager:
   """Handles CloudFormation Service Requests""" 
-  def __init__(self):
-    self.client = boto3.client('cloudformation')
+  client = ServiceClient('cloudformation')
+  stack_status_cache = TtlLruCache(int(os.environ.get('STACK_STATUS_CACHE_SIZE', 128)))
+  in_flight = dict()
+  in_flight_lock = threading.Lock()
 
-  def describe_stacks(self, stack_name):
+  # Returns a generator that describes stacks page by page
+  def describe_stacks(self, stack_name, max_items=None):
     func = partial(self.client.describe_stacks,StackName=stack_name)
-    return paginated_response(func, 'Stacks')
+    return paginate(func, 'Stacks', max_items=max_items)
+
+  # Describes a single stack with one DescribeStacks request
+  def describe_stack(self, stack_id):
+    return self.client.describe_stacks(StackName=stack_id)['Stacks'][0]
+
+  def get_stack_status(self, stack_id):
+    '''
+    Returns the status of a stack, cached for STACK_STATUS_TTL seconds across invocations.
+    Stacks should be given by stack ID, as stack names are reused by new stacks once a stack is deleted.
+    Concurrent lookups of a stack that is not cached wait for a single DescribeStacks request.
+    '''
+    from concurrent.futures import Future
+    with self.in_flight_lock:
+      future = self.in_flight.get(stack_id)
+      owner = future is None
+      if owner:
+        status = self.stack_status_cache.get(stack_id)
+        if status is not None:
+          return status
+        future = self.in_flight[stack_id] = Future()
+    if not owner:
+      return future.result()
+    try:
+      status = self.describe_stack(stack_id)['StackStatus']
+      self.stack_status_cache.put(stack_id, status, STACK_STATUS_TTL)
+      future.set_result(status)
+      return status
+    except Exception as e:
+      future.set_exception(e)
+      raise
+    finally:
+      with self.in_flight_lock:
+        del self.in_flight[stack_id]
+
+# Sends a custom resource response to the pre-signed CloudFormation response URL, defaulting the physical resource ID
+# as cfn_handler does
+def send_response(event, response):
+  from cfn_lambda_handler.cfn_lambda_handler import physical_resource_id
+  body = {
+    'StackId': event['StackId'],
+    'RequestId': event['RequestId'],
+    'LogicalResourceId': event['LogicalResourceId'],
+    'PhysicalResourceId': response.get('PhysicalResourceId') or event.get('PhysicalResourceId') or
+      physical_resource_id(event['StackId'], event['LogicalResourceId']),
+    'Status': response.get('Status') or 'SUCCESS'
+  }
+  for key in ['Reason','Data','NoEcho']:
+    if response.get(key):
+      body[key] = response[key]
+  import requests
+  data = dumps(body)
+  log.info("Responding to '%s' request with: %s", event.get('RequestType'), data)
+  result = requests.put(event['ResponseURL'], data=data, headers={'Content-Type': ''})
+  result.raise_for_status()
 
-  def get_stack_status(self, stack_name):
-    # return self.describe_stacks(stack_name)
-    return next(s for s in self.describe_stacks(stack_name))['StackStatus']
\ No newline at end of file
+# Handler decorator that lets create and update requests with an Event completion mode defer their response
+# Requests that run out of execution time before deferring are re-invoked as poll requests, as cfn_handler does
+def deferrable_cfn_handler(func, resolve_secrets=True, **kwargs):
+  from cfn_lambda_handler.cfn_lambda_handler import cfn_handler, walk, invoke, CfnLambdaExecutionTimeout
+  respond = cfn_handler(func, resolve_secrets=resolve_secrets, **kwargs)
+  def decorator(event, context):
+    deferrable = event.get('RequestType') in ['Create','Update'] and not event.get('EventStatus')
+    if not deferrable or event['ResourceProperties'].get('CompletionMode') != 'Event':
+      return respond(event, context)
+    if resolve_secrets:
+      event['ResourceProperties'] = walk(event['ResourceProperties'])
+    event['CreationTime'] = event.get('CreationTime') or int(time.time())
+    try:
+      response = func(event, context)
+    except CfnResponseDeferred:
+      log.info("Deferring response to '%s' request until task completion" % event['RequestType'])
+      return
+    except CfnLambdaExecutionTimeout as e:
+      log.info("Function approaching maximum Lambda execution timeout, invoking new Lambda function...")
+      try:
+        event['EventState'] = e.state
+        invoke(event, context)
+        return
+      except Exception:
+        log.exception("Failed to invoke new Lambda function after maximum Lambda execution timeout")
+        response = {
+          'Status': 'FAILED',
+          'Reason': 'Failed to invoke new Lambda function after maximum Lambda execution timeout'
+        }
+    except Exception:
+      log.exception("Failed to execute resource function")
+      response = {
+        'Status': 'FAILED',
+        'Reason': 'Exception was raised while handling custom resource'
+      }
+    send_response(event, response)
+  return decorator
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+from .metrics import get_metrics, NullMetrics
+
+# Error codes returned for throttled requests
+THROTTLING_ERRORS = ['ThrottlingException','TooManyRequestsException','RequestLimitExceeded','Throttling']
+
+# Clients are created once per process and reused across warm invocations
+clients = dict()
+lock = threading.Lock()
+
+# Builds the botocore client configuration from environment variables
+def get_config():
+  from botocore.config import Config
+  return Config(
+    max_pool_connections=int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', 25)),
+    connect_timeout=int(os.environ.get('CLIENT_CONNECT_TIMEOUT', 5)),
+    read_timeout=int(os.environ.get('CLIENT_READ_TIMEOUT', 30)),
+    retries={
+      'mode': os.environ.get('AWS_RETRY_MODE', 'adaptive'),
+      'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', 10))
+    }
+  )
+
+# Returns the shared client for a given service, creating it on first use from the default boto3 session
+def get_client(service):
+  client = clients.get(service)
+  if client is None:
+    with lock:
+      client = clients.get(service)
+      if client is None:
+        import boto3
+        client = clients[service] = instrument(boto3.client(service, config=get_config()))
+  return client
+
+class ServiceClient(object):
+  """Resolves the shared client for a service when first accessed from a manager instance"""
+  def __init__(self, service):
+    self.service = service
+
+  def __get__(self, instance, owner):
+    return self if instance is None else get_client(self.service)
+
+# Discards all shared clients
+def reset_clients():
+  with lock:
+    clients.clear()
+
+class InstrumentedClient(object):
+  """Records the latency, retries, throttles and response size of each operation called on a client"""
+  def __init__(self, client, metrics):
+    self.client = client
+    self.metrics = metrics
+
+  def __getattr__(self, name):
+    attr = getattr(self.client, name)
+    if name.startswith('_') or name in ['meta','exceptions','can_paginate','get_paginator','get_waiter'] or not callable(attr):
+      return attr
+    return lambda **kwargs: self.call(name, attr, kwargs)
+
+  def call(self, operation, func, kwargs):
+    start = time.time()
+    try:
+      response = func(**kwargs)
+    except Exception as e:
+      code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+      self.metrics.record('Errors', 1, Operation=operation)
+      if code in THROTTLING_ERRORS:
+        self.metrics.record('Throttles', 1, Operation=operation)
+      raise
+    finally:
+      self.metrics.record('Latency', (time.time() - start) * 1000, 'Milliseconds', Operation=operation)
+    metadata = response.get('ResponseMetadata') or {}
+    self.metrics.record('Retries', metadata.get('RetryAttempts', 0), Operation=operation)
+    size = (metadata.get('HTTPHeaders') or {}).get('content-length')
+    if size is not None:
+      self.metrics.record('ResponseSize', int(size), 'Bytes', Operation=operation)
+    return response
+
+# Returns a client that records metrics for each operation if metrics are enabled, otherwise the client itself
+def instrument(client):
+  metrics = get_metrics()
+  return client if isinstance(metrics, NullMetrics) else InstrumentedClient(client, metrics)
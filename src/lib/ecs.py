@@ -1,6 +1,44 @@
+import os
+import re
+import time
+import random
+import logging
+from collections import OrderedDict
 from functools import partial
-from .utils import paginated_response
-import boto3
+from .utils import paginate, chunks, concurrent_map
+from botocore.exceptions import ClientError
+from .clients import ServiceClient, THROTTLING_ERRORS
+from .cache import TtlLruCache
+from .metrics import get_metrics
+
+log = logging.getLogger()
+
+# Maximum number of tasks launched by a single RunTask request
+RUN_TASK_LIMIT = 10
+
+# Maximum number of tasks accepted by a single DescribeTasks request
+DESCRIBE_TASKS_LIMIT = 100
+
+# Task and container attributes kept in compact task state
+COMPACT_TASK_KEYS = ['taskArn','lastStatus','desiredStatus','stopCode','stoppedReason','createdAt','startedAt','stoppingAt','stoppedAt']
+COMPACT_CONTAINER_KEYS = ['name','lastStatus','exitCode','reason']
+
+# Maximum number of container instances accepted by a single DescribeContainerInstances request
+DESCRIBE_CONTAINER_INSTANCES_LIMIT = 100
+
+# Transient launch failure classes that are retried, with any other failure treated as permanent
+TRANSIENT_FAILURES = ['capacity','throttling','agent']
+
+# Seconds allowed for retrying tasks that failed to launch due to transient failures
+RUN_TASK_RETRY_DEADLINE = int(os.environ.get('RUN_TASK_RETRY_DEADLINE', 30))
+RUN_TASK_RETRY_DELAY = 1.0
+
+# Task definitions referenced without a revision may resolve to a new revision, so are only cached briefly
+TASK_DEFINITION_TTL = int(os.environ.get('TASK_DEFINITION_CACHE_TTL', 30))
+REVISIONED_TASK_DEFINITION = re.compile(r':\d+$')
+
+# Container instances may be deregistered and replaced, so EC2 instance lookups are only cached for a limited time
+CONTAINER_INSTANCE_TTL = int(os.environ.get('CONTAINER_INSTANCE_CACHE_TTL', 300))
 
 class EcsTaskFailureError(Exception):
     def __init__(self, task):
@@ -9,10 +47,12 @@ class EcsTaskFailureError(Exception):
         self.failures = task.get('failures')
 
 class EcsTaskExitCodeError(Exception):
-    def __init__(self, task, non_zero):
+    def __init__(self, task, non_zero, logs=None, outcomes=None):
         self.task = task
         self.taskArn = next((t['taskArn'] for t in task),None)
         self.non_zero = non_zero
+        self.logs = logs or []
+        self.outcomes = outcomes or []
 
 class EcsTaskTimeoutError(Exception):
     def __init__(self, tasks, creation, timeout):
@@ -21,45 +61,268 @@ class EcsTaskTimeoutError(Exception):
         self.tasks = tasks
         self.taskArn = next((t['taskArn'] for t in tasks),None)
 
+# Combines the tasks and failures of multiple ECS responses
+def merge_results(responses):
+  return {
+    'tasks': [t for r in responses for t in r.get('tasks', [])],
+    'failures': [f for r in responses for f in r.get('failures', [])]
+  }
+
+# Projects a described task onto the attributes required to track its completion
+def compact_task(task):
+  result = dict((k, task[k]) for k in COMPACT_TASK_KEYS if task.get(k) is not None)
+  result['containers'] = [dict((k, c[k]) for k in COMPACT_CONTAINER_KEYS if c.get(k) is not None) for c in task.get('containers', [])]
+  return result
+
+# Returns the task state kept in events, which is compact unless full task detail is requested
+def task_state(tasks, full=False):
+  return list(tasks) if full else [compact_task(t) for t in tasks]
+
+# Classifies a launch failure as 'capacity', 'throttling', 'agent' or 'permanent'
+def classify_failure(failure):
+  reason = failure.get('reason') or ''
+  if reason.startswith('RESOURCE:'):
+    return 'capacity'
+  if reason in THROTTLING_ERRORS:
+    return 'throttling'
+  if reason == 'AGENT':
+    return 'agent'
+  return 'permanent'
+
+# Sums launch retry counts keyed by failure class
+def merge_retries(*retries):
+  return dict((c, sum((r or {}).get(c, 0) for r in retries)) for c in TRANSIENT_FAILURES)
+
+# Returns the CPU units and memory in MiB reserved by a task definition, including any overrides
+def task_resources(task_definition, overrides=None):
+  overrides = overrides or {}
+  container_overrides = dict((o.get('name'), o) for o in overrides.get('containerOverrides', []))
+  cpu = memory = 0
+  for container in task_definition.get('containerDefinitions', []):
+    override = container_overrides.get(container.get('name'), {})
+    cpu += int(override.get('cpu') or container.get('cpu') or 0)
+    memory += int(override.get('memoryReservation') or container.get('memoryReservation') or override.get('memory') or container.get('memory') or 0)
+  cpu = int(overrides.get('cpu') or task_definition.get('cpu') or cpu)
+  memory = int(overrides.get('memory') or task_definition.get('memory') or memory)
+  return cpu, memory
+
 class EcsTaskManager:
   """Handles ECS Tasks"""
-  def __init__(self):
-    self.client = boto3.client('ecs')
+  client = ServiceClient('ecs')
+  task_definition_cache = TtlLruCache(int(os.environ.get('TASK_DEFINITION_CACHE_SIZE', 128)))
+  container_instance_cache = TtlLruCache(int(os.environ.get('CONTAINER_INSTANCE_CACHE_SIZE', 1024)))
+
+  def __init__(self, max_workers=None, retry_deadline=None):
+    self.max_workers = max_workers or int(os.environ.get('ECS_MAX_WORKERS', 10))
+    self.retry_deadline = RUN_TASK_RETRY_DEADLINE if retry_deadline is None else retry_deadline
 
   def get_container_instances(self, cluster, instance_ids):
-    containers = self.client.list_container_instances(cluster).get('containerInstanceArns')
-    describe_containers = self.client.describe_container_instances(cluster=cluster, containerInstances=containers).get('containerInstances')
-    return [c.get('containerInstanceArn') for c in describe_containers if c.get('ec2InstanceId') in instance_ids]
-    
-  def list_container_instances(self, cluster):
-    func = partial(self.client.list_container_instances,cluster=cluster)
-    return paginated_response(func, 'containerInstanceArns')
-
-  def start_task(self, cluster, task_definition, overrides, count, started_by, launch_type, network_configuration):
-    return self.client.run_task(
+    '''
+    Returns a dictionary of EC2 instance ID to container instance ARN for the given instances found in a cluster.
+    Lookups are cached across invocations, with all container instances of the cluster listed and described
+    in concurrent batches of at most 100 whenever an instance is not cached.
+    '''
+    cache = self.container_instance_cache
+    result = dict((i, cache.get((cluster, i))) for i in instance_ids)
+    if not all(result.values()):
+      for container in self.describe_container_instances(cluster):
+        instance_id, arn = container.get('ec2InstanceId'), container.get('containerInstanceArn')
+        cache.put((cluster, instance_id), arn, CONTAINER_INSTANCE_TTL)
+        if instance_id in result:
+          result[instance_id] = arn
+    return dict((i, arn) for i, arn in result.items() if arn)
+
+  # Returns a generator that lists container instances page by page
+  def list_container_instances(self, cluster, max_items=None, **kwargs):
+    func = partial(self.client.list_container_instances,cluster=cluster,**kwargs)
+    return paginate(func, 'containerInstanceArns', max_items=max_items)
+
+  def describe_container_instances(self, cluster, **kwargs):
+    '''
+    Describes the container instances of a cluster, listed page by page and described in concurrent batches of at most 100.
+    Keyword arguments such as 'status' filter the listed container instances.
+    '''
+    arns = list(self.list_container_instances(cluster, **kwargs))
+    describe = lambda batch: self.client.describe_container_instances(cluster=cluster, containerInstances=batch)
+    responses = concurrent_map(describe, chunks(arns, DESCRIBE_CONTAINER_INSTANCES_LIMIT), self.max_workers)
+    return [c for r in responses for c in r.get('containerInstances', [])]
+
+  def get_capacity(self, cluster, task_definition, overrides=None):
+    '''
+    Returns the number of tasks that fit the remaining CPU and memory of the active container instances in a cluster.
+    Returns None if the task definition does not reserve any CPU or memory.
+    '''
+    required = zip(['CPU', 'MEMORY'], task_resources(self.describe_task_definition(task_definition), overrides))
+    required = [(name, value) for name, value in required if value]
+    if not required:
+      return None
+    capacity = 0
+    for instance in self.describe_container_instances(cluster, status='ACTIVE'):
+      if not instance.get('agentConnected', True):
+        continue
+      remaining = dict((r.get('name'), r.get('integerValue', 0)) for r in instance.get('remainingResources', []))
+      capacity += min(remaining.get(name, 0) // value for name, value in required)
+    return capacity
+
+  def start_task(self, cluster, task_definition, overrides, count, started_by, launch_type, network_configuration, instances=None, retry=TRANSIENT_FAILURES):
+    '''
+    Runs any number of tasks as concurrent RunTask requests of at most 10 tasks.
+    If instances are given, one task is started on each instance instead and the count is ignored.
+    Tasks that fail to launch due to a failure class listed in 'retry' are run again with jittered exponential backoff
+    until the retry deadline, with the number of retries per failure class returned as 'retries'.
+    A request that raises a client error is reported in the returned failures, so tasks started by other requests are kept.
+    '''
+    args = dict(
       cluster=cluster, 
       taskDefinition=task_definition, 
       overrides=overrides, 
-      count=count, 
-      startedBy=started_by,
-      networkConfiguration=network_configuration,
-      launchType=launch_type
+      startedBy=started_by
     )
+    if network_configuration:
+      args['networkConfiguration'] = network_configuration
+    if instances:
+      return self.start_task_on_instances(instances, **args)
+    args['launchType'] = launch_type
+    deadline = time.time() + self.retry_deadline
+    def run_task(batch_count):
+      result = {'tasks': [], 'failures': [], 'retries': merge_retries()}
+      attempt = 0
+      while True:
+        try:
+          response = self.client.run_task(count=batch_count, **args)
+        except ClientError as e:
+          response = {'tasks': [], 'failures': [{'reason': e.response['Error']['Code'], 'detail': str(e), 'count': batch_count}]}
+        result['tasks'] += response.get('tasks', [])
+        batch_count -= len(response.get('tasks', []))
+        failures = response.get('failures', [])
+        classes = set(classify_failure(f) for f in failures)
+        delay = random.uniform(0, RUN_TASK_RETRY_DELAY * 2 ** attempt)
+        # Only the tasks that failed to launch are retried
+        if not batch_count or not failures or not classes.issubset(retry) or time.time() + delay > deadline:
+          result['failures'] += failures
+          return result
+        for c in classes:
+          result['retries'][c] += 1
+        log.info("Retrying %d task(s) that failed to launch (%s) in %.2f seconds..." % (batch_count, ', '.join(sorted(classes)), delay))
+        time.sleep(delay)
+        attempt += 1
+    counts = [min(RUN_TASK_LIMIT, count - i) for i in range(0, count, RUN_TASK_LIMIT)]
+    results = concurrent_map(run_task, counts, self.max_workers)
+    result = merge_results(results)
+    result['retries'] = merge_retries(*[r['retries'] for r in results])
+    return result
+
+  def start_task_on_instances(self, instances, **args):
+    '''
+    Starts one task on each container instance with concurrent StartTask requests.
+    Instances are given as EC2 instance IDs or container instance ARNs, with failures reported per instance.
+    '''
+    cluster = args['cluster']
+    instance_ids = [i for i in instances if not i.startswith('arn:')]
+    resolved = self.get_container_instances(cluster, instance_ids) if instance_ids else {}
+    def start(instance):
+      arn = resolved.get(instance, instance if instance.startswith('arn:') else None)
+      if not arn:
+        detail = 'Container instance for %s not found in cluster %s' % (instance, cluster)
+        return {'tasks': [], 'failures': [{'instance': instance, 'reason': 'MISSING', 'detail': detail}]}
+      try:
+        response = self.client.start_task(containerInstances=[arn], **args)
+      except ClientError as e:
+        response = {'tasks': [], 'failures': [{'arn': arn, 'reason': e.response['Error']['Code'], 'detail': str(e)}]}
+      for failure in response.get('failures', []):
+        failure['instance'] = instance
+      return response
+    return merge_results(concurrent_map(start, instances, self.max_workers))
+
+  def start_admitted_tasks(self, cluster, task_definition, overrides, count, started_by, launch_type, network_configuration):
+    '''
+    Runs only the tasks that fit the remaining capacity of the cluster, returning the number of tasks not run as 'queued'.
+    Tasks that fail to launch due to insufficient resources are queued rather than retried, with any other failure reported as usual.
+    Capacity is only checked for the EC2 launch type.
+    '''
+    capacity = self.get_capacity(cluster, task_definition, overrides) if launch_type == 'EC2' else None
+    admitted = count if capacity is None else min(count, capacity)
+    log.info("Cluster capacity admits %d of %d task(s)" % (admitted, count))
+    result = {'tasks': [], 'failures': []}
+    if admitted:
+      retry = [c for c in TRANSIENT_FAILURES if c != 'capacity']
+      result = self.start_task(cluster, task_definition, overrides, admitted, started_by, launch_type, network_configuration, retry=retry)
+    if all(classify_failure(f) == 'capacity' for f in result['failures']):
+      result['failures'] = []
+      result['queued'] = count - len(result['tasks'])
+    else:
+      result['queued'] = count - admitted
+    return result
 
   def describe_tasks(self, cluster, tasks):
-    return self.client.describe_tasks(cluster=cluster, tasks=tasks)
+    return self.bulk_describe_tasks([(cluster, t) for t in tasks])
+
+  def bulk_describe_tasks(self, tasks):
+    '''
+    Describes any number of (cluster, task) pairs.
+    Tasks are grouped per cluster into batches of at most 100 tasks, with batches described concurrently.
+    The returned tasks and failures follow the order of the given pairs.
+    '''
+    clusters = OrderedDict()
+    order = dict()
+    for index, (cluster, task) in enumerate(tasks):
+      if task not in order:
+        order[task] = index
+        clusters.setdefault(cluster, []).append(task)
+    batches = [(cluster, batch) for cluster, arns in clusters.items() for batch in chunks(arns, DESCRIBE_TASKS_LIMIT)]
+    describe = lambda batch: self.client.describe_tasks(cluster=batch[0], tasks=batch[1])
+    result = merge_results(concurrent_map(describe, batches, self.max_workers))
+    # Tasks may be referenced by full ARN or by task ID
+    position = lambda arn: order.get(arn, order.get(arn.split('/')[-1], len(order)))
+    result['tasks'].sort(key=lambda t: position(t.get('taskArn', '')))
+    result['failures'].sort(key=lambda f: position(f.get('arn', '')))
+    return result
 
   def describe_task_definition(self, task_definition):
-    response = self.client.describe_task_definition(taskDefinition=task_definition)
-    return response['taskDefinition']
+    '''
+    Returns a task definition, cached across invocations.
+    Revisions are immutable, so task definitions referenced by revision are cached until evicted.
+    The returned task definition is shared with the cache and must not be modified.
+    Cache hits and misses are recorded as metrics, which are written once per invocation.
+    '''
+    cache = self.task_definition_cache
+    result = cache.get(task_definition)
+    outcome = 'hit' if result is not None else 'miss'
+    get_metrics().record('TaskDefinitionCacheHits' if outcome == 'hit' else 'TaskDefinitionCacheMisses', 1)
+    if result is None:
+      result = self.client.describe_task_definition(taskDefinition=task_definition)['taskDefinition']
+      ttl = None if REVISIONED_TASK_DEFINITION.search(task_definition) else TASK_DEFINITION_TTL
+      cache.put(task_definition, result, ttl)
+      cache.put(result.get('taskDefinitionArn'), result)
+    log.debug("Task definition cache %s for %s (hits=%d misses=%d size=%d)" % (outcome, task_definition, cache.hits, cache.misses, len(cache.entries)))
+    return result
 
-  def list_tasks(self, cluster, **kwargs):
+  # Returns a generator that lists tasks page by page
+  def list_tasks(self, cluster, max_items=None, **kwargs):
     func = partial(self.client.list_tasks,cluster=cluster,**kwargs)
-    return paginated_response(func, 'taskArns')
+    return paginate(func, 'taskArns', max_items=max_items)
 
   def stop_task(self, cluster, task, reason='unknown'):
     return self.client.stop_task(cluster=cluster, task=task, reason=reason)
 
+  def bulk_stop_tasks(self, tasks, reason='unknown'):
+    '''
+    Stops any number of (cluster, task) pairs concurrently, with throttled requests retried by the botocore client.
+    Tasks that could not be stopped are reported in the returned failures.
+    '''
+    def stop(pair):
+      try:
+        response = self.stop_task(cluster=pair[0], task=pair[1], reason=reason)
+        return {'tasks': [response['task']] if response.get('task') else [], 'failures': []}
+      except ClientError as e:
+        return {'tasks': [], 'failures': [{'arn': pair[1], 'reason': e.response['Error']['Code'], 'detail': str(e)}]}
+    return merge_results(concurrent_map(stop, tasks, self.max_workers))
+
+  # Checks the completion of a batch of task specs, where failed task specs are complete
+  def check_batch_status(self, specs):
+    statuses = [s.get('Status') for s in specs]
+    return next((s for s in ['QUEUED','PENDING','RUNNING'] if s in statuses), 'STOPPED')
+
   # Checks ECS task completion
   def check_status(self, tasks):
     stats = [t.get('lastStatus') for t in tasks]
@@ -1,39 +1,110 @@
 import logging
-import json
-from datetime import datetime
+from serialization import normalize
+from metrics import get_metrics
+from results import APPLICATION_ERROR, RETRYABLE_OUTCOMES, failed_outcomes
 from ecs import EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError
-from voluptuous import MultipleInvalid, Invalid
-from cfn_lambda_handler import CfnLambdaExecutionTimeout
 from botocore.exceptions import ClientError
 
 log = logging.getLogger()
 
+# Voluptuous is only imported when an exception needs to be matched against validation errors
+def validation_errors():
+  from voluptuous import MultipleInvalid, Invalid
+  return (Invalid, MultipleInvalid)
+
+# Maximum number of failed tasks listed in a failure reason
+MAX_REASON_TASKS = 3
+
+# Maximum bytes of a failure reason sent to CloudFormation, which rejects response bodies over 4096 bytes
+CFN_REASON_BYTES = 2048
+
+# Marker of text omitted from a failure reason
+TRUNCATED = '... (truncated)'
+
+# Returns the UTF-8 encoded form of a string
+def encoded(text):
+  return text.encode('utf-8') if isinstance(text, unicode) else text
+
+# Returns a string cut to at most a given number of UTF-8 bytes, marking that it was truncated
+def truncate(text, limit):
+  data = encoded(text)
+  if len(data) <= limit:
+    return text
+  return data[:limit - len(TRUNCATED)].decode('utf-8', 'ignore') + TRUNCATED
+
+# Returns the last log lines that fit a given number of UTF-8 bytes, marking that earlier lines were omitted
+def last_lines(lines, limit):
+  kept = []
+  size = len(TRUNCATED) + 1
+  for line in reversed(lines):
+    size += len(encoded(line)) + 1
+    if size > limit:
+      break
+    kept.insert(0, line)
+  return kept if len(kept) == len(lines) else [TRUNCATED] + kept
+
+# Returns the suffix of a failure reason listing only the first of a number of tasks
+def more(items):
+  omitted = len(items) - MAX_REASON_TASKS
+  return " and %d more" % omitted if omitted > 0 else ""
+
+def exit_code_reason(e, limit=None):
+  '''
+  Returns the failure reason for tasks that did not succeed, with the number of tasks of each outcome unless all failed
+  with a non-zero exit code, the first few failed tasks and any tailed log lines.
+  If a limit is given, the reason is truncated to at most that many bytes, keeping the last log lines that fit.
+  '''
+  failed = failed_outcomes(e.outcomes)
+  if any(o['Outcome'] != APPLICATION_ERROR for o in failed):
+    counts = dict()
+    for o in failed:
+      counts[o['Outcome']] = counts.get(o['Outcome'], 0) + 1
+    summary = ", ".join("%d %s" % (counts[k], k) for k in sorted(counts, key=lambda k: (-counts[k], k)))
+    listed = ", ".join("%s (%s)" % (o['TaskArn'], o['Outcome']) for o in failed[:MAX_REASON_TASKS])
+    reason = "One or more tasks failed (%s): %s%s" % (summary, listed, more(failed))
+  else:
+    reason = "One or more containers failed with a non-zero exit code: %s%s" % (e.non_zero[:MAX_REASON_TASKS], more(e.non_zero))
+  if not e.logs:
+    return truncate(reason, limit) if limit else reason
+  header = reason + "\nLast log lines:\n"
+  if limit is None:
+    return header + "\n".join(e.logs)
+  return truncate(header + "\n".join(last_lines(e.logs, limit - len(encoded(header)))), limit)
+
+# Returns the failure reason reported for an error raised while creating or checking tasks
+def ecs_failure_reason(e):
+  if isinstance(e, ClientError):
+    return "A boto3 client error occurred: %s" % e
+  if isinstance(e, validation_errors()):
+    return "One or more invalid event properties: %s" % e
+  if isinstance(e, EcsTaskFailureError):
+    return "A task failure occurred: %s" % e.failures
+  if isinstance(e, EcsTaskExitCodeError):
+    return exit_code_reason(e)
+  if isinstance(e, EcsTaskTimeoutError):
+    return "The task failed to complete with the specified timeout of %s seconds" % e.timeout
+  return "An error occurred: %s" % e
+
+# Adds the task outcomes of an error for tasks that did not succeed to a failed event, flagging whether all are retryable
+def add_outcomes(event, e):
+  if isinstance(e, EcsTaskExitCodeError) and e.outcomes:
+    event['Outcomes'] = e.outcomes
+    event['Retryable'] = all(o['Outcome'] in RETRYABLE_OUTCOMES for o in failed_outcomes(e.outcomes))
+  return event
+
 def ecs_error_handler(func):
   def handle_task_result(event, context):
     try:
       event = func(event, context)
-    except ClientError as e:
-      event['Status'] = "FAILED"
-      event['Reason'] = "A boto3 client error occurred: %s" % e
-    except (Invalid, MultipleInvalid) as e:
-      event['Status'] = "FAILED"
-      event['Reason'] = "One or more invalid event properties: %s" % e
-    except EcsTaskFailureError as e:
-      event['Status'] = "FAILED"
-      event['Reason'] = "A task failure occurred: %s" % e.failures
-    except EcsTaskExitCodeError as e:
-      event['Status'] = "FAILED"
-      event['Reason'] = "One or more containers failed with a non-zero exit code: %s" % e.non_zero
-    except EcsTaskTimeoutError as e:
-      event['Status'] = "FAILED"
-      event['Reason'] = "The task failed to complete with the specified timeout of %s seconds" % e.timeout
     except Exception as e:
       event['Status'] = "FAILED"
-      event['Reason'] = "An error occurred: %s" % e
+      event['Reason'] = ecs_failure_reason(e)
+      add_outcomes(event, e)
     finally:
+      get_metrics().flush()
       if event['Status'] == "FAILED":
         log.error(event['Reason'])
-      return json.loads(json.dumps(event, default=lambda d: d.isoformat() if isinstance(d, datetime) else str(d)))
+      return normalize(event)
   return handle_task_result
 
 def cfn_error_handler(func):
@@ -46,17 +117,17 @@ def cfn_error_handler(func):
       event['PhysicalResourceId'] = e.taskArn or event['PhysicalResourceId']
     except EcsTaskExitCodeError as e:
       event['Status'] = "FAILED"
-      event['Reason'] = "One or more containers failed with a non-zero exit code: %s" % e.non_zero
+      event['Reason'] = exit_code_reason(e, CFN_REASON_BYTES)
       event['PhysicalResourceId'] = e.taskArn or event['PhysicalResourceId']
     except EcsTaskTimeoutError as e:
       event['Status'] = "FAILED"
       event['Reason'] = "The task failed to complete with the specified timeout of %s seconds" % e.timeout
       event['PhysicalResourceId'] = e.taskArn or event['PhysicalResourceId']
-    except CfnLambdaExecutionTimeout:
-      raise
-    except (Invalid, MultipleInvalid) as e:
+    except validation_errors() as e:
       event['Status'] = "FAILED"
       event['Reason'] = "One or more invalid event properties: %s" % e  
+    finally:
+      get_metrics().flush()
     if event.get('Status') == "FAILED":
       log.error(event['Reason'])
     return event
@@ -0,0 +1,119 @@
+import logging
+from botocore.exceptions import ClientError
+from .clients import ServiceClient
+from .utils import concurrent_map
+
+log = logging.getLogger()
+
+# Maximum number of GetLogEvents pages read from each log stream when tailed
+LOG_PAGES_LIMIT = 5
+
+# Statuses of tasks whose containers have not yet started, which have no log events to read
+NOT_STARTED_STATUSES = ['PROVISIONING', 'PENDING', 'ACTIVATING']
+
+# Returns the awslogs log group and stream of each container of a task, for containers with a stream prefix
+def log_streams(task_definition, task_arn):
+  task_id = task_arn.split('/')[-1]
+  streams = []
+  for container in task_definition.get('containerDefinitions', []):
+    config = container.get('logConfiguration') or {}
+    options = config.get('options') or {}
+    if config.get('logDriver') == 'awslogs' and options.get('awslogs-stream-prefix'):
+      streams.append({
+        'TaskArn': task_arn,
+        'Container': container['name'],
+        'Group': options['awslogs-group'],
+        'Stream': '%s/%s/%s' % (options['awslogs-stream-prefix'], container['name'], task_id)
+      })
+  return streams
+
+# Adds the log streams of any tasks that are not yet tailed
+def add_streams(streams, task_definition, tasks):
+  tailed = set(s['TaskArn'] for s in streams)
+  for task_arn in [t['taskArn'] for t in tasks if t['taskArn'] not in tailed]:
+    streams += log_streams(task_definition, task_arn)
+  return streams
+
+# Returns the log streams to tail, skipping those of tasks that have not started and those read after their task stopped
+def active_streams(streams, tasks):
+  statuses = dict((t['taskArn'], t.get('lastStatus')) for t in tasks)
+  return [s for s in streams if not s.get('Complete') and statuses.get(s['TaskArn']) not in NOT_STARTED_STATUSES]
+
+# Marks the log streams of stopped tasks as complete, as no further events are written to them once they are read
+def complete_streams(streams, tasks):
+  stopped = set(t['taskArn'] for t in tasks if t.get('lastStatus') == 'STOPPED')
+  for stream in streams:
+    if stream['TaskArn'] in stopped:
+      stream['Complete'] = True
+
+class LogsManager:
+  """Tails CloudWatch Logs streams of task containers"""
+  client = ServiceClient('logs')
+
+  def __init__(self, max_workers=10):
+    self.max_workers = max_workers
+
+  def tail(self, stream):
+    '''
+    Reads the events written to a log stream since its forward token, updating the token of the stream.
+    A log stream that does not exist yet, such as for a task that has not started, is read from the start on the next tail.
+    Returns the new lines.
+    '''
+    new = []
+    for _ in range(LOG_PAGES_LIMIT):
+      args = dict(logGroupName=stream['Group'], logStreamName=stream['Stream'], startFromHead=True)
+      if stream.get('Token'):
+        args['nextToken'] = stream['Token']
+      try:
+        response = self.client.get_log_events(**args)
+      except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceNotFoundException':
+          raise
+        break
+      new += [e['message'] for e in response.get('events', [])]
+      # The forward token is unchanged once the end of the stream is reached
+      token = response.get('nextForwardToken')
+      if not token or token == stream.get('Token'):
+        break
+      stream['Token'] = token
+    return new
+
+  def tail_streams(self, streams, lines):
+    '''
+    Tails log streams concurrently, logging at most the given number of new lines of each stream.
+    '''
+    results = concurrent_map(self.tail, streams, self.max_workers)
+    for stream, new in zip(streams, results):
+      if len(new) > lines:
+        log.info("[%s] ... %d lines omitted", stream['Container'], len(new) - lines)
+      for line in new[-lines:]:
+        log.info("[%s] %s", stream['Container'], line)
+
+  def tail_tasks(self, streams, tasks, lines):
+    '''
+    Tails the log streams of tasks that have started, other than those already read after their task stopped.
+    '''
+    active = active_streams(streams, tasks)
+    self.tail_streams(active, lines)
+    complete_streams(active, tasks)
+
+  def read_last(self, stream, lines):
+    '''
+    Reads the last lines of a log stream, returning no lines if the stream cannot be read.
+    '''
+    try:
+      response = self.client.get_log_events(
+        logGroupName=stream['Group'], logStreamName=stream['Stream'], startFromHead=False, limit=lines
+      )
+    except ClientError as e:
+      log.warning("Unable to read log stream %s: %s", stream['Stream'], e)
+      return []
+    return [e['message'] for e in response.get('events', [])]
+
+  def last_lines(self, streams, task_arns, lines):
+    '''
+    Reads the last lines of the log streams of the given tasks concurrently, prefixed by container name.
+    '''
+    streams = [s for s in streams or [] if s['TaskArn'] in task_arns]
+    results = concurrent_map(lambda s: self.read_last(s, lines), streams, self.max_workers)
+    return ['[%s] %s' % (s['Container'], line) for s, last in zip(streams, results) for line in last]
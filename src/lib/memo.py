@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import errno
+import hashlib
+from .clients import ServiceClient
+from .serialization import dumps, loads
+
+# Container definition attributes that determine the result of a run
+FINGERPRINT_CONTAINER_KEYS = ['name','image','command','entryPoint']
+
+# Matches ECR image references without a digest, capturing the registry ID, repository and optional tag
+ECR_IMAGE_TAG = re.compile(r'^(\d{12})\.dkr\.ecr\.([a-z0-9-]+)\.amazonaws\.com(?:\.cn)?/([^:@]+)(?::([^:@]+))?$')
+
+# Returns the effective inputs of a run of a task definition, with environment variables sorted by name
+# Images are replaced by the digests they resolve to, if given
+def run_inputs(task_definition, overrides=None, count=1, digests=None):
+  digests = digests or {}
+  containers = [dict(
+    [(k, c.get(k)) for k in FINGERPRINT_CONTAINER_KEYS],
+    image=digests.get(c.get('image'), c.get('image')),
+    environment=sorted((e['name'], e['value']) for e in c.get('environment', []))
+  ) for c in task_definition.get('containerDefinitions', [])]
+  return {
+    'family': task_definition.get('family'),
+    'containers': sorted(containers, key=lambda c: c['name']),
+    'overrides': overrides or {},
+    'count': count
+  }
+
+def fingerprint(inputs):
+  '''
+  Returns a SHA-256 hash of run inputs, which is independent of the order of dictionary keys.
+  '''
+  return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ImageResolver:
+  """Resolves the images of task definitions to the digests they currently reference"""
+  client = ServiceClient('ecr')
+
+  def __init__(self, region=None):
+    self.region = region or os.environ.get('AWS_REGION')
+
+  def digest(self, image):
+    '''
+    Returns the digest of an image, which is the image itself if referenced by digest.
+    Images referenced by tag can only be resolved from ECR repositories in the region of the function, so other tagged
+    images are rejected, as a push to the tag would not change the fingerprint.
+    '''
+    if '@' in image:
+      return image
+    from voluptuous import Invalid
+    match = ECR_IMAGE_TAG.match(image)
+    if not match:
+      raise Invalid('Memoize requires images referenced by digest or in ECR, but %s is referenced by tag' % image)
+    registry_id, region, repository, tag = match.groups()
+    if self.region and region != self.region:
+      raise Invalid('Memoize requires images in other regions to be referenced by digest, but %s is referenced by tag' % image)
+    response = self.client.describe_images(registryId=registry_id, repositoryName=repository, imageIds=[{'imageTag': tag or 'latest'}])
+    return response['imageDetails'][0]['imageDigest']
+
+  # Returns the digest of each image of a task definition, keyed by image
+  def digests(self, task_definition):
+    images = set(c['image'] for c in task_definition.get('containerDefinitions', []) if c.get('image'))
+    return dict((i, self.digest(i)) for i in images)
+
+class DynamoDbRunStore:
+  """Records successful runs in a DynamoDB table with a string partition key called Fingerprint"""
+  client = ServiceClient('dynamodb')
+
+  def __init__(self, table_name=None):
+    self.table_name = table_name or os.environ.get('RUN_MEMO_TABLE')
+
+  def get_run(self, key):
+    response = self.client.get_item(
+      TableName=self.table_name,
+      Key={'Fingerprint': {'S': key}},
+      ConsistentRead=True
+    )
+    item = response.get('Item')
+    return loads(item['Run']['S']) if item else None
+
+  def put_run(self, key, run):
+    return self.client.put_item(
+      TableName=self.table_name,
+      Item={
+        'Fingerprint': {'S': key},
+        'Run': {'S': dumps(run)}
+      }
+    )
+
+class FileRunStore:
+  """Records successful runs as JSON files in a local directory"""
+  def __init__(self, path=None):
+    self.path = path or os.environ.get('RUN_MEMO_PATH', '/tmp/run-memo')
+
+  def get_run(self, key):
+    try:
+      with open(os.path.join(self.path, key + '.json')) as f:
+        return loads(f.read())
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+  # Runs are written to a temporary file and renamed, so a partially written run is never read
+  def put_run(self, key, run):
+    try:
+      os.makedirs(self.path)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+    path = os.path.join(self.path, key + '.json')
+    with open(path + '.tmp', 'w') as f:
+      f.write(dumps(run))
+    os.rename(path + '.tmp', path)
+
+class MemoryRunStore:
+  """Records successful runs in memory"""
+  def __init__(self):
+    self.runs = dict()
+
+  def get_run(self, key):
+    return self.runs.get(key)
+
+  def put_run(self, key, run):
+    self.runs[key] = run
+
+# Returns the run store configured by RUN_MEMO_STORE
+def get_run_store():
+  return {
+    'dynamodb': DynamoDbRunStore,
+    'file': FileRunStore,
+    'memory': MemoryRunStore
+  }[os.environ.get('RUN_MEMO_STORE', 'dynamodb')]()
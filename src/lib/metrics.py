@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from .serialization import dumps
+
+# Maximum number of values per metric accepted in a single Embedded Metric Format log line
+EMF_VALUES_LIMIT = 100
+
+# Metrics logger resolved on first use
+metrics = None
+
+class Metrics(object):
+  """Buffers metric values and writes them as CloudWatch Embedded Metric Format log lines"""
+  def __init__(self, namespace, stream=None):
+    self.namespace = namespace
+    self.stream = stream
+    self.values = OrderedDict()
+    self.lock = threading.Lock()
+
+  # Values are grouped by dimensions, so each set of dimensions is written as a single log line
+  def record(self, name, value, unit='Count', **dimensions):
+    key = tuple(sorted(dimensions.items()))
+    with self.lock:
+      metric = self.values.setdefault(key, OrderedDict()).setdefault(name, (unit, []))
+      metric[1].append(value)
+
+  def flush(self):
+    with self.lock:
+      values, self.values = self.values, OrderedDict()
+    stream = self.stream or sys.stdout
+    for key, metrics in values.items():
+      for line in self.format(dict(key), metrics):
+        stream.write(line + '\n')
+    stream.flush()
+
+  # Returns the log lines for a set of dimensions, splitting metrics with more values than a log line accepts
+  def format(self, dimensions, metrics):
+    count = max(len(v[1]) for v in metrics.values())
+    for start in range(0, count, EMF_VALUES_LIMIT):
+      batch = [(n, u, v[start:start + EMF_VALUES_LIMIT]) for n, (u, v) in metrics.items() if v[start:start + EMF_VALUES_LIMIT]]
+      data = {
+        '_aws': {
+          'Timestamp': int(time.time() * 1000),
+          'CloudWatchMetrics': [{
+            'Namespace': self.namespace,
+            'Dimensions': [sorted(dimensions)],
+            'Metrics': [{'Name': n, 'Unit': u} for n, u, _ in batch]
+          }]
+        }
+      }
+      data.update(dimensions)
+      data.update((n, v[0] if len(v) == 1 else v) for n, _, v in batch)
+      yield dumps(data)
+
+class NullMetrics(object):
+  """Discards metric values when metrics are disabled"""
+  def record(self, name, value, unit='Count', **dimensions):
+    pass
+
+  def flush(self):
+    pass
+
+# Returns the shared metrics logger, which discards metrics unless METRICS_ENABLED is set
+def get_metrics():
+  global metrics
+  if metrics is None:
+    if os.environ.get('METRICS_ENABLED', 'false').lower() == 'true':
+      metrics = Metrics(os.environ.get('METRICS_NAMESPACE', 'EcsTasks'))
+    else:
+      metrics = NullMetrics()
+  return metrics
+
+# Discards the shared metrics logger, so that it is resolved again on next use
+def reset_metrics():
+  global metrics
+  metrics = None
@@ -0,0 +1,120 @@
+import os
+import time
+import logging
+import threading
+from .ecs import EcsTaskManager, EcsTaskFailureError, EcsTaskExitCodeError, EcsTaskTimeoutError
+from .cfn import CfnManager
+from .results import task_outcomes, failed_outcomes
+
+log = logging.getLogger()
+
+class EcsTaskPool:
+  """Runs ECS and CloudFormation requests on a shared thread pool, returning futures"""
+  def __init__(self, task_mgr=None, cfn_mgr=None, max_workers=None):
+    self.task_mgr = task_mgr or EcsTaskManager()
+    self.cfn_mgr = cfn_mgr or CfnManager()
+    # Requests share the connection pool of each client, so are bounded by its size
+    self.max_workers = max_workers or int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', 25))
+    self.executor = None
+    self.lock = threading.Lock()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  # Runs a function on the shared thread pool, which is created on first use
+  def submit(self, func, *args, **kwargs):
+    with self.lock:
+      if self.executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+      return self.executor.submit(func, *args, **kwargs)
+
+  def close(self):
+    with self.lock:
+      if self.executor is not None:
+        self.executor.shutdown()
+        self.executor = None
+
+  def start_task(self, **kwargs):
+    return self.submit(self.task_mgr.start_task, **kwargs)
+
+  def describe_tasks(self, cluster, tasks):
+    return self.submit(self.task_mgr.describe_tasks, cluster=cluster, tasks=tasks)
+
+  def list_tasks(self, cluster, **kwargs):
+    return self.submit(lambda: list(self.task_mgr.list_tasks(cluster=cluster, **kwargs)))
+
+  def stop_task(self, cluster, task, reason='unknown'):
+    return self.submit(self.task_mgr.stop_task, cluster=cluster, task=task, reason=reason)
+
+  def describe_task_definition(self, task_definition):
+    return self.submit(self.task_mgr.describe_task_definition, task_definition)
+
+  def get_stack_status(self, stack_name):
+    return self.submit(self.cfn_mgr.get_stack_status, stack_name)
+
+  def poll(self, task_sets, interval=10, remaining_time=None):
+    '''
+    Polls task sets until their tasks stop, returning a future for each task set.
+    Each task set has a 'Cluster' and a 'TaskResult' with the started 'tasks', and optionally a 'TaskDefinition' whose
+    non-essential containers are ignored, a 'CreationTime' and a 'Timeout'.
+    The tasks of all task sets that have not yet stopped are described together on each poll, from a single polling thread.
+    A future resolves to the task result of its task set, with the 'outcomes' of its tasks, once all of its tasks succeed,
+    or raises EcsTaskExitCodeError or EcsTaskTimeoutError.  Futures of task sets that have not stopped once 'remaining_time' (in milliseconds) falls below
+    the poll interval resolve to None, so that the task sets can be polled again by another invocation.
+    '''
+    from concurrent.futures import Future
+    futures = [Future() for _ in task_sets]
+    thread = threading.Thread(target=self.poll_task_sets, args=(task_sets, futures, interval, remaining_time))
+    thread.daemon = True
+    thread.start()
+    return futures
+
+  def poll_task_sets(self, task_sets, futures, interval, remaining_time):
+    pending = list(zip(task_sets, futures))
+    try:
+      while True:
+        result = self.task_mgr.bulk_describe_tasks([(s['Cluster'], t['taskArn']) for s, _ in pending for t in s['TaskResult']['tasks']])
+        described = dict((t['taskArn'], t) for t in result['tasks'])
+        failures = dict((f.get('arn'), f) for f in result['failures'])
+        polling = []
+        for task_set, future in pending:
+          task_set['TaskResult']['tasks'] = [described.get(t['taskArn'], t) for t in task_set['TaskResult']['tasks']]
+          task_set['TaskResult']['failures'] = [failures[t['taskArn']] for t in task_set['TaskResult']['tasks'] if t['taskArn'] in failures]
+          if not self.check_task_set(task_set, future):
+            polling.append((task_set, future))
+        pending = polling
+        if not pending:
+          return
+        if remaining_time and remaining_time() < (interval + 5) * 1000:
+          for _, future in pending:
+            future.set_result(None)
+          return
+        log.info("%d task set(s) have not yet completed, checking again in %s seconds..." % (len(pending), interval))
+        time.sleep(interval)
+    except Exception as e:
+      for _, future in pending:
+        future.set_exception(e)
+
+  # Resolves the future of a task set once its tasks stop, fail to be described or time out, returning whether it was resolved
+  def check_task_set(self, task_set, future):
+    tasks = task_set['TaskResult']['tasks']
+    if task_set['TaskResult']['failures']:
+      future.set_exception(EcsTaskFailureError(task_set['TaskResult']))
+    elif task_set.get('Timeout') and task_set['CreationTime'] + task_set['Timeout'] < int(time.time()):
+      future.set_exception(EcsTaskTimeoutError(tasks, task_set['CreationTime'], task_set['Timeout']))
+    elif all(t.get('lastStatus') == 'STOPPED' for t in tasks):
+      task_definition = self.task_mgr.describe_task_definition(task_set['TaskDefinition']) if task_set.get('TaskDefinition') else None
+      outcomes = task_outcomes(tasks, task_definition)
+      failed = [o['TaskArn'] for o in failed_outcomes(outcomes)]
+      if failed:
+        future.set_exception(EcsTaskExitCodeError(tasks, failed, outcomes=outcomes))
+      else:
+        task_set['TaskResult']['outcomes'] = outcomes
+        future.set_result(task_set['TaskResult'])
+    else:
+      return False
+    return True
@@ -0,0 +1,60 @@
+import os
+import logging
+from .clients import ServiceClient
+from .serialization import dumps
+
+log = logging.getLogger()
+
+# Maximum delay of an SQS message in seconds
+MAX_DELAY_SECONDS = 900
+
+# Maximum length of the cause of a Step Functions task failure
+MAX_CAUSE_LENGTH = 32768
+
+# Error reported to Step Functions for a task set that failed
+TASK_SET_ERROR = 'TaskSetFailed'
+
+class TaskSetQueue:
+  """Sends supervised task sets that have not stopped back to their queue and delivers the results of complete task sets"""
+  sqs = ServiceClient('sqs')
+  sfn = ServiceClient('stepfunctions')
+
+  def __init__(self, result_queue_url=None):
+    self.result_queue_url = result_queue_url or os.environ.get('SUPERVISOR_RESULT_QUEUE_URL')
+    self.queue_urls = dict()
+
+  # Returns the URL of the queue a record was received from, based on its event source ARN
+  def queue_url(self, record):
+    arn = record['eventSourceARN']
+    url = self.queue_urls.get(arn)
+    if url is None:
+      account, name = arn.split(':')[4:6]
+      url = self.queue_urls[arn] = self.sqs.get_queue_url(QueueName=name, QueueOwnerAWSAccountId=account)['QueueUrl']
+    return url
+
+  # Returns true if the result of a task set can be delivered once it is complete
+  def can_deliver(self, task_set):
+    return bool(task_set.get('TaskToken') or self.result_queue_url)
+
+  def requeue(self, record, task_set):
+    '''
+    Sends an updated task set to the queue of the record it was received from, delayed until its next check.
+    '''
+    self.sqs.send_message(
+      QueueUrl=self.queue_url(record),
+      MessageBody=dumps(task_set),
+      DelaySeconds=min(int(task_set.get('NextPoll') or 0), MAX_DELAY_SECONDS)
+    )
+
+  def deliver(self, task_set):
+    '''
+    Delivers the result of a complete task set to the Step Functions task token of the task set if given,
+    otherwise to the result queue.
+    '''
+    token = task_set.get('TaskToken')
+    if token and task_set['Status'] == 'FAILED':
+      self.sfn.send_task_failure(taskToken=token, error=TASK_SET_ERROR, cause=(task_set.get('Reason') or '')[:MAX_CAUSE_LENGTH])
+    elif token:
+      self.sfn.send_task_success(taskToken=token, output=dumps(task_set))
+    else:
+      self.sqs.send_message(QueueUrl=self.result_queue_url, MessageBody=dumps(task_set))
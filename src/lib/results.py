@@ -0,0 +1,76 @@
+# Outcomes of a stopped task
+SUCCEEDED = 'Succeeded'
+APPLICATION_ERROR = 'ApplicationError'
+OUT_OF_MEMORY = 'OutOfMemory'
+IMAGE_PULL_ERROR = 'ImagePullError'
+STARTUP_ERROR = 'StartupError'
+SPOT_INTERRUPTION = 'SpotInterruption'
+INFRASTRUCTURE_ERROR = 'InfrastructureError'
+USER_STOPPED = 'UserStopped'
+UNKNOWN = 'Unknown'
+
+# Outcomes caused by the capacity a task ran on rather than the task itself, which may succeed when run again
+RETRYABLE_OUTCOMES = [SPOT_INTERRUPTION, INFRASTRUCTURE_ERROR]
+
+# Stop codes of tasks stopped because their capacity was reclaimed
+INTERRUPTION_STOP_CODES = ['SpotInterruption', 'TerminationNotice']
+
+# Error prefixes of container and task stopped reasons for tasks that failed to start
+STARTUP_ERRORS = ['CannotStartContainerError', 'CannotCreateContainerError', 'CannotInspectContainerError', 'ResourceInitializationError']
+
+# Returns the names of the containers of a task definition that are not essential, which may exit without failing the task
+def non_essential_containers(task_definition):
+  return set(c.get('name') for c in (task_definition or {}).get('containerDefinitions', []) if c.get('essential') is False)
+
+# Returns the outcome of a stopped task, ignoring the exit codes and reasons of non-essential containers
+def classify_task(task, non_essential=()):
+  containers = [c for c in task.get('containers', []) if c.get('name') not in non_essential]
+  reasons = [task.get('stoppedReason') or ''] + [c.get('reason') or '' for c in containers]
+  if task.get('stopCode') in INTERRUPTION_STOP_CODES:
+    return SPOT_INTERRUPTION
+  if any('OutOfMemoryError' in r for r in reasons):
+    return OUT_OF_MEMORY
+  if any('CannotPullContainerError' in r for r in reasons):
+    return IMAGE_PULL_ERROR
+  if task.get('stopCode') == 'TaskFailedToStart' or any(e in r for e in STARTUP_ERRORS for r in reasons):
+    return STARTUP_ERROR
+  if all(c.get('exitCode') == 0 for c in containers):
+    return SUCCEEDED
+  if task.get('stopCode') == 'UserInitiated':
+    return USER_STOPPED
+  if task.get('stopCode') == 'ServiceSchedulerInitiated' or task.get('stoppedReason', '').startswith('Host EC2'):
+    return INFRASTRUCTURE_ERROR
+  if any(c.get('exitCode') not in [0, None] for c in containers):
+    return APPLICATION_ERROR
+  return UNKNOWN
+
+def task_outcome(task, non_essential=()):
+  '''
+  Returns a compact summary of the outcome of a stopped task, with the exit codes and reasons of essential containers
+  that did not exit with a zero exit code.
+  '''
+  outcome = classify_task(task, non_essential)
+  summary = {
+    'TaskArn': task.get('taskArn'),
+    'Outcome': outcome,
+    'Retryable': outcome in RETRYABLE_OUTCOMES
+  }
+  if task.get('stopCode'):
+    summary['StopCode'] = task['stopCode']
+  if task.get('stoppedReason'):
+    summary['StoppedReason'] = task['stoppedReason']
+  failed = [c for c in task.get('containers', []) if c.get('name') not in non_essential and c.get('exitCode') != 0]
+  if outcome != SUCCEEDED and failed:
+    summary['Containers'] = [dict(
+      [('Name', c.get('name'))] + [(k, c[a]) for k, a in [('ExitCode', 'exitCode'), ('Reason', 'reason')] if c.get(a) is not None]
+    ) for c in failed]
+  return summary
+
+# Returns the outcome summaries of stopped tasks
+def task_outcomes(tasks, task_definition=None):
+  non_essential = non_essential_containers(task_definition)
+  return [task_outcome(t, non_essential) for t in tasks]
+
+# Returns the outcome summaries of tasks that did not succeed
+def failed_outcomes(outcomes):
+  return [o for o in outcomes if o['Outcome'] != SUCCEEDED]
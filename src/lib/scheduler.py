@@ -0,0 +1,34 @@
+import random
+
+# Number of polls made at the base interval after tasks start running
+RUNNING_FAST_POLLS = 2
+
+# Polls at the base interval
+def fixed_interval(attempt, status, interval, max_interval):
+  return interval
+
+# Doubles the interval on each poll up to the maximum interval, with jitter
+def exponential_interval(attempt, status, interval, max_interval):
+  capped = min(max(interval, max_interval), interval * 2 ** min(attempt, 16))
+  return max(interval, int(round(random.uniform(capped / 2.0, capped))))
+
+# Polls at the base interval while tasks are starting, then backs off while tasks are running
+def status_interval(attempt, status, interval, max_interval):
+  if status == 'RUNNING' and attempt >= RUNNING_FAST_POLLS:
+    return exponential_interval(attempt - RUNNING_FAST_POLLS + 1, status, interval, max_interval)
+  return interval
+
+# Poll strategies keyed by the PollStrategy property value
+STRATEGIES = {
+  'Fixed': fixed_interval,
+  'Exponential': exponential_interval,
+  'Status': status_interval
+}
+
+# Counts consecutive polls for the same aggregate task status
+def next_attempt(attempt, previous_status, status):
+  return attempt + 1 if status == previous_status else 0
+
+# Returns the number of seconds to wait before the next poll
+def poll_interval(strategy, attempt, status, interval, max_interval):
+  return STRATEGIES[strategy](attempt, status, interval, max_interval)
@@ -0,0 +1,73 @@
+import os
+import json
+from datetime import datetime
+
+# Types that are serialized as JSON without conversion
+SCALAR_TYPES = frozenset(type(v) for v in [None, True, 0, 2 ** 64, 0.0, '', u''])
+STRING_TYPES = frozenset(type(v) for v in ['', u''])
+
+# Optional JSON backends, in order of preference, used when installed unless JSON_BACKEND is set to 'json'
+FAST_BACKENDS = ['orjson', 'ujson']
+
+# JSON backend resolved on first use
+backend = None
+
+# Converts values that JSON does not support, such as the datetimes returned by boto3
+def default(value):
+  return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def normalize(value):
+  '''
+  Returns a copy of a JSON-like structure with datetimes as ISO 8601 strings and any other unsupported values as strings.
+  This is equivalent to a JSON round trip using the default conversion, in a single pass without serializing and parsing.
+  '''
+  kind = type(value)
+  if kind in SCALAR_TYPES:
+    return value
+  # Scalar values are checked inline to avoid a call for each value
+  if kind is dict:
+    return {(k if type(k) in STRING_TYPES else str(k)): (v if type(v) in SCALAR_TYPES else normalize(v)) for k, v in value.items()}
+  if kind is list or kind is tuple:
+    return [v if type(v) in SCALAR_TYPES else normalize(v) for v in value]
+  if isinstance(value, dict):
+    return normalize(dict(value))
+  if isinstance(value, (list, tuple)):
+    return normalize(list(value))
+  return default(value)
+
+# Returns the name and module of the JSON backend, preferring an installed fast backend
+def get_backend():
+  global backend
+  if backend is None:
+    names = FAST_BACKENDS if os.environ.get('JSON_BACKEND', 'auto') == 'auto' else [os.environ['JSON_BACKEND']]
+    for name in names:
+      try:
+        backend = (name, __import__(name))
+        break
+      except ImportError:
+        pass
+    else:
+      backend = ('json', json)
+  return backend
+
+def dumps(data):
+  '''
+  Serializes data as JSON, converting datetimes and other unsupported values as strings.
+  '''
+  name, module = get_backend()
+  if name == 'orjson':
+    return module.dumps(data, default=default).decode('utf-8')
+  if name == 'ujson':
+    return module.dumps(normalize(data), escape_forward_slashes=False)
+  return json.dumps(data, default=default)
+
+def loads(data):
+  return get_backend()[1].loads(data)
+
+class JsonFormatter(object):
+  """Serializes data as JSON only when formatted, so log records that are never emitted are not serialized"""
+  def __init__(self, data):
+    self.data = data
+
+  def __str__(self):
+    return dumps(self.data)
@@ -0,0 +1,102 @@
+import os
+import time
+from botocore.exceptions import ClientError
+from .clients import ServiceClient
+from .serialization import dumps, loads
+
+# Seconds after which a claim on a state is considered abandoned, such as by an invocation that timed out
+CLAIM_TIMEOUT = 300
+
+class TaskStateManager:
+  """Handles persisted task state"""
+  client = ServiceClient('dynamodb')
+
+  def __init__(self, table_name=None):
+    self.table_name = table_name or os.environ.get('TASK_STATE_TABLE')
+
+  def put_state(self, key, state):
+    return self.client.put_item(
+      TableName=self.table_name,
+      Item={
+        'StartedBy': {'S': key},
+        'State': {'S': dumps(state)}
+      }
+    )
+
+  def get_state(self, key):
+    response = self.client.get_item(
+      TableName=self.table_name,
+      Key={'StartedBy': {'S': key}},
+      ConsistentRead=True
+    )
+    item = response.get('Item')
+    return loads(item['State']['S']) if item else None
+
+  # Returns a generator of (key, state) pairs of all persisted states, scanning the table page by page
+  def list_states(self):
+    args = dict(TableName=self.table_name, ConsistentRead=True)
+    while True:
+      response = self.client.scan(**args)
+      for item in response.get('Items', []):
+        yield item['StartedBy']['S'], loads(item['State']['S'])
+      if not response.get('LastEvaluatedKey'):
+        return
+      args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+  # Replaces a persisted state unless it was removed or claimed for completion by another invocation
+  def update_state(self, key, state):
+    try:
+      self.client.update_item(
+        TableName=self.table_name,
+        Key={'StartedBy': {'S': key}},
+        UpdateExpression='SET #state = :state',
+        ConditionExpression='attribute_exists(StartedBy) AND attribute_not_exists(Completing)',
+        ExpressionAttributeNames={'#state': 'State'},
+        ExpressionAttributeValues={':state': {'S': dumps(state)}}
+      )
+    except ClientError as e:
+      if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+        raise
+
+  def claim_state(self, key, timeout=CLAIM_TIMEOUT):
+    '''
+    Claims a persisted state for completion, so that only one invocation responds to its request.
+    Returns False if the state was removed or is claimed by another invocation within the claim timeout.
+    '''
+    now = int(time.time())
+    try:
+      self.client.update_item(
+        TableName=self.table_name,
+        Key={'StartedBy': {'S': key}},
+        UpdateExpression='SET Completing = :now',
+        ConditionExpression='attribute_exists(StartedBy) AND (attribute_not_exists(Completing) OR Completing < :expired)',
+        ExpressionAttributeValues={':now': {'N': str(now)}, ':expired': {'N': str(now - timeout)}}
+      )
+    except ClientError as e:
+      if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+        raise
+      return False
+    return True
+
+  # Releases the claim on a persisted state, so that its completion is retried
+  def release_state(self, key):
+    try:
+      self.client.update_item(
+        TableName=self.table_name,
+        Key={'StartedBy': {'S': key}},
+        UpdateExpression='REMOVE Completing',
+        ConditionExpression='attribute_exists(StartedBy)'
+      )
+    except ClientError as e:
+      if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+        raise
+
+  # Returns the deleted state, or None if another invocation already removed it
+  def delete_state(self, key):
+    response = self.client.delete_item(
+      TableName=self.table_name,
+      Key={'StartedBy': {'S': key}},
+      ReturnValues='ALL_OLD'
+    )
+    item = response.get('Attributes')
+    return loads(item['State']['S']) if item else None
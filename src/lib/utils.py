@@ -1,15 +1,54 @@
-def paginated_response(func, result_key, next_token=None):
+from datetime import datetime
+
+def paginate(func, result_key, next_token=None, max_items=None):
   '''
-  Returns expanded response for paginated operations.
-  The 'result_key' is used to define the concatenated results that are combined from each paginated response.
+  Yields the items of paginated operations page by page, requesting each page only when needed.
+  The 'result_key' is used to define the items that are yielded from each paginated response.
+  Iteration stops after 'max_items' items when specified.
   '''
   args=dict()
-  if next_token:
+  count = 0
+  while max_items is None or count < max_items:
+    if next_token:
       args['NextToken'] = next_token
-  response = func(**args)
-  result = response.get(result_key)
-  next_token = response.get('NextToken')
-  if not next_token:
-    return result
-  return result + paginated_response(func, result_key, next_token)
-  
\ No newline at end of file
+    response = func(**args)
+    for item in response.get(result_key) or []:
+      yield item
+      count += 1
+      if max_items is not None and count >= max_items:
+        return
+    next_token = response.get('NextToken')
+    if not next_token:
+      return
+
+def paginated_response(func, result_key, next_token=None, max_items=None):
+  '''
+  Returns expanded response for paginated operations.
+  The 'result_key' is used to define the concatenated results that are combined from each paginated response.
+  '''
+  return list(paginate(func, result_key, next_token, max_items))
+
+def chunks(items, size):
+  '''
+  Splits a list into consecutive lists of at most 'size' items.
+  '''
+  return [items[i:i + size] for i in range(0, len(items), size)]
+
+def concurrent_map(func, items, max_workers):
+  '''
+  Applies 'func' to each item using a bounded thread pool and returns the results in item order.
+  A single item is run in the calling thread.
+  '''
+  items = list(items)
+  if len(items) <= 1 or max_workers <= 1:
+    return [func(i) for i in items]
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+    return list(executor.map(func, items))
+
+def parse_timestamp(value):
+  '''
+  Parses an ISO 8601 UTC timestamp, such as the CreateTimestamp generated by create_task, into a naive UTC datetime.
+  '''
+  value = value.replace('+00:00', '').rstrip('Z')
+  return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
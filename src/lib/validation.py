@@ -1,4 +1,11 @@
-from voluptuous import Required, All, Any, Range, Schema, Length
+import os
+from hashlib import md5
+
+# Compiled validators, built on first use and reused across warm invocations
+validators = dict()
+
+# Schema version, derived from this module so that any schema change invalidates stamped events
+schema_versions = []
 
 def ToInt(value):
   if isinstance(value, int):
@@ -19,30 +26,80 @@ def ToBool(value):
     raise ValueError
 
 # For Overrides, which must specify all values as strings
+# Nodes that already only hold strings are returned as is rather than copied
 def DictToString(value):
   def string_values(node):
+    if isinstance(node, basestring):
+      return node
     if type(node) is dict:
-      result={}
+      result = None
       for k,v in node.iteritems():
-        result[k] = string_values(v)
-    elif type(node) is list:
-      result=[]
-      for v in node:
-        result.append(string_values(v))
-    else:
-      result = str(node)
-    return result
+        s = string_values(v)
+        if s is not v:
+          result = result or dict(node)
+          result[k] = s
+      return node if result is None else result
+    if type(node) is list:
+      result = [string_values(v) for v in node]
+      return node if all(s is v for s, v in zip(result, node)) else result
+    return str(node)
   if isinstance(value, dict):
     return string_values(value)
   else:
     raise ValueError
 
+# Task graph entries must have unique names and only depend on other entries, without any cycles
+def TaskGraph(value):
+  from voluptuous import Invalid
+  names = [t['Name'] for t in value]
+  if len(set(names)) != len(names):
+    raise Invalid('task graph names must be unique')
+  dependencies = dict((t['Name'], t['DependsOn']) for t in value)
+  unknown = [d for t in value for d in t['DependsOn'] if d not in dependencies]
+  if unknown:
+    raise Invalid('task graph dependencies %s are not defined' % unknown)
+  resolved = set()
+  while len(resolved) < len(names):
+    ready = [n for n in names if n not in resolved and all(d in resolved for d in dependencies[n])]
+    if not ready:
+      raise Invalid('task graph dependencies of %s form a cycle' % sorted(set(names) - resolved))
+    resolved.update(ready)
+  return value
+
+# Maximum number of tasks run by a custom resource, whose task state is persisted in re-invocation payloads of at most
+# 256KB and in DynamoDB items of at most 400KB
+CFN_MAX_COUNT = 100
+
+# Resources must specify either a task definition or a task graph, which is polled to completion
+def TaskDefinitionOrGraph(value):
+  from voluptuous import Invalid
+  if not value.get('TaskDefinition') and not value.get('TaskGraph'):
+    raise Invalid('either TaskDefinition or TaskGraph must be specified')
+  if value.get('TaskGraph') and not value['Timeout']:
+    raise Invalid('a TaskGraph requires a Timeout greater than 0')
+  if value.get('TaskGraph') and value['CompletionMode'] == 'Event':
+    raise Invalid('a TaskGraph requires a CompletionMode of Poll')
+  if value.get('TaskGraph') and value['Instances']:
+    raise Invalid('Instances cannot be specified with a TaskGraph')
+  if sum(t['Count'] for t in value.get('TaskGraph', [])) > CFN_MAX_COUNT:
+    raise Invalid('a TaskGraph can run at most %d tasks in total' % CFN_MAX_COUNT)
+  return value
+
 # Validation Helper
 def get_cfn_validator():
-  return Schema({
+  from voluptuous import Required, Optional, All, Any, Range, Schema, Length
+  graph_task = {
+    Required('Name'): Any(str, unicode),
+    Required('TaskDefinition'): Any(str, unicode),
+    Required('Overrides', default=dict()): All(DictToString),
+    Required('Count', default=1): All(ToInt, Range(min=1, max=CFN_MAX_COUNT)),
+    Required('DependsOn', default=list()): All([Any(str, unicode)])
+  }
+  return Schema(All({
   Required('Cluster'): Any(str, unicode),
-  Required('TaskDefinition'): Any(str, unicode),
-  Required('Count', default=1): All(ToInt, Range(min=0, max=10)),
+  Optional('TaskDefinition'): Any(str, unicode),
+  Required('TaskGraph', default=list()): All([graph_task], Length(max=20), TaskGraph),
+  Required('Count', default=1): All(ToInt, Range(min=0, max=CFN_MAX_COUNT)),
   Required('RunOnUpdate', default=True): All(ToBool),
   Required('UpdateCriteria', default=[]): All([Schema({
     Required('Container'): Any(str, unicode),
@@ -52,31 +109,100 @@ def get_cfn_validator():
   Required('RunOnRollback', default=True): All(ToBool),
   Required('Timeout', default=290): All(ToInt, Range(min=0, max=3600)),
   Required('PollInterval', default=10): All(ToInt, Range(min=10, max=60)),
+  Required('MaxPollInterval', default=60): All(ToInt, Range(min=10, max=600)),
+  Required('PollStrategy', default='Fixed'): Any('Fixed','Exponential','Status'),
   Required('Overrides', default=dict()): All(DictToString),
   Required('Instances', default=list()): All(list, Length(max=10)),
-}, extra=True)
+  Required('LaunchType', default='EC2'): Any('EC2','FARGATE'),
+  Required('NetworkConfiguration', default=dict()): All(dict),
+  Required('CompletionMode', default='Poll'): Any('Poll','Event'),
+  Required('WaitOnDelete', default=False): All(ToBool),
+  Required('Memoize', default=False): All(ToBool),
+  Required('StreamLogs', default=False): All(ToBool),
+  Required('LogLines', default=20): All(ToInt, Range(min=1, max=100)),
+}, TaskDefinitionOrGraph), extra=True)
+
+# Maximum number of tasks run by an event, whose task state with the outcomes and last log lines of failed tasks is
+# returned in Step Functions payloads of at most 256KB
+ECS_MAX_COUNT = 300
+
+# Events must specify either a task definition or a batch of task specs
+def TaskDefinitionOrSpecs(value):
+  from voluptuous import Invalid
+  if not value.get('TaskDefinition') and not value.get('TaskSpecs'):
+    raise Invalid('either TaskDefinition or TaskSpecs must be specified')
+  if sum(s['Count'] for s in value.get('TaskSpecs', [])) > ECS_MAX_COUNT:
+    raise Invalid('TaskSpecs can run at most %d tasks in total' % ECS_MAX_COUNT)
+  return value
 
 # Validation Helper
+# Task specs without a LaunchType or NetworkConfiguration use the values of the event
 def get_ecs_validator():
-  return Schema({
+  from voluptuous import Required, Optional, All, Any, Range, Schema, Length
+  task_spec = {
+    Optional('Name'): Any(str, unicode),
+    Required('TaskDefinition'): Any(str, unicode),
+    Required('Count', default=1): All(ToInt, Range(min=1, max=ECS_MAX_COUNT)),
+    Required('Overrides', default=dict()): All(DictToString),
+    Required('Instances', default=list()): All(list, Length(max=10)),
+    Optional('LaunchType'): Any('EC2','FARGATE'),
+    Optional('NetworkConfiguration'): All(dict),
+    Required('Tasks', default=list()): All(list),
+    Required('LaunchFailures', default=list()): All(list),
+    Required('Queued', default=0): All(ToInt, Range(min=0)),
+    Required('LaunchRetries', default=dict()): All(dict),
+    Required('Status', default=''): Any(str, unicode)
+  }
+  return Schema(All({
   Required('Cluster'): Any(str, unicode),
-  Required('TaskDefinition'): Any(str, unicode),
-  Required('Count', default=1): All(ToInt, Range(min=1, max=10)),
+  Optional('TaskDefinition'): Any(str, unicode),
+  Required('TaskSpecs', default=list()): All([task_spec], Length(max=50)),
+  Required('Count', default=1): All(ToInt, Range(min=1, max=ECS_MAX_COUNT)),
   Required('Overrides', default=dict()): All(DictToString),
   Required('Instances', default=list()): All(list, Length(max=10)),
+  Required('LaunchType', default='EC2'): Any('EC2','FARGATE'),
+  Required('NetworkConfiguration', default=dict()): All(dict),
   Required('Tasks', default=list()): All(list),
+  Required('LaunchFailures', default=list()): All(list),
+  Required('AdmissionMode', default='Immediate'): Any('Immediate','Capacity'),
+  Required('Queued', default=0): All(ToInt, Range(min=0)),
+  Required('LaunchRetries', default=dict()): All(dict),
+  Required('FullTaskDetail', default=False): All(ToBool),
+  Required('Memoize', default=False): All(ToBool),
+  Required('StreamLogs', default=False): All(ToBool),
+  Required('LogLines', default=20): All(ToInt, Range(min=1, max=100)),
   Required('Status', default=''): Any(str, unicode),
   Required('StartedBy', default='admin'): Any(str, unicode),
   Required('Timeout', default=3600): All(ToInt, Range(min=60, max=604800)),
-  Required('Poll', default=10): All(ToInt, Range(min=10, max=3600))
-}, extra=True)
+  Required('Poll', default=10): All(ToInt, Range(min=10, max=3600)),
+  Required('MaxPoll', default=300): All(ToInt, Range(min=10, max=3600)),
+  Required('PollStrategy', default='Fixed'): Any('Fixed','Exponential','Status'),
+  Required('PollAttempt', default=0): All(ToInt, Range(min=0))
+}, TaskDefinitionOrSpecs), extra=True)
+
+# Returns the compiled validator for a given schema
+def get_validator(name):
+  validator = validators.get(name)
+  if validator is None:
+    validator = validators[name] = {'cfn': get_cfn_validator, 'ecs': get_ecs_validator}[name]()
+  return validator
+
+# Returns a hash of the validation module source
+def get_schema_version():
+  if not schema_versions:
+    with open(os.path.splitext(__file__)[0] + '.py', 'rb') as source:
+      schema_versions.append(md5(source.read()).hexdigest())
+  return schema_versions[0]
 
 # Validation Helper
+# Events already validated against the current schema (e.g. by create_task) are stamped and not validated again
 def validate_ecs(data):
-  request_validator = get_ecs_validator()
-  return request_validator(data)
+  if data.get('SchemaVersion') == get_schema_version():
+    return data
+  result = get_validator('ecs')(data)
+  result['SchemaVersion'] = get_schema_version()
+  return result
 
 # Validation Helper
 def validate_cfn(data):
-  request_validator = get_cfn_validator()
-  return request_validator(data)
\ No newline at end of file
+  return get_validator('cfn')(data)
\ No newline at end of file
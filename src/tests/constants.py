@@ -11,10 +11,14 @@ REQUEST_ID = str(uuid4())
 RESOURCE_TYPE = 'Custom::LogGroup'
 FUNCTION_NAME = 'cfnEcsTasks'
 FUNCTION_ARN = 'arn:aws:lambda:%s:%s:function:%s-%s' % (AWS_REGION, AWS_ACCOUNT_ID, STACK_NAME, FUNCTION_NAME)
+QUEUE_ARN = 'arn:aws:sqs:%s:%s:task-sets' % (AWS_REGION, AWS_ACCOUNT_ID)
+QUEUE_URL = 'https://sqs.%s.amazonaws.com/%s/task-sets' % (AWS_REGION, AWS_ACCOUNT_ID)
+RESULT_QUEUE_URL = 'https://sqs.%s.amazonaws.com/%s/task-set-results' % (AWS_REGION, AWS_ACCOUNT_ID)
 CLUSTER_NAME = 'my-stack-ApplicationCluster'
 OLD_TASK_DEFINITION_ARN = u'arn:aws:ecs:%s:%s:task-definition/my-stack-AdhocTaskDefinition:1' % (AWS_REGION, AWS_ACCOUNT_ID)
 NEW_TASK_DEFINITION_ARN = u'arn:aws:ecs:%s:%s:task-definition/my-stack-AdhocTaskDefinition:2' % (AWS_REGION, AWS_ACCOUNT_ID)
 MEMORY_LIMIT = '128'
+LOG_GROUP = 'my-stack-ApplicationLogGroup'
 STACK_ID = 'arn:aws:cloudformation:%s:%s:stack/%s/%s' % (AWS_REGION, AWS_ACCOUNT_ID, STACK_NAME, str(uuid4()))
 LOGICAL_RESOURCE_ID = 'MyEcsTask'
 PHYSICAL_RESOURCE_ID = 'arn:aws:ecs:%s:%s:task/96052dc0-a646-4068-86d5-4c947b9a88b5' % (AWS_REGION, AWS_ACCOUNT_ID)
@@ -113,4 +117,36 @@ DESCRIBE_STACKS_RESULT = {
 
 LIST_TASKS_RESULT = {
   'taskArns': [ PHYSICAL_RESOURCE_ID ]
-}
\ No newline at end of file
+}
+DESCRIBE_IMAGES_RESULT = {
+  'imageDetails': [{
+    'registryId': str(AWS_ACCOUNT_ID),
+    'repositoryName': 'org/my-app',
+    'imageDigest': 'sha256:0b1c4c3f3ac4f8e3e4b5a2f9e8d7c6b5a4f3e2d1c0b9a8f7e6d5c4b3a2f1e0d9',
+    'imageTags': ['latest']
+  }]
+}
+TASK_STATE_CHANGE_EVENT = {
+  'version': '0',
+  'id': str(uuid4()),
+  'detail-type': 'ECS Task State Change',
+  'source': 'aws.ecs',
+  'account': str(AWS_ACCOUNT_ID),
+  'time': UTC.isoformat() + 'Z',
+  'region': AWS_REGION,
+  'resources': [ PHYSICAL_RESOURCE_ID ],
+  'detail': {
+    'clusterArn': 'arn:aws:ecs:%s:%s:cluster/%s' % (AWS_REGION, AWS_ACCOUNT_ID, CLUSTER_NAME),
+    'taskArn': PHYSICAL_RESOURCE_ID,
+    'taskDefinitionArn': OLD_TASK_DEFINITION_ARN,
+    'lastStatus': 'STOPPED',
+    'desiredStatus': 'STOPPED',
+    'stoppedReason': 'Essential container in task exited',
+    'containers': [{
+      'name': 'app',
+      'taskArn': PHYSICAL_RESOURCE_ID,
+      'lastStatus': 'STOPPED',
+      'exitCode': 0
+    }]
+  }
+}
@@ -5,7 +5,7 @@ import mock
 import datetime
 from dateutil.tz import tzutc
 from uuid import uuid4
-from lib import EcsTaskManager, CfnManager
+from lib import EcsTaskManager, CfnManager, TaskStateManager, ImageResolver, TaskSetQueue
 from constants import *
 
 # Patched create_task module
@@ -14,9 +14,13 @@ def create_task():
   with mock.patch('boto3.client') as client:
     import create_task
     client.run_task.return_value = START_TASK_RESULT
+    client.describe_images.return_value = DESCRIBE_IMAGES_RESULT
     task_mgr = EcsTaskManager()
     task_mgr.client = client
+    task_mgr.task_definition_cache.clear()
     create_task.task_mgr = task_mgr
+    create_task.image_resolver = ImageResolver()
+    create_task.image_resolver.client = client
     yield create_task
 
 # Patched check_task module
@@ -25,9 +29,15 @@ def check_task():
   with mock.patch('boto3.client') as client:
     import check_task
     client.describe_tasks.return_value = RUNNING_TASK_RESULT
+    client.describe_task_definition.side_effect = lambda taskDefinition: TASK_DEFINITION_RESULTS.get(taskDefinition, OLD_TASK_DEFINITION_RESULT)
     task_mgr = EcsTaskManager()
     task_mgr.client = client
+    task_mgr.task_definition_cache.clear()
     check_task.task_mgr = task_mgr
+    client.get_queue_url.return_value = {'QueueUrl': QUEUE_URL}
+    check_task.task_set_queue = TaskSetQueue(RESULT_QUEUE_URL)
+    check_task.task_set_queue.sqs = client
+    check_task.task_set_queue.sfn = client
     yield check_task
 
 @pytest.fixture
@@ -86,6 +96,8 @@ def task_mgr():
     client.describe_task_definition.side_effect = lambda taskDefinition: TASK_DEFINITION_RESULTS[taskDefinition]
     task_mgr = EcsTaskManager()
     task_mgr.client = client
+    task_mgr.task_definition_cache.clear()
+    task_mgr.container_instance_cache.clear()
     yield task_mgr
 
 # Patched CFN manager
@@ -93,10 +105,50 @@ def task_mgr():
 def cfn_mgr():
   with mock.patch('boto3.client') as client:
     cfn_mgr = CfnManager()
+    cfn_mgr.stack_status_cache.clear()
     client.describe_stacks.side_effect = lambda StackName: DESCRIBE_STACKS_RESULT
     cfn_mgr.client = client
     yield cfn_mgr
 
+# Patched task state manager backed by an in-memory table
+@pytest.fixture
+def state_mgr():
+  with mock.patch('boto3.client') as client:
+    items = {}
+    get_item = lambda Key: {'Item': items[Key['StartedBy']['S']]} if Key['StartedBy']['S'] in items else {}
+    delete_item = lambda Key: {'Attributes': items.pop(Key['StartedBy']['S'])} if Key['StartedBy']['S'] in items else {}
+    client.put_item.side_effect = lambda TableName, Item: items.update({Item['StartedBy']['S']: Item})
+    client.get_item.side_effect = lambda TableName, Key, ConsistentRead: get_item(Key)
+    client.delete_item.side_effect = lambda TableName, Key, ReturnValues: delete_item(Key)
+    client.scan.side_effect = lambda TableName, ConsistentRead: {'Items': list(items.values())}
+    client.update_item.side_effect = lambda TableName, Key, **kwargs: update_item(items, Key['StartedBy']['S'], **kwargs)
+    state_mgr = TaskStateManager('my-stack-TaskState')
+    state_mgr.client = client
+    state_mgr.items = items
+    yield state_mgr
+
+# Applies the claim updates made to a stubbed state item, failing their conditions as DynamoDB would
+def update_item(items, key, UpdateExpression, ConditionExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None):
+  from botocore.exceptions import ClientError
+  item = items.get(key)
+  values = ExpressionAttributeValues or {}
+  if UpdateExpression == 'SET #state = :state' and item and 'Completing' not in item:
+    item['State'] = values[':state']
+  elif UpdateExpression == 'SET Completing = :now' and item and \
+      ('Completing' not in item or int(item['Completing']['N']) < int(values[':expired']['N'])):
+    item['Completing'] = values[':now']
+  elif UpdateExpression == 'REMOVE Completing' and item:
+    item.pop('Completing', None)
+  else:
+    raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'UpdateItem')
+  return {}
+
+# Stubbed CloudFormation response URL
+@pytest.fixture
+def response_url():
+  with mock.patch('requests.put') as put:
+    yield put
+
 # Patched ecs_tasks module
 @pytest.fixture
 def ecs_tasks():
@@ -107,9 +159,15 @@ def ecs_tasks():
     client.describe_task_definition.side_effect = lambda taskDefinition: TASK_DEFINITION_RESULTS[taskDefinition]
     client.list_tasks.side_effect = [LIST_TASKS_RESULT]
     client.stop_task.side_effect = [STOPPED_TASK_RESULT]
+    client.describe_images.return_value = DESCRIBE_IMAGES_RESULT
     task_mgr = EcsTaskManager()
     task_mgr.client = client
+    task_mgr.task_definition_cache.clear()
+    task_mgr.container_instance_cache.clear()
     ecs_tasks.task_mgr = task_mgr
+    ecs_tasks.cfn_mgr.stack_status_cache.clear()
+    ecs_tasks.image_resolver = ImageResolver()
+    ecs_tasks.image_resolver.client = client
     yield ecs_tasks
 
 # CFN Create Request
@@ -187,16 +245,55 @@ def required_property(request):
 # Check validation of illegal property values
 @pytest.fixture(
   ids = [
-    'Count','RunOnUpdate','RunOnRollback','Timeout','PollInterval','Instances','Overrides'
+    'Count','RunOnUpdate','RunOnRollback','Timeout','PollInterval','Instances','Overrides','CompletionMode'
   ], 
   params=[
-    ('Count','50'),               # Maximum count = 10
+    ('Count','5000'),             # Maximum count = 100
     ('RunOnUpdate','never'),      # RunOnUpdate is a boolean
     ('RunOnRollback', 'always'),  # RunOnRollback is a boolean
     ('Timeout','4000'),           # Maximum timeout = 3600
     ('PollInterval','300'),       # Maximum poll interval = 60
     ('Instances',range(0,11)),    # Maximum number of instances = 10
-    ('Overrides',[])              # Overrides is of type dict
+    ('Overrides',[]),             # Overrides is of type dict
+    ('CompletionMode','Wait')     # CompletionMode is one of Poll or Event
   ])
 def invalid_property(request):
-  yield request.param
\ No newline at end of file
+  yield request.param
+
+# In-memory CloudWatch Logs client
+class LocalLogsClient:
+  """CloudWatch Logs stand-in returning log events in pages with forward tokens"""
+  def __init__(self, page_size=2):
+    self.page_size = page_size
+    self.streams = dict()
+    self.calls = 0
+
+  def put_log_events(self, group, stream, *messages):
+    self.streams.setdefault((group, stream), []).extend(messages)
+
+  def get_log_events(self, logGroupName, logStreamName, startFromHead=True, nextToken=None, limit=None):
+    from botocore.exceptions import ClientError
+    self.calls += 1
+    events = self.streams.get((logGroupName, logStreamName))
+    if events is None:
+      raise ClientError({'Error': {'Code': 'ResourceNotFoundException', 'Message': 'The specified log stream does not exist.'}}, 'GetLogEvents')
+    # Without a token, reading from the tail returns the most recent events
+    if not startFromHead:
+      page = events[-(limit or self.page_size):]
+      return {'events': [{'message': m} for m in page], 'nextForwardToken': 'f/%d' % len(events)}
+    start = int(nextToken.split('/')[1]) if nextToken else 0
+    page = events[start:start + self.page_size]
+    return {'events': [{'message': m} for m in page], 'nextForwardToken': 'f/%d' % (start + len(page))}
+
+# Returns a task definition result with the awslogs driver configured for its container
+def logged_task_definition(taskDefinition):
+  result = copy.deepcopy(TASK_DEFINITION_RESULTS[OLD_TASK_DEFINITION_ARN])
+  result['taskDefinition']['containerDefinitions'][0]['logConfiguration'] = {
+    'logDriver': 'awslogs',
+    'options': {'awslogs-group': LOG_GROUP, 'awslogs-stream-prefix': 'ecs'}
+  }
+  return result
+
+# Log stream name of the container of the fixture task
+def log_stream(task_arn=PHYSICAL_RESOURCE_ID):
+  return 'ecs/app/%s' % task_arn.split('/')[-1]
@@ -1,9 +1,15 @@
+import copy
+import json
+import mock
 import pytest
 import fixtures
 from fixtures import context, ecs_tasks, handlers, create_update_handlers, time, now, cfn_mgr
+from fixtures import state_mgr, response_url
 from fixtures import create_event, update_event, delete_event
 from fixtures import required_property, invalid_property
 from cfn_lambda_handler import CfnLambdaExecutionTimeout
+from botocore.exceptions import ClientError
+from lib import memo, task_state
 
 # Test poll request completes successfully
 def test_poll_task_completes(ecs_tasks, create_event, context, time):
@@ -17,7 +23,8 @@ def test_poll_task_completes(ecs_tasks, create_event, context, time):
   # Simulated poll event
   poll_event = create_event
   poll_event['EventState'] = e.value.state
-  assert poll_event['EventState']['TaskResult'] == fixtures.RUNNING_TASK_RESULT
+  # Task state is persisted in its compact form
+  assert poll_event['EventState']['TaskResult'] == {'tasks': task_state(fixtures.RUNNING_TASK_RESULT['tasks']), 'failures': []}
   # Process the poll request during which the task will complete
   response = ecs_tasks.handle_poll(poll_event, context)
   assert ecs_tasks.task_mgr.client.run_task.call_count == 1
@@ -25,6 +32,17 @@ def test_poll_task_completes(ecs_tasks, create_event, context, time):
   assert response['Status'] == 'SUCCESS'
   assert response['PhysicalResourceId'] == fixtures.PHYSICAL_RESOURCE_ID
 
+# Test poll interval backs off with the exponential poll strategy
+def test_poll_task_exponential_strategy(ecs_tasks, create_event, context, time):
+  create_event['ResourceProperties']['PollStrategy'] = 'Exponential'
+  create_event['ResourceProperties']['Timeout'] = 3600
+  ecs_tasks.task_mgr.client.describe_tasks.side_effect = [fixtures.RUNNING_TASK_RESULT] * 4 + [fixtures.STOPPED_TASK_RESULT]
+  context.get_remaining_time_in_millis.return_value = 900000
+  with mock.patch('random.uniform', side_effect=lambda a, b: b):
+    response = ecs_tasks.handle_create(create_event, context)
+  assert response['Status'] == 'SUCCESS'
+  assert [c[0][0] for c in time.call_args_list] == [10, 10, 20, 40, 60]
+
 # Test poll request fails after maximum timeout 
 def test_poll_task_timeout(ecs_tasks, create_event, context, time, now):
   create_event['ResourceProperties']['Timeout'] = 3600
@@ -68,14 +86,69 @@ def test_delete_task_stopped(ecs_tasks, delete_event, context, time):
 
 # Test running task is stopped on delete
 def test_running_task_is_stopped_on_delete(ecs_tasks, delete_event, context, time):
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.RUNNING_TASK_RESULT
   response = ecs_tasks.handle_delete(delete_event, context)
   assert not ecs_tasks.task_mgr.client.run_task.called
-  assert not ecs_tasks.task_mgr.client.describe_tasks.called
+  assert ecs_tasks.task_mgr.client.describe_tasks.called
   assert ecs_tasks.task_mgr.client.list_tasks.called
   assert ecs_tasks.task_mgr.client.stop_task.called
   assert response['Status'] == 'SUCCESS'
   assert response['PhysicalResourceId'] == fixtures.PHYSICAL_RESOURCE_ID
 
+# Test task that is already stopping is not stopped again on delete
+def test_stopping_task_is_not_stopped_on_delete(ecs_tasks, delete_event, context, time):
+  response = ecs_tasks.handle_delete(delete_event, context)
+  assert ecs_tasks.task_mgr.client.describe_tasks.called
+  assert not ecs_tasks.task_mgr.client.stop_task.called
+  assert response['Status'] == 'SUCCESS'
+
+# Test all running tasks are stopped concurrently on delete
+def test_running_tasks_are_stopped_concurrently_on_delete(ecs_tasks, delete_event, context, time):
+  task_arns = ['arn:aws:ecs:us-west-2:123456789012:task/%d' % i for i in range(20)]
+  ecs_tasks.task_mgr.client.list_tasks.side_effect = [{'taskArns': task_arns}]
+  ecs_tasks.task_mgr.client.describe_tasks.side_effect = lambda cluster, tasks: {
+    'tasks': [dict(fixtures.RUNNING_TASK_RESULT['tasks'][0], taskArn=t) for t in tasks], 'failures': []
+  }
+  ecs_tasks.task_mgr.client.stop_task.side_effect = lambda cluster, task, reason: {'task': {'taskArn': task}}
+  response = ecs_tasks.handle_delete(delete_event, context)
+  assert ecs_tasks.task_mgr.client.describe_tasks.call_count == 1
+  assert sorted(c[1]['task'] for c in ecs_tasks.task_mgr.client.stop_task.call_args_list) == sorted(task_arns)
+  assert response['Status'] == 'SUCCESS'
+
+# Test throttled stop requests are only retried by the botocore client on delete, and fail once its retries are exhausted
+def test_throttled_stop_is_not_retried_again_on_delete(ecs_tasks, delete_event, context, time):
+  throttled = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'StopTask')
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.RUNNING_TASK_RESULT
+  ecs_tasks.task_mgr.client.stop_task.side_effect = [throttled]
+  response = ecs_tasks.handle_delete(delete_event, context)
+  assert ecs_tasks.task_mgr.client.stop_task.call_count == 1
+  assert not time.called
+  assert response['Status'] == 'FAILED'
+
+# Test delete fails when a task cannot be stopped
+def test_stop_failure_on_delete(ecs_tasks, delete_event, context, time):
+  denied = ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'Denied'}}, 'StopTask')
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.RUNNING_TASK_RESULT
+  ecs_tasks.task_mgr.client.stop_task.side_effect = [denied]
+  response = ecs_tasks.handle_delete(delete_event, context)
+  assert ecs_tasks.task_mgr.client.stop_task.call_count == 1
+  assert response['Status'] == 'FAILED'
+  assert 'AccessDeniedException' in response['Reason']
+
+# Test delete waits for stopped tasks and re-enters through a poll request
+def test_wait_on_delete(ecs_tasks, delete_event, context, time):
+  delete_event['ResourceProperties']['WaitOnDelete'] = 'true'
+  ecs_tasks.task_mgr.client.describe_tasks.side_effect = [fixtures.RUNNING_TASK_RESULT, fixtures.RUNNING_TASK_RESULT, fixtures.STOPPED_TASK_RESULT]
+  context.get_remaining_time_in_millis.side_effect = [20000, 10000, 20000]
+  with pytest.raises(CfnLambdaExecutionTimeout) as e:
+    ecs_tasks.handle_delete(delete_event, context)
+  assert ecs_tasks.task_mgr.client.stop_task.called
+  delete_event['EventState'] = e.value.state
+  response = ecs_tasks.handle_poll(delete_event, context)
+  assert ecs_tasks.task_mgr.client.describe_tasks.call_count == 3
+  assert response['Status'] == 'SUCCESS'
+  assert response['PhysicalResourceId'] == fixtures.PHYSICAL_RESOURCE_ID
+
 # Test task is not run on stack rollback when RunOnRollback is false
 def test_no_run_when_run_on_rollback_disabled(ecs_tasks, cfn_mgr, update_event, context, time):
   ecs_tasks.cfn_mgr = cfn_mgr
@@ -162,6 +235,16 @@ def test_run_task_non_zero_exit_code(ecs_tasks, create_update_handlers, context,
   assert response['PhysicalResourceId'] == fixtures.PHYSICAL_RESOURCE_ID
   assert 'One or more containers failed with a non-zero exit code' in response['Reason']
 
+# Test tasks that fail to start report their outcome in the failure reason
+def test_run_task_failed_to_start(ecs_tasks, create_event, context, time):
+  result = copy.deepcopy(fixtures.STOPPED_TASK_RESULT)
+  result['tasks'][0].update(stopCode='TaskFailedToStart', stoppedReason='CannotPullContainerError: image not found')
+  del result['tasks'][0]['containers'][0]['exitCode']
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = result
+  response = ecs_tasks.handle_create(create_event, context)
+  assert response['Status'] == 'FAILED'
+  assert response['Reason'] == 'One or more tasks failed (1 ImagePullError): %s (ImagePullError)' % fixtures.PHYSICAL_RESOURCE_ID
+
 # Test for ECS task that does not complete within Lambda execution timeout
 def test_run_task_execution_timeout(ecs_tasks, create_update_handlers, context, time):
   context.get_remaining_time_in_millis.return_value = 1000
@@ -171,7 +254,7 @@ def test_run_task_execution_timeout(ecs_tasks, create_update_handlers, context,
     response = handler(event, context)
     assert ecs_tasks.task_mgr.client.run_task.called
     assert not ecs_tasks.task_mgr.client.describe_tasks.called
-  assert e.value.state['TaskResult'] == fixtures.START_TASK_RESULT
+  assert e.value.state['TaskResult'] == {'tasks': task_state(fixtures.START_TASK_RESULT['tasks']), 'failures': []}
 
 # Test for ECS task that does not complete within absolute task timeout
 def test_create_new_task_completion_timeout(ecs_tasks, create_update_handlers, context, time, now):
@@ -208,3 +291,359 @@ def test_invalid_property(ecs_tasks, handlers, invalid_property, context, time):
   assert 'One or more invalid event properties' in response['Reason']
   assert ecs_tasks.task_mgr.client.run_task.was_not_called
   assert ecs_tasks.task_mgr.client.describe_tasks.was_not_called
+
+# Test event completion mode defers the response until a task state change event is received
+def test_event_completion_mode(ecs_tasks, state_mgr, response_url, create_event, context, time):
+  ecs_tasks.state_mgr = state_mgr
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  started_by = ecs_tasks.get_task_id(fixtures.STACK_ID,fixtures.LOGICAL_RESOURCE_ID)
+  ecs_tasks.handler(create_event, context)
+  assert ecs_tasks.task_mgr.client.run_task.called
+  assert not ecs_tasks.task_mgr.client.describe_tasks.called
+  assert not time.called
+  assert not response_url.called
+  assert started_by in state_mgr.items
+  # Simulated ECS task state change event
+  event = copy.deepcopy(fixtures.TASK_STATE_CHANGE_EVENT)
+  event['detail']['startedBy'] = started_by
+  ecs_tasks.handle_task_event(event, context)
+  assert ecs_tasks.task_mgr.client.describe_tasks.called
+  assert response_url.call_count == 1
+  assert response_url.call_args[0][0] == create_event['ResponseURL']
+  response = json.loads(response_url.call_args[1]['data'])
+  assert response['Status'] == 'SUCCESS'
+  assert response['PhysicalResourceId'] == fixtures.PHYSICAL_RESOURCE_ID
+  assert started_by not in state_mgr.items
+
+# Test event completion mode reports non-zero exit codes
+def test_event_completion_mode_non_zero_exit_code(ecs_tasks, state_mgr, response_url, create_event, context, time):
+  ecs_tasks.state_mgr = state_mgr
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.FAILED_TASK_RESULT
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  ecs_tasks.handler(create_event, context)
+  event = copy.deepcopy(fixtures.TASK_STATE_CHANGE_EVENT)
+  event['detail']['startedBy'] = ecs_tasks.get_task_id(fixtures.STACK_ID,fixtures.LOGICAL_RESOURCE_ID)
+  ecs_tasks.handle_task_event(event, context)
+  response = json.loads(response_url.call_args[1]['data'])
+  assert response['Status'] == 'FAILED'
+  assert response['PhysicalResourceId'] == fixtures.PHYSICAL_RESOURCE_ID
+  assert 'One or more containers failed with a non-zero exit code' in response['Reason']
+
+# Test event completion mode waits for all tasks to stop
+def test_event_completion_mode_task_running(ecs_tasks, state_mgr, response_url, create_event, context, time):
+  ecs_tasks.state_mgr = state_mgr
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.RUNNING_TASK_RESULT
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  ecs_tasks.handler(create_event, context)
+  event = copy.deepcopy(fixtures.TASK_STATE_CHANGE_EVENT)
+  event['detail']['startedBy'] = ecs_tasks.get_task_id(fixtures.STACK_ID,fixtures.LOGICAL_RESOURCE_ID)
+  ecs_tasks.handle_task_event(event, context)
+  assert ecs_tasks.task_mgr.client.describe_tasks.called
+  assert not response_url.called
+  assert event['detail']['startedBy'] in state_mgr.items
+
+# Test deferred responses without a physical resource ID default to the ID generated by cfn_handler
+def test_event_completion_mode_default_physical_resource_id(ecs_tasks, state_mgr, response_url, create_event, context):
+  ecs_tasks.state_mgr = state_mgr
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  create_event['ResourceProperties']['Count'] = 0
+  ecs_tasks.handler(create_event, context)
+  response = json.loads(response_url.call_args[1]['data'])
+  assert response['Status'] == 'SUCCESS'
+  assert response['PhysicalResourceId'] == ecs_tasks.get_task_id(fixtures.STACK_ID, fixtures.LOGICAL_RESOURCE_ID)
+
+# Test the scheduled sweep fails deferred requests that time out without a task state change event
+def test_event_completion_mode_sweep(ecs_tasks, state_mgr, response_url, create_event, context, time, now):
+  ecs_tasks.state_mgr = state_mgr
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.RUNNING_TASK_RESULT
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  create_event['ResourceProperties']['Timeout'] = 60
+  ecs_tasks.handler(create_event, context)
+  started_by = ecs_tasks.get_task_id(fixtures.STACK_ID, fixtures.LOGICAL_RESOURCE_ID)
+  ecs_tasks.sweep_deferred({}, context)
+  assert not response_url.called
+  assert started_by in state_mgr.items
+  now.return_value = fixtures.NOW + 120
+  ecs_tasks.sweep_deferred({}, context)
+  response = json.loads(response_url.call_args[1]['data'])
+  assert response['Status'] == 'FAILED'
+  assert 'timeout of 60 seconds' in response['Reason']
+  assert started_by not in state_mgr.items
+
+# Test a deferred request keeps its state until its response is sent, so a failed response is retried by the sweep
+def test_event_completion_mode_response_failure(ecs_tasks, state_mgr, response_url, create_event, context, time):
+  from requests.exceptions import HTTPError
+  ecs_tasks.state_mgr = state_mgr
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  ecs_tasks.handler(create_event, context)
+  started_by = ecs_tasks.get_task_id(fixtures.STACK_ID, fixtures.LOGICAL_RESOURCE_ID)
+  event = copy.deepcopy(fixtures.TASK_STATE_CHANGE_EVENT)
+  event['detail']['startedBy'] = started_by
+  response_url.return_value.raise_for_status.side_effect = HTTPError('503 Server Error')
+  with pytest.raises(HTTPError):
+    ecs_tasks.handle_task_event(event, context)
+  assert started_by in state_mgr.items
+  assert 'Completing' not in state_mgr.items[started_by]
+  response_url.return_value.raise_for_status.side_effect = None
+  ecs_tasks.sweep_deferred({}, context)
+  assert response_url.call_count == 2
+  assert started_by not in state_mgr.items
+
+# Test only the invocation that claims a deferred request sends its response
+def test_event_completion_mode_claimed_request(ecs_tasks, state_mgr, response_url, create_event, context, time):
+  ecs_tasks.state_mgr = state_mgr
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  ecs_tasks.handler(create_event, context)
+  started_by = ecs_tasks.get_task_id(fixtures.STACK_ID, fixtures.LOGICAL_RESOURCE_ID)
+  assert state_mgr.claim_state(started_by)
+  ecs_tasks.sweep_deferred({}, context)
+  assert not response_url.called
+  assert started_by in state_mgr.items
+
+# Test event completion mode persists log stream tokens while tasks are running
+def test_event_completion_mode_stream_logs(ecs_tasks, state_mgr, response_url, create_event, context, time):
+  ecs_tasks.state_mgr = state_mgr
+  ecs_tasks.task_mgr.client.describe_task_definition.side_effect = fixtures.logged_task_definition
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.RUNNING_TASK_RESULT
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  create_event['ResourceProperties']['StreamLogs'] = 'true'
+  started_by = ecs_tasks.get_task_id(fixtures.STACK_ID, fixtures.LOGICAL_RESOURCE_ID)
+  event = copy.deepcopy(fixtures.TASK_STATE_CHANGE_EVENT)
+  event['detail']['startedBy'] = started_by
+  logs_client = fixtures.LocalLogsClient()
+  logs_client.put_log_events(fixtures.LOG_GROUP, fixtures.log_stream(), 'Running migrations')
+  with mock.patch.object(ecs_tasks.logs_mgr, 'client', logs_client, create=True):
+    ecs_tasks.handler(create_event, context)
+    ecs_tasks.handle_task_event(event, context)
+    assert state_mgr.get_state(started_by)['EventState']['LogStreams'][0]['Token'] == 'f/1'
+    logs_client.put_log_events(fixtures.LOG_GROUP, fixtures.log_stream(), 'Applied 0002')
+    ecs_tasks.handle_task_event(event, context)
+  assert state_mgr.get_state(started_by)['EventState']['LogStreams'][0]['Token'] == 'f/2'
+  assert logs_client.calls == 4
+  assert not response_url.called
+
+# Test task state change events for unknown tasks are ignored
+def test_event_completion_mode_unknown_task(ecs_tasks, state_mgr, response_url, context):
+  ecs_tasks.state_mgr = state_mgr
+  event = copy.deepcopy(fixtures.TASK_STATE_CHANGE_EVENT)
+  event['detail']['startedBy'] = 'admin'
+  ecs_tasks.handle_task_event(event, context)
+  assert state_mgr.client.get_item.called
+  assert not ecs_tasks.task_mgr.client.describe_tasks.called
+  assert not response_url.called
+
+def test_get_stack_status_reads_first_page(cfn_mgr):
+  cfn_mgr.client.describe_stacks.side_effect = [{'Stacks': [{'StackStatus': 'CREATE_COMPLETE'}], 'NextToken': 'next'}]
+  assert cfn_mgr.get_stack_status('my-stack') == 'CREATE_COMPLETE'
+  assert cfn_mgr.client.describe_stacks.call_count == 1
+
+def test_get_stack_status_cached_by_stack_id(cfn_mgr, now):
+  cfn_mgr.client.describe_stacks.side_effect = lambda StackName: {'Stacks': [{'StackId': StackName, 'StackStatus': 'UPDATE_IN_PROGRESS'}]}
+  assert [cfn_mgr.get_stack_status(fixtures.STACK_ID) for _ in range(30)] == ['UPDATE_IN_PROGRESS'] * 30
+  assert cfn_mgr.get_stack_status('other-stack') == 'UPDATE_IN_PROGRESS'
+  assert cfn_mgr.client.describe_stacks.call_count == 2
+  # Statuses are described again once their TTL expires
+  now.return_value = fixtures.NOW + 60
+  cfn_mgr.get_stack_status(fixtures.STACK_ID)
+  assert cfn_mgr.client.describe_stacks.call_count == 3
+
+def test_get_stack_status_coalesces_concurrent_lookups(cfn_mgr):
+  import threading
+  from lib.utils import concurrent_map
+  described = threading.Event()
+  def describe_stacks(StackName):
+    described.wait(1)
+    return {'Stacks': [{'StackStatus': 'UPDATE_ROLLBACK_IN_PROGRESS'}]}
+  cfn_mgr.client.describe_stacks.side_effect = describe_stacks
+  # Caching is disabled, so lookups only share the in-flight request
+  with mock.patch('lib.cfn.STACK_STATUS_TTL', -1):
+    timer = threading.Timer(0.2, described.set)
+    timer.start()
+    statuses = concurrent_map(lambda _: cfn_mgr.get_stack_status(fixtures.STACK_ID), range(30), 30)
+  assert statuses == ['UPDATE_ROLLBACK_IN_PROGRESS'] * 30
+  assert cfn_mgr.client.describe_stacks.call_count == 1
+  assert not cfn_mgr.in_flight
+
+def test_get_stack_status_errors_not_cached(cfn_mgr):
+  error = ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'DescribeStacks')
+  cfn_mgr.client.describe_stacks.side_effect = [error, {'Stacks': [{'StackStatus': 'UPDATE_IN_PROGRESS'}]}]
+  with pytest.raises(ClientError):
+    cfn_mgr.get_stack_status(fixtures.STACK_ID)
+  assert cfn_mgr.get_stack_status(fixtures.STACK_ID) == 'UPDATE_IN_PROGRESS'
+
+# Builds a task graph where migrate runs first, then web and worker in parallel
+def graph_event(create_event):
+  create_event['ResourceProperties']['Timeout'] = 3600
+  create_event['ResourceProperties']['TaskGraph'] = [
+    {'Name': 'migrate', 'TaskDefinition': 'migrate'},
+    {'Name': 'web', 'TaskDefinition': 'web', 'DependsOn': ['migrate']},
+    {'Name': 'worker', 'TaskDefinition': 'worker', 'DependsOn': ['migrate']}
+  ]
+  return create_event
+
+# Simulates tasks that run for a given number of describe calls, or a number per task definition, exiting with the given
+# exit codes per task definition
+def graph_client(client, polls=1, exit_codes={}):
+  described = {}
+  def run_task(**kwargs):
+    task_arn = 'arn:aws:ecs:us-west-2:123456789012:task/%s' % kwargs['taskDefinition']
+    return {'tasks': [{'taskArn': task_arn, 'lastStatus': 'PENDING', 'containers': []}], 'failures': []}
+  def describe_tasks(cluster, tasks):
+    result = []
+    for arn in tasks:
+      described[arn] = described.get(arn, 0) + 1
+      stopped = described[arn] > (polls.get(arn.split('/')[-1], 1) if isinstance(polls, dict) else polls)
+      exit_code = exit_codes.get(arn.split('/')[-1], 0)
+      result.append({
+        'taskArn': arn,
+        'lastStatus': 'STOPPED' if stopped else 'RUNNING',
+        'containers': [{'name': 'app', 'exitCode': exit_code}] if stopped else []
+      })
+    return {'tasks': result, 'failures': []}
+  client.run_task.side_effect = run_task
+  client.describe_tasks.side_effect = describe_tasks
+  client.describe_task_definition.side_effect = lambda taskDefinition: {'taskDefinition': {'family': taskDefinition, 'containerDefinitions': [{'name': 'app'}]}}
+
+# Test task graph entries start once their dependencies complete, with independent entries started together
+def test_task_graph_runs_in_dependency_order(ecs_tasks, create_event, context, time):
+  graph_client(ecs_tasks.task_mgr.client)
+  context.get_remaining_time_in_millis.return_value = 900000
+  response = ecs_tasks.handle_create(graph_event(create_event), context)
+  started = [c[1]['taskDefinition'] for c in ecs_tasks.task_mgr.client.run_task.call_args_list]
+  assert started[0] == 'migrate'
+  assert sorted(started[1:]) == ['web', 'worker']
+  # migrate is described once running and once stopped, web and worker are then described together
+  assert ecs_tasks.task_mgr.client.describe_tasks.call_count == 4
+  assert response['Status'] == 'SUCCESS'
+  assert response['PhysicalResourceId'] == 'arn:aws:ecs:us-west-2:123456789012:task/migrate'
+
+# Test task graph fails on the first non-zero exit code without starting dependent entries
+def test_task_graph_fails_fast(ecs_tasks, create_event, context, time):
+  graph_client(ecs_tasks.task_mgr.client, exit_codes={'migrate': 1})
+  context.get_remaining_time_in_millis.return_value = 900000
+  response = ecs_tasks.handle_create(graph_event(create_event), context)
+  assert ecs_tasks.task_mgr.client.run_task.call_count == 1
+  assert response['Status'] == 'FAILED'
+  assert 'non-zero exit code' in response['Reason']
+
+# Test task graph stops the running tasks of other entries when an entry fails
+def test_task_graph_fails_fast_stops_running_entries(ecs_tasks, create_event, context, time):
+  graph_client(ecs_tasks.task_mgr.client, polls={'web': 5}, exit_codes={'worker': 1})
+  context.get_remaining_time_in_millis.return_value = 900000
+  response = ecs_tasks.handle_create(graph_event(create_event), context)
+  assert response['Status'] == 'FAILED'
+  ecs_tasks.task_mgr.client.stop_task.assert_called_once_with(
+    cluster=fixtures.CLUSTER_NAME, task='arn:aws:ecs:us-west-2:123456789012:task/web', reason='Task graph failed'
+  )
+
+# Test task graph with Instances is rejected, as task graph entries are not placed on instances
+def test_task_graph_instances_are_invalid(ecs_tasks, create_event, context, time):
+  graph_event(create_event)['ResourceProperties']['Instances'] = ['i-12345678']
+  response = ecs_tasks.handle_create(create_event, context)
+  assert not ecs_tasks.task_mgr.client.run_task.called
+  assert response['Status'] == 'FAILED'
+  assert 'Instances cannot be specified with a TaskGraph' in response['Reason']
+
+# Test task graph progress is persisted across poll requests
+def test_task_graph_persists_progress(ecs_tasks, create_event, context, time):
+  graph_client(ecs_tasks.task_mgr.client, polls=2)
+  context.get_remaining_time_in_millis.side_effect = [20000, 10000]
+  with pytest.raises(CfnLambdaExecutionTimeout) as e:
+    ecs_tasks.handle_create(graph_event(create_event), context)
+  poll_event = create_event
+  poll_event['EventState'] = e.value.state
+  assert [t['Status'] for t in e.value.state['TaskGraph']] == ['STARTED', 'WAITING', 'WAITING']
+  context.get_remaining_time_in_millis.side_effect = None
+  context.get_remaining_time_in_millis.return_value = 900000
+  response = ecs_tasks.handle_poll(poll_event, context)
+  assert ecs_tasks.task_mgr.client.run_task.call_count == 3
+  assert response['Status'] == 'SUCCESS'
+
+# Test task graph with a dependency cycle is rejected
+def test_task_graph_cycle_is_invalid(ecs_tasks, create_event, context, time):
+  graph_event(create_event)['ResourceProperties']['TaskGraph'][0]['DependsOn'] = ['web']
+  response = ecs_tasks.handle_create(create_event, context)
+  assert not ecs_tasks.task_mgr.client.run_task.called
+  assert response['Status'] == 'FAILED'
+  assert 'cycle' in response['Reason']
+
+# Test task graph with an Event completion mode is rejected, as task graphs are polled to completion
+def test_task_graph_event_completion_mode_is_invalid(ecs_tasks, state_mgr, response_url, create_event, context, time):
+  ecs_tasks.state_mgr = state_mgr
+  graph_event(create_event)['ResourceProperties']['CompletionMode'] = 'Event'
+  ecs_tasks.handler(create_event, context)
+  assert not ecs_tasks.task_mgr.client.run_task.called
+  response = json.loads(response_url.call_args[1]['data'])
+  assert response['Status'] == 'FAILED'
+  assert 'CompletionMode of Poll' in response['Reason']
+
+# Test deferrable requests that run out of execution time before deferring are re-invoked as poll requests
+def test_deferrable_handler_reinvokes_on_execution_timeout(response_url, create_event, context):
+  from lib import deferrable_cfn_handler
+  def func(event, context):
+    raise CfnLambdaExecutionTimeout({'TaskGraph': []})
+  create_event['ResourceProperties']['CompletionMode'] = 'Event'
+  with mock.patch('cfn_lambda_handler.cfn_lambda_handler.invoke') as invoke:
+    deferrable_cfn_handler(func)(create_event, context)
+  assert invoke.call_args[0][0]['EventState'] == {'TaskGraph': []}
+  assert not response_url.called
+
+# Test memoized task is skipped when a previous run with the same inputs succeeded
+def test_memoized_task_is_skipped(ecs_tasks, create_event, context, time):
+  create_event['ResourceProperties']['Memoize'] = 'true'
+  with mock.patch.object(ecs_tasks, 'run_store', memo.MemoryRunStore()):
+    first = ecs_tasks.handle_create(copy.deepcopy(create_event), context)
+    second = ecs_tasks.handle_create(copy.deepcopy(create_event), context)
+  assert ecs_tasks.task_mgr.client.run_task.call_count == 1
+  assert first['Status'] == second['Status'] == 'SUCCESS'
+  assert second['PhysicalResourceId'] == first['PhysicalResourceId']
+
+# Test memoized task is run again when its task definition environment changes
+def test_memoized_task_runs_when_inputs_change(ecs_tasks, create_event, context, time):
+  create_event['ResourceProperties']['Memoize'] = 'true'
+  with mock.patch.object(ecs_tasks, 'run_store', memo.MemoryRunStore()):
+    ecs_tasks.handle_create(copy.deepcopy(create_event), context)
+    create_event['ResourceProperties']['TaskDefinition'] = fixtures.NEW_TASK_DEFINITION_ARN
+    ecs_tasks.handle_create(create_event, context)
+  assert ecs_tasks.task_mgr.client.run_task.call_count == 2
+
+# Test memoized task is run again when a new image is pushed to the tag it references
+def test_memoized_task_runs_when_image_pushed(ecs_tasks, create_event, context, time):
+  create_event['ResourceProperties']['Memoize'] = 'true'
+  with mock.patch.object(ecs_tasks, 'run_store', memo.MemoryRunStore()):
+    ecs_tasks.handle_create(copy.deepcopy(create_event), context)
+    pushed = copy.deepcopy(fixtures.DESCRIBE_IMAGES_RESULT)
+    pushed['imageDetails'][0]['imageDigest'] = 'sha256:' + '0' * 64
+    ecs_tasks.task_mgr.client.describe_images.return_value = pushed
+    ecs_tasks.handle_create(create_event, context)
+  assert ecs_tasks.task_mgr.client.run_task.call_count == 2
+
+# Test failed runs of a memoized task are not recorded
+def test_memoized_task_failure_is_not_recorded(ecs_tasks, create_event, context, time):
+  create_event['ResourceProperties']['Memoize'] = 'true'
+  ecs_tasks.task_mgr.client.describe_tasks.return_value = fixtures.FAILED_TASK_RESULT
+  with mock.patch.object(ecs_tasks, 'run_store', memo.MemoryRunStore()) as run_store:
+    response = ecs_tasks.handle_create(create_event, context)
+  assert response['Status'] == 'FAILED'
+  assert not run_store.runs
+
+# Test log stream tokens are persisted across poll requests and the last log lines are included in the failure reason
+def test_stream_logs(ecs_tasks, create_event, context, time):
+  create_event['ResourceProperties']['StreamLogs'] = 'true'
+  create_event['ResourceProperties']['LogLines'] = 2
+  ecs_tasks.task_mgr.client.describe_task_definition.side_effect = fixtures.logged_task_definition
+  ecs_tasks.task_mgr.client.describe_tasks.side_effect = [fixtures.RUNNING_TASK_RESULT, fixtures.FAILED_TASK_RESULT]
+  context.get_remaining_time_in_millis.side_effect = [20000, 10000]
+  logs_client = fixtures.LocalLogsClient()
+  logs_client.put_log_events(fixtures.LOG_GROUP, fixtures.log_stream(), 'Running migrations')
+  with mock.patch.object(ecs_tasks.logs_mgr, 'client', logs_client, create=True):
+    with pytest.raises(CfnLambdaExecutionTimeout) as e:
+      ecs_tasks.handle_create(create_event, context)
+    assert e.value.state['LogStreams'][0]['Token'] == 'f/1' and 'Lines' not in e.value.state['LogStreams'][0]
+    logs_client.put_log_events(fixtures.LOG_GROUP, fixtures.log_stream(), 'Applying 0002', 'Error: relation exists')
+    create_event['EventState'] = e.value.state
+    context.get_remaining_time_in_millis.side_effect = None
+    context.get_remaining_time_in_millis.return_value = 900000
+    response = ecs_tasks.handle_poll(create_event, context)
+  assert response['Status'] == 'FAILED'
+  assert response['Reason'].endswith('Last log lines:\n[app] Applying 0002\n[app] Error: relation exists')
@@ -0,0 +1,72 @@
+import os
+import pytest
+import mock
+from lib import clients, EcsTaskManager, CfnManager
+
+@pytest.fixture
+def boto3_client():
+  clients.reset_clients()
+  with mock.patch('boto3.client', side_effect=lambda service, config: mock.Mock(service=service)) as client:
+    yield client
+  clients.reset_clients()
+
+def test_client_is_shared(boto3_client):
+  task_mgr = EcsTaskManager()
+  other_task_mgr = EcsTaskManager()
+  cfn_mgr = CfnManager()
+  assert not boto3_client.called
+  assert task_mgr.client is other_task_mgr.client
+  assert cfn_mgr.client is not task_mgr.client
+  assert boto3_client.call_count == 2
+  assert [c[0][0] for c in boto3_client.call_args_list] == ['ecs', 'cloudformation']
+
+def test_client_config(boto3_client):
+  env = {
+    'CLIENT_MAX_POOL_CONNECTIONS': '50',
+    'CLIENT_CONNECT_TIMEOUT': '2',
+    'CLIENT_READ_TIMEOUT': '10',
+    'AWS_RETRY_MODE': 'standard',
+    'AWS_MAX_ATTEMPTS': '5'
+  }
+  with mock.patch.dict(os.environ, env):
+    clients.get_client('ecs')
+  config = boto3_client.call_args[1]['config']
+  assert config.max_pool_connections == 50
+  assert config.connect_timeout == 2
+  assert config.read_timeout == 10
+  assert config.retries == {'mode': 'standard', 'max_attempts': 5}
+
+@pytest.fixture
+def instrumented():
+  client = mock.Mock()
+  recorder = mock.Mock()
+  yield clients.InstrumentedClient(client, recorder), client, recorder
+
+def recorded(recorder):
+  return dict((c[0][0], c[0][1]) for c in recorder.record.call_args_list)
+
+def test_instrumented_client_records_calls(instrumented):
+  client, raw, recorder = instrumented
+  raw.run_task.return_value = {'tasks': [], 'ResponseMetadata': {'RetryAttempts': 2, 'HTTPHeaders': {'content-length': '512'}}}
+  assert client.run_task(cluster='cluster') == raw.run_task.return_value
+  raw.run_task.assert_called_once_with(cluster='cluster')
+  values = recorded(recorder)
+  assert values['Retries'] == 2
+  assert values['ResponseSize'] == 512
+  assert values['Latency'] >= 0
+  assert all(c[1] == {'Operation': 'run_task'} for c in recorder.record.call_args_list)
+
+def test_instrumented_client_records_throttles(instrumented):
+  from botocore.exceptions import ClientError
+  client, raw, recorder = instrumented
+  raw.describe_tasks.side_effect = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'DescribeTasks')
+  with pytest.raises(ClientError):
+    client.describe_tasks(cluster='cluster', tasks=[])
+  assert sorted(recorded(recorder)) == ['Errors', 'Latency', 'Throttles']
+
+def test_client_is_not_instrumented_when_metrics_disabled(boto3_client):
+  with mock.patch.object(clients, 'get_metrics', return_value=mock.Mock(spec=clients.NullMetrics)):
+    assert not isinstance(clients.get_client('ecs'), clients.InstrumentedClient)
+  clients.reset_clients()
+  with mock.patch.object(clients, 'get_metrics', return_value=mock.Mock()):
+    assert isinstance(clients.get_client('ecs'), clients.InstrumentedClient)
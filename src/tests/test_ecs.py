@@ -1,3 +1,5 @@
+import copy
+import mock
 import pytest
 import datetime
 import fixtures
@@ -6,27 +8,107 @@ from fixtures import check_task
 from fixtures import check_task_event
 from fixtures import create_task
 from fixtures import create_task_event
+from fixtures import task_mgr
+from fixtures import time
 from dateutil.parser import parse
+from botocore.exceptions import ClientError
+from lib.cache import TtlLruCache
+from lib import memo, dumps, loads
+from lib import ecs
+from uuid import uuid4
 
 def test_create_task_created(create_task, create_task_event, context):
   result = create_task.handler(create_task_event, context)
   creation = parse(result['CreateTimestamp'])
   assert create_task.task_mgr.client.run_task.called
   assert result['Status'] == 'PENDING'
+  assert result['NextPoll'] == 10
   assert creation < parse(datetime.datetime.utcnow().isoformat() + 'Z')
 
-def test_create_task_failure(create_task, create_task_event, context):
-  create_task.task_mgr.client.run_task.return_value['failures'] = fixtures.TASK_FAILURE
+def test_create_task_failure(create_task, create_task_event, context, time):
+  create_task.task_mgr.client.run_task.return_value = fixtures.TASK_FAILURE
   result = create_task.handler(create_task_event, context)
   assert create_task.task_mgr.client.run_task.called
   assert result['Status'] == 'FAILED'
   assert result['Reason'].startswith('A task failure occurred')
+  assert create_task.task_mgr.client.run_task.call_count == time.call_count + 1
+
+def test_create_task_partial_failure(create_task, create_task_event, context):
+  partial_failure = copy.deepcopy(fixtures.START_TASK_RESULT)
+  partial_failure['failures'] = [{'reason': 'MISSING', 'arn': 'arn:aws:ecs:us-west-2:123456789012:container-instance/1'}]
+  create_task.task_mgr.client.run_task.side_effect = [fixtures.START_TASK_RESULT, partial_failure]
+  create_task_event['Count'] = 15
+  result = create_task.handler(create_task_event, context)
+  assert create_task.task_mgr.client.run_task.call_count == 2
+  assert sorted(c[1]['count'] for c in create_task.task_mgr.client.run_task.call_args_list) == [5, 10]
+  assert result['Status'] == 'PENDING'
+  assert len(result['Tasks']) == 2
+  assert result['LaunchFailures'] == partial_failure['failures']
+  assert result['LaunchRetries'] == {'capacity': 0, 'throttling': 0, 'agent': 0}
+
+def test_check_task_completed_with_launch_failures(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.return_value = fixtures.STOPPED_TASK_RESULT
+  check_task_event['LaunchFailures'] = fixtures.TASK_FAILURE['failures']
+  result = check_task.handler(check_task_event, context)
+  assert check_task.task_mgr.client.describe_tasks.called
+  assert result['Status'] == 'FAILED'
+  assert result['Reason'].startswith('A task failure occurred')
+
+def test_start_task_client_error_keeps_started_tasks(task_mgr):
+  error = ClientError({'Error': {'Code': 'InvalidParameterException', 'Message': 'Invalid overrides'}}, 'RunTask')
+  task_mgr.client.run_task.side_effect = [fixtures.START_TASK_RESULT, error, fixtures.START_TASK_RESULT]
+  result = task_mgr.start_task(fixtures.CLUSTER_NAME, fixtures.OLD_TASK_DEFINITION_ARN, {}, 25, 'admin', 'EC2', {})
+  assert task_mgr.client.run_task.call_count == 3
+  assert len(result['tasks']) == 2
+  assert [f['reason'] for f in result['failures']] == ['InvalidParameterException']
+
+def test_start_task_retries_transient_failures(task_mgr, time):
+  error = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'RunTask')
+  capacity = {'tasks': [{'taskArn': 'task-1'}, {'taskArn': 'task-2'}], 'failures': [{'reason': 'RESOURCE:MEMORY'}]}
+  agent = {'tasks': [{'taskArn': 'task-3'}], 'failures': [{'reason': 'AGENT'}]}
+  task_mgr.client.run_task.side_effect = [error, capacity, agent, {'tasks': [{'taskArn': 'task-4'}], 'failures': []}]
+  result = task_mgr.start_task(fixtures.CLUSTER_NAME, fixtures.OLD_TASK_DEFINITION_ARN, {}, 4, 'admin', 'EC2', {})
+  # Only the tasks that failed to launch are retried
+  assert [c[1]['count'] for c in task_mgr.client.run_task.call_args_list] == [4, 4, 2, 1]
+  assert [t['taskArn'] for t in result['tasks']] == ['task-1', 'task-2', 'task-3', 'task-4']
+  assert result['failures'] == []
+  assert result['retries'] == {'capacity': 1, 'throttling': 1, 'agent': 1}
+  assert time.call_count == 3
+
+def test_start_task_does_not_retry_permanent_failures(task_mgr, time):
+  task_mgr.client.run_task.return_value = {'tasks': [], 'failures': [{'reason': 'RESOURCE:CPU'}, {'reason': 'MISSING'}]}
+  result = task_mgr.start_task(fixtures.CLUSTER_NAME, fixtures.OLD_TASK_DEFINITION_ARN, {}, 1, 'admin', 'EC2', {})
+  assert task_mgr.client.run_task.call_count == 1
+  assert len(result['failures']) == 2
+  assert not time.called
+
+def test_start_task_retry_deadline(task_mgr, time):
+  clock = [fixtures.NOW]
+  time.side_effect = lambda delay: clock.__setitem__(0, clock[0] + delay)
+  task_mgr.client.run_task.return_value = fixtures.TASK_FAILURE
+  with mock.patch('time.time', side_effect=lambda: clock[0]), mock.patch('random.uniform', side_effect=lambda a, b: b):
+    result = task_mgr.start_task(fixtures.CLUSTER_NAME, fixtures.OLD_TASK_DEFINITION_ARN, {}, 1, 'admin', 'EC2', {})
+  # Retries back off 1, 2, 4 and 8 seconds, with the next 16 second delay exceeding the 30 second deadline
+  assert [c[0][0] for c in time.call_args_list] == [1, 2, 4, 8]
+  assert task_mgr.client.run_task.call_count == 5
+  assert result['failures'] == fixtures.TASK_FAILURE['failures']
+  assert result['retries']['capacity'] == 4
 
 def test_check_task_running(check_task, check_task_event, context):
   result = check_task.handler(check_task_event, context)
   assert check_task.task_mgr.client.describe_tasks.called
   assert result['Status'] == 'RUNNING'
 
+def test_check_task_next_poll(check_task, check_task_event, context):
+  check_task_event['Status'] = 'RUNNING'
+  check_task_event['PollStrategy'] = 'Exponential'
+  check_task_event['PollAttempt'] = 2
+  check_task_event['MaxPoll'] = 60
+  result = check_task.handler(check_task_event, context)
+  assert result['Status'] == 'RUNNING'
+  assert result['PollAttempt'] == 3
+  assert 30 <= result['NextPoll'] <= 60
+
 def test_check_task_completed(check_task, check_task_event, context):
   check_task.task_mgr.client.describe_tasks.return_value = fixtures.STOPPED_TASK_RESULT
   result = check_task.handler(check_task_event, context)
@@ -49,9 +131,445 @@ def test_check_task_exited_non_zero(check_task, check_task_event, context):
   assert result['Reason'].startswith('One or more containers failed with a non-zero exit code')
 
 def test_check_task_failure(check_task, check_task_event, context):
-  check_task.task_mgr.client.describe_tasks.return_value['failures'] = fixtures.TASK_FAILURE
+  result = copy.deepcopy(fixtures.RUNNING_TASK_RESULT)
+  result['failures'] = fixtures.TASK_FAILURE['failures']
+  check_task.task_mgr.client.describe_tasks.return_value = result
   result = check_task.handler(check_task_event, context)
   assert check_task.task_mgr.client.describe_tasks.called
   assert result['Status'] == 'FAILED'
   assert result['Reason'].startswith('A task failure occurred')
-  
\ No newline at end of file
+  
+def test_bulk_describe_tasks(task_mgr):
+  pairs = [('cluster-%d' % (i % 2), 'arn:aws:ecs:us-west-2:123456789012:task/%d' % i) for i in range(250)]
+  def describe_tasks(cluster, tasks):
+    return {
+      'tasks': [{'taskArn': t, 'clusterArn': cluster} for t in reversed(tasks) if not t.endswith('/7')],
+      'failures': [{'arn': t, 'reason': 'MISSING'} for t in tasks if t.endswith('/7')]
+    }
+  task_mgr.client.describe_tasks.side_effect = describe_tasks
+  result = task_mgr.bulk_describe_tasks(pairs)
+  assert task_mgr.client.describe_tasks.call_count == 4
+  assert all(len(c[1]['tasks']) <= 100 for c in task_mgr.client.describe_tasks.call_args_list)
+  assert [t['taskArn'] for t in result['tasks']] == [p[1] for p in pairs if not p[1].endswith('/7')]
+  assert [f['arn'] for f in result['failures']] == [pairs[7][1]]
+  assert all(t['clusterArn'] == 'cluster-%d' % (int(t['taskArn'].split('/')[-1]) % 2) for t in result['tasks'])
+
+def test_describe_task_definition_cached_by_revision(task_mgr):
+  first = task_mgr.describe_task_definition(fixtures.OLD_TASK_DEFINITION_ARN)
+  second = task_mgr.describe_task_definition(fixtures.OLD_TASK_DEFINITION_ARN)
+  assert first is second
+  assert task_mgr.client.describe_task_definition.call_count == 1
+  assert task_mgr.task_definition_cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+def test_describe_task_definition_records_cache_metrics(task_mgr):
+  with mock.patch.object(ecs, 'get_metrics') as get_metrics, mock.patch.object(ecs, 'log') as log:
+    task_mgr.describe_task_definition(fixtures.OLD_TASK_DEFINITION_ARN)
+    task_mgr.describe_task_definition(fixtures.OLD_TASK_DEFINITION_ARN)
+  assert [c[0] for c in get_metrics().record.call_args_list] == [('TaskDefinitionCacheMisses', 1), ('TaskDefinitionCacheHits', 1)]
+  assert not log.info.called
+
+def test_describe_task_definition_family_expires(task_mgr):
+  family = 'my-stack-AdhocTaskDefinition'
+  task_mgr.client.describe_task_definition.side_effect = lambda taskDefinition: fixtures.NEW_TASK_DEFINITION_RESULT
+  with mock.patch('time.time', return_value=fixtures.NOW):
+    task_mgr.describe_task_definition(family)
+    task_mgr.describe_task_definition(family)
+  # The resolved revision is cached until evicted
+  with mock.patch('time.time', return_value=fixtures.NOW + 3600):
+    task_mgr.describe_task_definition(family)
+    task_mgr.describe_task_definition(fixtures.NEW_TASK_DEFINITION_ARN)
+  assert task_mgr.client.describe_task_definition.call_count == 2
+
+def test_task_definition_cache_evicts_least_recently_used():
+  cache = TtlLruCache(capacity=2)
+  cache.put('a', 1)
+  cache.put('b', 2)
+  cache.get('a')
+  cache.put('c', 3)
+  assert cache.get('b') is None
+  assert cache.get('a') == 1
+  assert cache.get('c') == 3
+
+def container_instances(task_mgr, count):
+  arn = lambda i: 'arn:aws:ecs:us-west-2:123456789012:container-instance/%d' % i
+  task_mgr.client.list_container_instances.side_effect = [
+    {'containerInstanceArns': [arn(i) for i in range(0, 100)], 'NextToken': 'next'},
+    {'containerInstanceArns': [arn(i) for i in range(100, count)]}
+  ]
+  task_mgr.client.describe_container_instances.side_effect = lambda cluster, containerInstances: {
+    'containerInstances': [{'containerInstanceArn': c, 'ec2InstanceId': 'i-%s' % c.split('/')[-1]} for c in containerInstances]
+  }
+  return arn
+
+def test_get_container_instances(task_mgr):
+  arn = container_instances(task_mgr, 150)
+  result = task_mgr.get_container_instances(fixtures.CLUSTER_NAME, ['i-5', 'i-120', 'i-999'])
+  assert result == {'i-5': arn(5), 'i-120': arn(120)}
+  assert task_mgr.client.list_container_instances.call_args_list[0] == mock.call(cluster=fixtures.CLUSTER_NAME)
+  assert task_mgr.client.describe_container_instances.call_count == 2
+  # Cached instances are resolved without listing the cluster
+  assert task_mgr.get_container_instances(fixtures.CLUSTER_NAME, ['i-5', 'i-140']) == {'i-5': arn(5), 'i-140': arn(140)}
+  assert task_mgr.client.list_container_instances.call_count == 2
+
+def test_start_task_on_instances(task_mgr):
+  arn = container_instances(task_mgr, 150)
+  def start_task(containerInstances, **kwargs):
+    if containerInstances == [arn(7)]:
+      return {'tasks': [], 'failures': [{'arn': arn(7), 'reason': 'RESOURCE:MEMORY'}]}
+    return {'tasks': [{'taskArn': 'task-%s' % containerInstances[0].split('/')[-1], 'lastStatus': 'PENDING'}], 'failures': []}
+  task_mgr.client.start_task.side_effect = start_task
+  instances = ['i-1', arn(2), 'i-7', 'i-999']
+  result = task_mgr.start_task(fixtures.CLUSTER_NAME, fixtures.OLD_TASK_DEFINITION_ARN, {}, 1, 'admin', 'EC2', {}, instances)
+  assert not task_mgr.client.run_task.called
+  assert task_mgr.client.start_task.call_count == 3
+  assert 'launchType' not in task_mgr.client.start_task.call_args[1]
+  assert [t['taskArn'] for t in result['tasks']] == ['task-1', 'task-2']
+  assert [(f['instance'], f['reason']) for f in result['failures']] == [('i-7', 'RESOURCE:MEMORY'), ('i-999', 'MISSING')]
+
+def test_create_task_on_instances(create_task, create_task_event, context):
+  create_task.task_mgr.client.start_task.return_value = fixtures.START_TASK_RESULT
+  create_task_event['Instances'] = ['arn:aws:ecs:us-west-2:123456789012:container-instance/1']
+  result = create_task.handler(create_task_event, context)
+  assert create_task.task_mgr.client.start_task.called
+  assert not create_task.task_mgr.client.run_task.called
+  assert result['Status'] == 'PENDING'
+
+def cluster_capacity(task_mgr, memory):
+  task_mgr.client.list_container_instances.side_effect = lambda **kwargs: {'containerInstanceArns': ['ci-%d' % i for i in range(len(memory))]}
+  task_mgr.client.describe_container_instances.side_effect = lambda cluster, containerInstances: {
+    'containerInstances': [{
+      'containerInstanceArn': c,
+      'agentConnected': True,
+      'remainingResources': [
+        {'name': 'CPU', 'type': 'INTEGER', 'integerValue': 1024},
+        {'name': 'MEMORY', 'type': 'INTEGER', 'integerValue': memory[int(c.split('-')[-1])]}
+      ]
+    } for c in containerInstances]
+  }
+
+def run_tasks(count, **kwargs):
+  return {'tasks': [{'taskArn': 'task-%s' % uuid4(), 'lastStatus': 'PENDING'} for i in range(count)], 'failures': []}
+
+def test_task_resources():
+  task_definition = fixtures.OLD_TASK_DEFINITION_RESULT['taskDefinition']
+  assert ecs.task_resources(task_definition) == (0, 100)
+  assert ecs.task_resources(task_definition, {'containerOverrides': [{'name': 'app', 'cpu': '256', 'memoryReservation': '300'}]}) == (256, 300)
+  assert ecs.task_resources(task_definition, {'memory': '512'}) == (0, 512)
+  assert ecs.task_resources(dict(task_definition, cpu='512', memory='1024')) == (512, 1024)
+
+def test_get_capacity(task_mgr):
+  cluster_capacity(task_mgr, [250, 99, 1000])
+  assert task_mgr.get_capacity(fixtures.CLUSTER_NAME, fixtures.OLD_TASK_DEFINITION_ARN) == 12
+  assert task_mgr.client.list_container_instances.call_args == mock.call(cluster=fixtures.CLUSTER_NAME, status='ACTIVE')
+
+def test_create_task_queued(create_task, create_task_event, context):
+  create_task.task_mgr.client.describe_task_definition.side_effect = lambda taskDefinition: fixtures.OLD_TASK_DEFINITION_RESULT
+  create_task.task_mgr.client.run_task.side_effect = run_tasks
+  cluster_capacity(create_task.task_mgr, [250, 100])
+  create_task_event.update({'Count': 5, 'AdmissionMode': 'Capacity'})
+  result = create_task.handler(create_task_event, context)
+  assert create_task.task_mgr.client.run_task.call_args[1]['count'] == 3
+  assert result['Status'] == 'QUEUED'
+  assert result['Queued'] == 2
+  assert len(result['Tasks']) == 3
+
+def test_create_task_queued_without_capacity(create_task, create_task_event, context):
+  create_task.task_mgr.client.describe_task_definition.side_effect = lambda taskDefinition: fixtures.OLD_TASK_DEFINITION_RESULT
+  cluster_capacity(create_task.task_mgr, [50])
+  create_task_event.update({'Count': 2, 'AdmissionMode': 'Capacity'})
+  result = create_task.handler(create_task_event, context)
+  assert not create_task.task_mgr.client.run_task.called
+  assert result['Status'] == 'QUEUED'
+  assert result['Queued'] == 2
+
+def test_start_admitted_tasks_requeues_resource_failures(task_mgr):
+  cluster_capacity(task_mgr, [1000])
+  task_mgr.client.run_task.side_effect = lambda count, **kwargs: {
+    'tasks': run_tasks(count - 2)['tasks'],
+    'failures': [{'arn': 'ci-0', 'reason': 'RESOURCE:MEMORY'}]
+  }
+  result = task_mgr.start_admitted_tasks(fixtures.CLUSTER_NAME, fixtures.OLD_TASK_DEFINITION_ARN, {}, 5, 'admin', 'EC2', {})
+  assert len(result['tasks']) == 3
+  assert result['failures'] == []
+  assert result['queued'] == 2
+
+def test_check_task_launches_queued(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_task_definition.side_effect = lambda taskDefinition: fixtures.OLD_TASK_DEFINITION_RESULT
+  check_task.task_mgr.client.run_task.side_effect = run_tasks
+  check_task.task_mgr.client.describe_tasks.return_value = fixtures.RUNNING_TASK_RESULT
+  cluster_capacity(check_task.task_mgr, [150])
+  check_task_event.update({'Status': 'QUEUED', 'Queued': 2, 'AdmissionMode': 'Capacity'})
+  result = check_task.handler(check_task_event, context)
+  assert result['Status'] == 'QUEUED'
+  assert result['Queued'] == 1
+  assert len(result['Tasks']) == 2
+  cluster_capacity(check_task.task_mgr, [150])
+  result = check_task.handler(result, context)
+  assert result['Queued'] == 0
+  assert result['Status'] == 'PENDING'
+  assert check_task.task_mgr.client.run_task.call_count == 2
+
+def test_compact_task():
+  task = ecs.compact_task(fixtures.STOPPED_TASK_RESULT['tasks'][0])
+  assert sorted(task.keys()) == ['containers', 'createdAt', 'desiredStatus', 'lastStatus', 'startedAt', 'stoppedReason', 'taskArn']
+  assert task['containers'] == [{'name': 'app', 'lastStatus': 'STOPPED', 'exitCode': 0}]
+
+def test_create_task_compact_state(create_task, create_task_event, context):
+  result = create_task.handler(create_task_event, context)
+  assert result['Tasks'] == [{
+    'taskArn': fixtures.PHYSICAL_RESOURCE_ID,
+    'lastStatus': 'PENDING',
+    'desiredStatus': 'RUNNING',
+    'createdAt': fixtures.UTC.isoformat(),
+    'containers': [{'name': 'app', 'lastStatus': 'PENDING'}]
+  }]
+
+def test_create_task_full_detail(create_task, create_task_event, context):
+  create_task_event['FullTaskDetail'] = 'true'
+  result = create_task.handler(create_task_event, context)
+  assert result['Tasks'][0]['containerInstanceArn'] == fixtures.START_TASK_RESULT['tasks'][0]['containerInstanceArn']
+  assert result['Tasks'][0]['containers'][0]['containerArn'] == fixtures.START_TASK_RESULT['tasks'][0]['containers'][0]['containerArn']
+
+def test_check_task_exited_non_zero_compact(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.return_value = fixtures.FAILED_TASK_RESULT
+  check_task_event['Tasks'] = [ecs.compact_task(t) for t in check_task_event['Tasks']]
+  result = check_task.handler(check_task_event, context)
+  assert result['Status'] == 'FAILED'
+  assert result['Reason'] == 'One or more containers failed with a non-zero exit code: %s' % [fixtures.PHYSICAL_RESOURCE_ID]
+  assert result['Outcomes'][0]['Outcome'] == 'ApplicationError'
+  assert result['Retryable'] is False
+
+# Test stopped tasks are classified, with retryable outcomes flagged so that only those are run again
+def test_check_task_outcomes(check_task, check_task_event, context):
+  interrupted = copy.deepcopy(fixtures.FAILED_TASK_RESULT)
+  interrupted['tasks'][0].update(stopCode='SpotInterruption', stoppedReason='Your Spot Task was interrupted.')
+  check_task.task_mgr.client.describe_tasks.return_value = interrupted
+  result = check_task.handler(copy.deepcopy(check_task_event), context)
+  assert result['Status'] == 'FAILED'
+  assert result['Reason'] == 'One or more tasks failed (1 SpotInterruption): %s (SpotInterruption)' % fixtures.PHYSICAL_RESOURCE_ID
+  assert result['Outcomes'][0]['Containers'] == [{'Name': 'app', 'ExitCode': 1}]
+  assert result['Retryable'] is True
+  check_task.task_mgr.client.describe_tasks.return_value = fixtures.STOPPED_TASK_RESULT
+  result = check_task.handler(check_task_event, context)
+  assert result['Status'] == 'STOPPED'
+  assert result['Outcomes'] == [{'TaskArn': fixtures.PHYSICAL_RESOURCE_ID, 'Outcome': 'Succeeded', 'Retryable': False, 'StoppedReason': 'Container exited'}]
+
+# Test containers marked as not essential in the task definition may exit with a non-zero exit code
+def test_check_task_non_essential_container(check_task, check_task_event, context):
+  task_definition = copy.deepcopy(fixtures.OLD_TASK_DEFINITION_RESULT)
+  task_definition['taskDefinition']['containerDefinitions'].append({'name': 'sidecar', 'essential': False})
+  check_task.task_mgr.client.describe_task_definition.side_effect = lambda taskDefinition: task_definition
+  stopped = copy.deepcopy(fixtures.STOPPED_TASK_RESULT)
+  stopped['tasks'][0]['containers'].append({'name': 'sidecar', 'lastStatus': 'STOPPED', 'exitCode': 137})
+  check_task.task_mgr.client.describe_tasks.return_value = stopped
+  result = check_task.handler(check_task_event, context)
+  assert result['Status'] == 'STOPPED'
+  assert result['Outcomes'][0]['Outcome'] == 'Succeeded'
+
+def batch_run_task(taskDefinition, count, **kwargs):
+  if taskDefinition == 'seed':
+    return fixtures.TASK_FAILURE
+  return {'tasks': [{'taskArn': '%s-%d' % (taskDefinition, i), 'lastStatus': 'PENDING', 'containers': []} for i in range(count)], 'failures': []}
+
+def test_create_task_batch(create_task, create_task_event, context):
+  create_task.task_mgr.client.run_task.side_effect = batch_run_task
+  del create_task_event['TaskDefinition']
+  create_task_event['TaskSpecs'] = [
+    {'Name': 'migrate', 'TaskDefinition': 'migrate', 'Overrides': {'containerOverrides': [{'name': 'app', 'command': ['migrate']}]}},
+    {'Name': 'index', 'TaskDefinition': 'index', 'Count': 2, 'LaunchType': 'FARGATE', 'NetworkConfiguration': {'awsvpcConfiguration': {'subnets': ['subnet-1']}}}
+  ]
+  result = create_task.handler(create_task_event, context)
+  calls = dict((c[1]['taskDefinition'], c[1]) for c in create_task.task_mgr.client.run_task.call_args_list)
+  assert calls['migrate']['launchType'] == 'EC2'
+  assert calls['migrate']['overrides'] == {'containerOverrides': [{'name': 'app', 'command': ['migrate']}]}
+  assert calls['index']['networkConfiguration'] == {'awsvpcConfiguration': {'subnets': ['subnet-1']}}
+  assert result['Status'] == 'PENDING'
+  assert [len(s['Tasks']) for s in result['TaskSpecs']] == [1, 2]
+  assert [s['Status'] for s in result['TaskSpecs']] == ['PENDING', 'PENDING']
+
+def test_create_task_batch_spec_failure(create_task, create_task_event, context, time):
+  create_task.task_mgr.client.run_task.side_effect = batch_run_task
+  create_task_event['TaskSpecs'] = [{'TaskDefinition': 'migrate'}, {'TaskDefinition': 'seed'}]
+  result = create_task.handler(create_task_event, context)
+  assert result['Status'] == 'PENDING'
+  assert result['TaskSpecs'][0]['Status'] == 'PENDING'
+  assert result['TaskSpecs'][1]['Status'] == 'FAILED'
+  assert result['TaskSpecs'][1]['Reason'].startswith('A task failure occurred')
+
+def test_create_task_batch_failure(create_task, create_task_event, context, time):
+  create_task.task_mgr.client.run_task.side_effect = batch_run_task
+  create_task_event['TaskSpecs'] = [{'TaskDefinition': 'seed'}]
+  result = create_task.handler(create_task_event, context)
+  assert result['Status'] == 'FAILED'
+  assert result['Reason'].startswith('A task failure occurred')
+
+def test_create_task_requires_task_definition(create_task, create_task_event, context):
+  del create_task_event['TaskDefinition']
+  result = create_task.handler(create_task_event, context)
+  assert result['Status'] == 'FAILED'
+  assert 'either TaskDefinition or TaskSpecs must be specified' in result['Reason']
+
+def batch_check_event(check_task_event):
+  check_task_event['TaskSpecs'] = [
+    {'Name': 'migrate', 'TaskDefinition': 'migrate', 'Status': 'RUNNING', 'Tasks': [{'taskArn': 'migrate-0'}]},
+    {'Name': 'seed', 'TaskDefinition': 'seed', 'Status': 'RUNNING', 'Tasks': [{'taskArn': 'seed-0'}, {'taskArn': 'seed-1'}]}
+  ]
+  return check_task_event
+
+def describe_batch(statuses):
+  def describe_tasks(cluster, tasks):
+    return {'tasks': [{
+      'taskArn': t,
+      'lastStatus': statuses[t][0],
+      'containers': [{'name': 'app', 'exitCode': statuses[t][1]}]
+    } for t in tasks], 'failures': []}
+  return describe_tasks
+
+def test_check_task_batch(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.side_effect = describe_batch({'migrate-0': ('STOPPED', 1), 'seed-0': ('RUNNING', None), 'seed-1': ('STOPPED', 0)})
+  result = check_task.handler(batch_check_event(check_task_event), context)
+  # The tasks of all task specs are described together
+  assert check_task.task_mgr.client.describe_tasks.call_count == 1
+  assert result['Status'] == 'RUNNING'
+  assert result['TaskSpecs'][0]['Status'] == 'FAILED'
+  assert result['TaskSpecs'][0]['Reason'] == 'One or more containers failed with a non-zero exit code: %s' % ['migrate-0']
+  assert result['TaskSpecs'][1]['Status'] == 'RUNNING'
+  assert [t['lastStatus'] for t in result['TaskSpecs'][1]['Tasks']] == ['RUNNING', 'STOPPED']
+  # Failed task specs are no longer described, with the batch failing once all task specs are complete
+  check_task.task_mgr.client.describe_tasks.side_effect = describe_batch({'seed-0': ('STOPPED', 0), 'seed-1': ('STOPPED', 0)})
+  result = check_task.handler(result, context)
+  assert check_task.task_mgr.client.describe_tasks.call_args[1]['tasks'] == ['seed-0', 'seed-1']
+  assert result['Status'] == 'FAILED'
+  assert result['Reason'].startswith('A task failure occurred')
+  assert 'migrate' in result['Reason']
+
+def test_check_task_batch_completed(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.side_effect = describe_batch({'migrate-0': ('STOPPED', 0), 'seed-0': ('STOPPED', 0), 'seed-1': ('STOPPED', 0)})
+  result = check_task.handler(batch_check_event(check_task_event), context)
+  assert result['Status'] == 'STOPPED'
+  assert [s['Status'] for s in result['TaskSpecs']] == ['STOPPED', 'STOPPED']
+
+# Test memoized create_task records its run once stopped and skips runs with the same inputs
+def test_memoized_task_is_skipped(create_task, check_task, create_task_event, context):
+  create_task.task_mgr.client.describe_task_definition.side_effect = lambda taskDefinition: fixtures.TASK_DEFINITION_RESULTS[taskDefinition]
+  check_task.task_mgr.client.describe_tasks.return_value = fixtures.STOPPED_TASK_RESULT
+  create_task_event['Memoize'] = True
+  run_store = memo.MemoryRunStore()
+  with mock.patch.object(create_task, 'run_store', run_store), mock.patch.object(check_task, 'run_store', run_store):
+    started = create_task.handler(copy.deepcopy(create_task_event), context)
+    assert not run_store.runs
+    stopped = check_task.handler(started, context)
+    skipped = create_task.handler(copy.deepcopy(create_task_event), context)
+  assert stopped['Status'] == 'STOPPED'
+  assert run_store.runs[started['Fingerprint']]['TaskArn'] == started['Tasks'][0]['taskArn']
+  assert create_task.task_mgr.client.run_task.call_count == 1
+  assert skipped['Status'] == 'STOPPED'
+  assert skipped['Skipped'] and skipped['Tasks'] == []
+
+# Builds a task set tracking one task on a given cluster
+def task_set(check_task_event, cluster, arn):
+  task_set = copy.deepcopy(check_task_event)
+  task_set['Cluster'] = cluster
+  task_set['Tasks'] = [dict(fixtures.START_TASK_RESULT['tasks'][0], taskArn=arn)]
+  return task_set
+
+# Describes tasks as stopped if their ARN ends with 'stopped', otherwise as running
+def describe_by_arn(cluster, tasks):
+  result = lambda arn: fixtures.STOPPED_TASK_RESULT if arn.endswith('stopped') else fixtures.RUNNING_TASK_RESULT
+  return {'tasks': [dict(result(arn)['tasks'][0], taskArn=arn) for arn in tasks], 'failures': []}
+
+# Builds SQS records of task sets tracking one task each
+def queue_records(check_task_event, arns):
+  return [{'messageId': 'message-%d' % i, 'eventSourceARN': fixtures.QUEUE_ARN, 'body': dumps(task_set(check_task_event, 'cluster', arn))}
+    for i, arn in enumerate(arns)]
+
+# Test supervisor checks all task sets with one describe request per cluster
+def test_supervise_task_sets(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.side_effect = describe_by_arn
+  task_sets = [task_set(check_task_event, 'cluster-%d' % (i % 2), 'task-%d-%s' % (i, 'stopped' if i % 3 else 'running')) for i in range(6)]
+  result = check_task.supervise({'TaskSets': task_sets}, context)
+  assert sorted(c[1]['cluster'] for c in check_task.task_mgr.client.describe_tasks.call_args_list) == ['cluster-0', 'cluster-1']
+  assert [s['Status'] for s in result['TaskSets']] == ['RUNNING', 'STOPPED', 'STOPPED', 'RUNNING', 'STOPPED', 'STOPPED']
+  assert all(s['NextPoll'] for s in result['TaskSets'])
+
+# Test supervisor fails invalid, timed out and missing task sets without affecting other task sets
+def test_supervise_task_set_failures(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.side_effect = lambda cluster, tasks: {
+    'tasks': [dict(fixtures.RUNNING_TASK_RESULT['tasks'][0], taskArn='task-running')],
+    'failures': [{'arn': 'task-missing', 'reason': 'MISSING'}]
+  }
+  timed_out = task_set(check_task_event, 'cluster', 'task-timeout')
+  timed_out['CreateTimestamp'] = (fixtures.UTC - datetime.timedelta(seconds=120)).isoformat() + 'Z'
+  task_sets = [task_set(check_task_event, 'cluster', 'task-running'), {'Cluster': 'cluster'}, timed_out, task_set(check_task_event, 'cluster', 'task-missing')]
+  result = check_task.supervise({'TaskSets': task_sets}, context)
+  assert [s['Status'] for s in result['TaskSets']] == ['RUNNING', 'FAILED', 'FAILED', 'FAILED']
+  assert 'invalid event properties' in result['TaskSets'][1]['Reason']
+  assert 'timeout' in result['TaskSets'][2]['Reason']
+  assert 'MISSING' in result['TaskSets'][3]['Reason']
+  assert 'Outcomes' not in result['TaskSets'][3]
+  assert check_task.task_mgr.client.describe_tasks.call_args[1]['tasks'] == ['task-running', 'task-missing']
+
+# Test failed task sets report their task outcomes, with only interrupted task sets flagged as retryable
+def test_supervise_task_set_outcomes(check_task, check_task_event, context):
+  def describe_tasks(cluster, tasks):
+    result = copy.deepcopy(fixtures.FAILED_TASK_RESULT)['tasks']
+    result[0].update(taskArn=tasks[0], stopCode='SpotInterruption' if tasks[0] == 'task-spot' else 'EssentialContainerExited')
+    if tasks[0] == 'task-oom':
+      result[0]['containers'][0].update(exitCode=137, reason='OutOfMemoryError: Container killed due to memory usage')
+    return {'tasks': result, 'failures': []}
+  check_task.task_mgr.client.describe_tasks.side_effect = describe_tasks
+  result = check_task.supervise({'TaskSets': [task_set(check_task_event, 'a', 'task-spot'), task_set(check_task_event, 'b', 'task-oom')]}, context)
+  assert [s['Status'] for s in result['TaskSets']] == ['FAILED', 'FAILED']
+  assert [s['Outcomes'][0]['Outcome'] for s in result['TaskSets']] == ['SpotInterruption', 'OutOfMemory']
+  assert [s['Retryable'] for s in result['TaskSets']] == [True, False]
+
+# Test supervisor sends running task sets back to their queue and delivers stopped task sets to the result queue
+def test_supervise_queue_records(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.side_effect = describe_by_arn
+  records = queue_records(check_task_event, ['task-running', 'task-stopped'])
+  result = check_task.supervise({'Records': records}, context)
+  assert [s['Status'] for s in result['TaskSets']] == ['RUNNING', 'STOPPED']
+  assert result['batchItemFailures'] == []
+  sent = dict((c[1]['QueueUrl'], c[1]) for c in check_task.task_set_queue.sqs.send_message.call_args_list)
+  check_task.task_set_queue.sqs.get_queue_url.assert_called_once_with(QueueName='task-sets', QueueOwnerAWSAccountId=str(fixtures.AWS_ACCOUNT_ID))
+  assert loads(sent[fixtures.QUEUE_URL]['MessageBody'])['Status'] == 'RUNNING'
+  assert sent[fixtures.QUEUE_URL]['DelaySeconds'] == result['TaskSets'][0]['NextPoll']
+  assert loads(sent[fixtures.RESULT_QUEUE_URL]['MessageBody'])['Status'] == 'STOPPED'
+
+# Test supervisor delivers task set results to their task tokens and reports records that could not be forwarded
+def test_supervise_queue_task_tokens(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_tasks.side_effect = describe_by_arn
+  check_task.task_set_queue.sqs.send_message.side_effect = Exception('Access denied')
+  check_task_event['TaskToken'] = 'token'
+  records = queue_records(check_task_event, ['task-running', 'task-stopped'])
+  result = check_task.supervise({'Records': records}, context)
+  assert result['batchItemFailures'] == [{'itemIdentifier': 'message-0'}]
+  output = loads(check_task.task_set_queue.sfn.send_task_success.call_args[1]['output'])
+  assert output['Status'] == 'STOPPED' and output['TaskToken'] == 'token'
+
+# Test supervisor does not launch queued tasks of queued task sets whose result cannot be delivered
+def test_supervise_queue_without_destination(check_task, check_task_event, context):
+  check_task.task_set_queue.result_queue_url = None
+  check_task_event['Queued'] = 1
+  result = check_task.supervise({'Records': queue_records(check_task_event, ['task-running'])}, context)
+  assert result['TaskSets'][0]['Status'] == 'FAILED'
+  assert 'requires a TaskToken' in result['TaskSets'][0]['Reason']
+  assert result['batchItemFailures'] == []
+  assert not check_task.task_mgr.client.run_task.called
+  assert not check_task.task_set_queue.sqs.send_message.called
+
+# Test check_task tails log streams with only forward tokens persisted in the event and reads the last lines on failure
+def test_check_task_stream_logs(check_task, check_task_event, context):
+  check_task.task_mgr.client.describe_task_definition.side_effect = fixtures.logged_task_definition
+  check_task_event['StreamLogs'] = True
+  logs_client = fixtures.LocalLogsClient()
+  logs_client.put_log_events(fixtures.LOG_GROUP, fixtures.log_stream(), 'Loading data')
+  with mock.patch.object(check_task.logs_mgr, 'client', logs_client, create=True):
+    running = check_task.handler(check_task_event, context)
+    assert running['LogStreams'][0]['Token'] == 'f/1' and 'Lines' not in running['LogStreams'][0]
+    logs_client.put_log_events(fixtures.LOG_GROUP, fixtures.log_stream(), 'Out of memory')
+    check_task.task_mgr.client.describe_tasks.return_value = fixtures.FAILED_TASK_RESULT
+    failed = check_task.handler(running, context)
+  assert logs_client.calls == 5
+  assert failed['Status'] == 'FAILED'
+  assert failed['Reason'].endswith('Last log lines:\n[app] Loading data\n[app] Out of memory')
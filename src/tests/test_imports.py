@@ -0,0 +1,14 @@
+import os
+import sys
+import subprocess
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY_MODULES = ['boto3', 'voluptuous', 'requests', 'cfn_lambda_handler', 'dateutil.parser', 'concurrent.futures']
+
+# Handler modules must defer heavy imports and client creation until first use
+@pytest.mark.parametrize('handler', ['ecs_tasks', 'create_task', 'check_task'])
+def test_handler_import_is_lazy(handler):
+  code = 'import sys; import %s; print(",".join(m for m in %r if m in sys.modules))' % (handler, HEAVY_MODULES)
+  output = subprocess.check_output([sys.executable, '-c', code], cwd=SRC_DIR)
+  assert output.strip() == b''
@@ -0,0 +1,70 @@
+import mock
+import pytest
+from lib import logs
+from fixtures import LocalLogsClient, logged_task_definition, log_stream
+from constants import LOG_GROUP, OLD_TASK_DEFINITION_ARN, PHYSICAL_RESOURCE_ID
+
+@pytest.fixture
+def logs_mgr():
+  logs_mgr = logs.LogsManager()
+  logs_mgr.client = LocalLogsClient()
+  return logs_mgr
+
+def stream():
+  return {'TaskArn': PHYSICAL_RESOURCE_ID, 'Container': 'app', 'Group': LOG_GROUP, 'Stream': log_stream()}
+
+def test_log_streams():
+  task_definition = logged_task_definition(OLD_TASK_DEFINITION_ARN)['taskDefinition']
+  task_definition['containerDefinitions'].append({'name': 'sidecar', 'logConfiguration': {'logDriver': 'json-file'}})
+  assert logs.log_streams(task_definition, PHYSICAL_RESOURCE_ID) == [stream()]
+
+def test_add_streams_skips_tailed_tasks():
+  task_definition = logged_task_definition(OLD_TASK_DEFINITION_ARN)['taskDefinition']
+  streams = [dict(stream(), Token='f/2')]
+  logs.add_streams(streams, task_definition, [{'taskArn': PHYSICAL_RESOURCE_ID}, {'taskArn': 'arn:aws:ecs:task/other'}])
+  assert [(s['Stream'], s.get('Token')) for s in streams] == [(log_stream(), 'f/2'), ('ecs/app/other', None)]
+
+def test_tail_reads_from_forward_token(logs_mgr):
+  s = stream()
+  logs_mgr.client.put_log_events(LOG_GROUP, log_stream(), 'one', 'two', 'three')
+  assert logs_mgr.tail(s) == ['one', 'two', 'three']
+  assert s['Token'] == 'f/3' and 'Lines' not in s
+  assert logs_mgr.tail(s) == []
+  logs_mgr.client.put_log_events(LOG_GROUP, log_stream(), 'four')
+  assert logs_mgr.tail(s) == ['four']
+
+def test_tail_missing_stream(logs_mgr):
+  s = stream()
+  assert logs_mgr.tail(s) == []
+  assert 'Token' not in s
+  logs_mgr.client.put_log_events(LOG_GROUP, log_stream(), 'started')
+  assert logs_mgr.tail(s) == ['started']
+
+def test_tail_reads_limited_pages(logs_mgr):
+  s = stream()
+  logs_mgr.client.put_log_events(LOG_GROUP, log_stream(), *['line %d' % i for i in range(20)])
+  assert len(logs_mgr.tail(s)) == logs.LOG_PAGES_LIMIT * 2
+  assert logs_mgr.tail(s)[0] == 'line %d' % (logs.LOG_PAGES_LIMIT * 2)
+
+def test_tail_streams_logs_bounded_lines(logs_mgr):
+  logs_mgr.client.put_log_events(LOG_GROUP, log_stream(), 'one', 'two', 'three')
+  with mock.patch.object(logs, 'log') as log:
+    logs_mgr.tail_streams([stream()], 2)
+  assert [c[0][1:] for c in log.info.call_args_list] == [('app', 1), ('app', 'two'), ('app', 'three')]
+
+def test_last_lines(logs_mgr):
+  logs_mgr.client.put_log_events(LOG_GROUP, log_stream(), 'started', 'done', 'failed')
+  logs_mgr.client.put_log_events(LOG_GROUP, 'ecs/app/other', 'ok')
+  streams = [dict(stream(), Token='f/3'), dict(stream(), TaskArn='other', Stream='ecs/app/other'), dict(stream(), TaskArn='missing', Stream='ecs/app/missing')]
+  assert logs_mgr.last_lines(streams, [PHYSICAL_RESOURCE_ID, 'missing'], 2) == ['[app] done', '[app] failed']
+  assert logs_mgr.last_lines(None, [PHYSICAL_RESOURCE_ID], 2) == []
+
+def test_tail_tasks_skips_unstarted_and_read_tasks(logs_mgr):
+  streams = [stream(), dict(stream(), TaskArn='pending', Stream='ecs/app/pending')]
+  tasks = [{'taskArn': PHYSICAL_RESOURCE_ID, 'lastStatus': 'STOPPED'}, {'taskArn': 'pending', 'lastStatus': 'PENDING'}]
+  logs_mgr.client.put_log_events(LOG_GROUP, log_stream(), 'done')
+  logs_mgr.tail_tasks(streams, tasks, 2)
+  assert logs_mgr.client.calls == 2
+  assert streams[0]['Complete'] and 'Complete' not in streams[1]
+  logs_mgr.tail_tasks(streams, tasks, 2)
+  assert logs_mgr.client.calls == 2
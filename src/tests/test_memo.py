@@ -0,0 +1,71 @@
+import os
+import copy
+import mock
+import pytest
+from lib import memo
+from constants import OLD_TASK_DEFINITION_RESULT, NEW_TASK_DEFINITION_RESULT
+
+TASK_DEFINITION = OLD_TASK_DEFINITION_RESULT['taskDefinition']
+
+def test_fingerprint_ignores_ordering():
+  task_definition = copy.deepcopy(TASK_DEFINITION)
+  task_definition['containerDefinitions'][0]['environment'] = [{'name': 'B', 'value': '2'}, {'name': 'A', 'value': '1'}]
+  reordered = copy.deepcopy(task_definition)
+  reordered['containerDefinitions'][0]['environment'].reverse()
+  overrides = {'containerOverrides': [{'name': 'app', 'command': ['migrate']}], 'taskRoleArn': 'role'}
+  assert memo.fingerprint(memo.run_inputs(task_definition, overrides)) == memo.fingerprint(memo.run_inputs(reordered, dict(overrides)))
+
+def test_fingerprint_ignores_task_definition_revision():
+  revision = dict(TASK_DEFINITION, revision=2, taskDefinitionArn='my-stack-AdhocTaskDefinition:2')
+  assert memo.fingerprint(memo.run_inputs(TASK_DEFINITION)) == memo.fingerprint(memo.run_inputs(revision))
+
+@pytest.mark.parametrize('task_definition,overrides,count', [
+  (NEW_TASK_DEFINITION_RESULT['taskDefinition'], None, 1),
+  (TASK_DEFINITION, {'containerOverrides': [{'name': 'app', 'command': ['seed']}]}, 1),
+  (TASK_DEFINITION, None, 2)
+])
+def test_fingerprint_changes_with_inputs(task_definition, overrides, count):
+  assert memo.fingerprint(memo.run_inputs(task_definition, overrides, count)) != memo.fingerprint(memo.run_inputs(TASK_DEFINITION))
+
+def test_fingerprint_changes_with_image_digest():
+  image = TASK_DEFINITION['containerDefinitions'][0]['image']
+  first = memo.fingerprint(memo.run_inputs(TASK_DEFINITION, digests={image: 'sha256:1'}))
+  assert first != memo.fingerprint(memo.run_inputs(TASK_DEFINITION, digests={image: 'sha256:2'}))
+
+def test_image_resolver():
+  resolver = memo.ImageResolver('us-west-2')
+  resolver.client = mock.Mock()
+  resolver.client.describe_images.return_value = {'imageDetails': [{'imageDigest': 'sha256:1'}]}
+  assert resolver.digest('nginx@sha256:2') == 'nginx@sha256:2'
+  assert resolver.digests(TASK_DEFINITION) == {TASK_DEFINITION['containerDefinitions'][0]['image']: 'sha256:1'}
+  resolver.client.describe_images.assert_called_with(registryId='123456789012', repositoryName='org/my-app', imageIds=[{'imageTag': 'latest'}])
+  # Tagged images outside ECR cannot be resolved, so a push to the tag would go unnoticed
+  from lib.errors import validation_errors
+  with pytest.raises(validation_errors()):
+    resolver.digest('nginx:1.25')
+  # Tagged images in other regions cannot be resolved with the client of the function region
+  with pytest.raises(validation_errors()):
+    resolver.digest('123456789012.dkr.ecr.eu-west-1.amazonaws.com/org/my-app:latest')
+  assert resolver.digest('123456789012.dkr.ecr.eu-west-1.amazonaws.com/org/my-app@sha256:3').endswith('@sha256:3')
+  assert resolver.client.describe_images.call_count == 1
+
+def test_file_run_store(tmpdir):
+  store = memo.FileRunStore(str(tmpdir.join('runs')))
+  assert store.get_run('abc') is None
+  store.put_run('abc', {'TaskArn': 'task'})
+  assert store.get_run('abc') == {'TaskArn': 'task'}
+  assert memo.FileRunStore(str(tmpdir.join('runs'))).get_run('abc') == {'TaskArn': 'task'}
+
+def test_dynamodb_run_store():
+  store = memo.DynamoDbRunStore('runs')
+  store.client = mock.Mock()
+  store.client.get_item.return_value = {'Item': {'Fingerprint': {'S': 'abc'}, 'Run': {'S': '{"TaskArn": "task"}'}}}
+  store.put_run('abc', {'TaskArn': 'task'})
+  assert store.client.put_item.call_args[1]['Item']['Fingerprint'] == {'S': 'abc'}
+  assert store.get_run('abc') == {'TaskArn': 'task'}
+  assert store.client.get_item.call_args[1]['Key'] == {'Fingerprint': {'S': 'abc'}}
+
+@pytest.mark.parametrize('name,kind', [('dynamodb', memo.DynamoDbRunStore), ('file', memo.FileRunStore), ('memory', memo.MemoryRunStore)])
+def test_get_run_store(name, kind):
+  with mock.patch.dict(os.environ, {'RUN_MEMO_STORE': name}):
+    assert isinstance(memo.get_run_store(), kind)
@@ -0,0 +1,71 @@
+import os
+import json
+import mock
+import pytest
+from StringIO import StringIO
+from lib import metrics
+import fixtures
+from fixtures import context, ecs_tasks, create_event, time, now
+
+@pytest.fixture
+def emf():
+  return metrics.Metrics('EcsTasks', StringIO())
+
+def lines(emf):
+  emf.flush()
+  return [json.loads(l) for l in emf.stream.getvalue().splitlines()]
+
+def test_metrics_are_written_as_emf(emf):
+  emf.record('Latency', 12.5, 'Milliseconds', Operation='run_task')
+  emf.record('Latency', 7.5, 'Milliseconds', Operation='run_task')
+  emf.record('Retries', 0, Operation='run_task')
+  emf.record('PollIterations', 1)
+  run_task, poll = lines(emf)
+  assert run_task['_aws']['CloudWatchMetrics'] == [{
+    'Namespace': 'EcsTasks',
+    'Dimensions': [['Operation']],
+    'Metrics': [{'Name': 'Latency', 'Unit': 'Milliseconds'}, {'Name': 'Retries', 'Unit': 'Count'}]
+  }]
+  assert run_task['Operation'] == 'run_task'
+  assert run_task['Latency'] == [12.5, 7.5]
+  assert run_task['Retries'] == 0
+  assert poll['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [[]]
+  assert poll['PollIterations'] == 1
+
+def test_metrics_are_cleared_on_flush(emf):
+  emf.record('PollIterations', 1)
+  emf.flush()
+  emf.flush()
+  assert len(emf.stream.getvalue().splitlines()) == 1
+
+def test_metric_values_are_split_across_lines(emf):
+  for i in range(250):
+    emf.record('Latency', i, 'Milliseconds', Operation='describe_tasks')
+  emf.record('Retries', 1, Operation='describe_tasks')
+  output = lines(emf)
+  assert [len(l['Latency']) for l in output] == [100, 100, 50]
+  assert [l.get('Retries') for l in output] == [1, None, None]
+  assert output[1]['_aws']['CloudWatchMetrics'][0]['Metrics'] == [{'Name': 'Latency', 'Unit': 'Milliseconds'}]
+
+@pytest.mark.parametrize('env,kind', [({}, metrics.NullMetrics), ({'METRICS_ENABLED': 'false'}, metrics.NullMetrics), ({'METRICS_ENABLED': 'true'}, metrics.Metrics)])
+def test_metrics_are_disabled_by_default(env, kind):
+  environ = dict((k, v) for k, v in os.environ.items() if k != 'METRICS_ENABLED')
+  environ.update(env)
+  metrics.reset_metrics()
+  with mock.patch.dict(os.environ, environ, clear=True):
+    assert isinstance(metrics.get_metrics(), kind)
+  metrics.reset_metrics()
+
+# Test polling records poll iterations, sleeps and the time until tasks stopped
+def test_poll_metrics(ecs_tasks, create_event, context, time, now, emf):
+  create_event['ResourceProperties']['Timeout'] = 3600
+  ecs_tasks.task_mgr.client.describe_tasks.side_effect = [fixtures.RUNNING_TASK_RESULT, fixtures.STOPPED_TASK_RESULT]
+  context.get_remaining_time_in_millis.return_value = 900000
+  with mock.patch.object(ecs_tasks, 'metrics', emf):
+    now.return_value = fixtures.NOW + 30
+    response = ecs_tasks.handle_create(create_event, context)
+  assert response['Status'] == 'SUCCESS'
+  [output] = lines(emf)
+  assert output['PollIterations'] == [1, 1, 1]
+  assert output['PollSleep'] == [10, 10]
+  assert output['TimeToStopped'] == 30
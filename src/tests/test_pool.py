@@ -0,0 +1,68 @@
+import mock
+import pytest
+import fixtures
+from fixtures import task_mgr, cfn_mgr, time, now
+from lib import EcsTaskPool, EcsTaskExitCodeError, EcsTaskTimeoutError, EcsTaskFailureError
+
+@pytest.fixture
+def pool(task_mgr, cfn_mgr):
+  with EcsTaskPool(task_mgr, cfn_mgr, max_workers=4) as pool:
+    yield pool
+
+def task_set(arn, **kwargs):
+  return dict(Cluster='cluster', TaskResult={'tasks': [dict(fixtures.START_TASK_RESULT['tasks'][0], taskArn=arn)], 'failures': []}, **kwargs)
+
+# Describes tasks as stopped once described a given number of times, with a non-zero exit code if their ARN ends with 'failed'
+def describe_after(polls):
+  described = {}
+  def describe_tasks(cluster, tasks):
+    result = []
+    for arn in tasks:
+      described[arn] = described.get(arn, 0) + 1
+      task = fixtures.STOPPED_TASK_RESULT if described[arn] >= polls.get(arn, 1) else fixtures.RUNNING_TASK_RESULT
+      task = fixtures.FAILED_TASK_RESULT if task is fixtures.STOPPED_TASK_RESULT and arn.endswith('failed') else task
+      result.append(dict(task['tasks'][0], taskArn=arn))
+    return {'tasks': result, 'failures': []}
+  return describe_tasks
+
+def test_requests_return_futures(pool):
+  pool.task_mgr.client.list_tasks.side_effect = None
+  pool.task_mgr.client.list_tasks.return_value = {'taskArns': ['task-1', 'task-2']}
+  futures = [pool.start_task(cluster='cluster', task_definition='migrate', overrides={}, count=1, started_by='admin', launch_type='EC2', network_configuration={}) for _ in range(3)]
+  tasks = pool.list_tasks('cluster', startedBy='admin')
+  status = pool.get_stack_status(fixtures.STACK_NAME)
+  assert all(f.result()['tasks'] for f in futures)
+  assert tasks.result() == ['task-1', 'task-2']
+  assert status.result() == 'ROLLBACK_IN_PROGRESS'
+  assert pool.task_mgr.client.run_task.call_count == 3
+
+def test_poll_resolves_each_task_set(pool, time):
+  pool.task_mgr.client.describe_tasks.side_effect = describe_after({'task-slow': 3})
+  futures = pool.poll([task_set('task-fast'), task_set('task-slow'), task_set('task-failed')])
+  assert futures[0].result(timeout=5)['tasks'][0]['lastStatus'] == 'STOPPED'
+  assert futures[1].result(timeout=5)['tasks'][0]['taskArn'] == 'task-slow'
+  assert futures[1].result()['outcomes'][0]['Outcome'] == 'Succeeded'
+  with pytest.raises(EcsTaskExitCodeError):
+    futures[2].result(timeout=5)
+  # All task sets are described together on each poll
+  assert pool.task_mgr.client.describe_tasks.call_count == 3
+  assert time.call_count == 2
+
+def test_poll_timeout_and_describe_failures(pool, time, now):
+  pool.task_mgr.client.describe_tasks.side_effect = lambda cluster, tasks: {
+    'tasks': [dict(fixtures.RUNNING_TASK_RESULT['tasks'][0], taskArn='task-running')],
+    'failures': [{'arn': 'task-missing', 'reason': 'MISSING'}]
+  }
+  futures = pool.poll([task_set('task-running', CreationTime=fixtures.NOW - 120, Timeout=60), task_set('task-missing')])
+  with pytest.raises(EcsTaskTimeoutError):
+    futures[0].result(timeout=5)
+  with pytest.raises(EcsTaskFailureError):
+    futures[1].result(timeout=5)
+
+def test_poll_returns_pending_task_sets_when_out_of_time(pool, time):
+  pool.task_mgr.client.describe_tasks.side_effect = describe_after({'task-slow': 10})
+  remaining_time = mock.Mock(side_effect=[20000, 10000])
+  futures = pool.poll([task_set('task-fast'), task_set('task-slow')], remaining_time=remaining_time)
+  assert futures[0].result(timeout=5)['tasks'][0]['lastStatus'] == 'STOPPED'
+  assert futures[1].result(timeout=5) is None
+  assert pool.task_mgr.client.describe_tasks.call_count == 2
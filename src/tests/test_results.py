@@ -0,0 +1,84 @@
+import copy
+import pytest
+import fixtures
+from lib import results
+
+def stopped_task(exit_code=0, **kwargs):
+  task = copy.deepcopy(fixtures.STOPPED_TASK_RESULT['tasks'][0])
+  task.update(kwargs)
+  task['containers'][0]['exitCode'] = exit_code
+  return task
+
+def with_sidecar(task, exit_code=None, **kwargs):
+  task['containers'].append(dict({'name': 'sidecar', 'lastStatus': 'STOPPED'}, **kwargs))
+  if exit_code is not None:
+    task['containers'][-1]['exitCode'] = exit_code
+  return task
+
+@pytest.mark.parametrize('task,outcome', [
+  (stopped_task(), results.SUCCEEDED),
+  (stopped_task(1, stopCode='EssentialContainerExited'), results.APPLICATION_ERROR),
+  (stopped_task(137, stopCode='EssentialContainerExited', containers=[{'name': 'app', 'exitCode': 137, 'reason': 'OutOfMemoryError: Container killed due to memory usage'}]), results.OUT_OF_MEMORY),
+  (stopped_task(None, stopCode='TaskFailedToStart', stoppedReason='CannotPullContainerError: pull image manifest has been retried 5 time(s)'), results.IMAGE_PULL_ERROR),
+  (stopped_task(None, stopCode='TaskFailedToStart', stoppedReason='ResourceInitializationError: unable to pull secrets or registry auth'), results.STARTUP_ERROR),
+  (stopped_task(143, stopCode='SpotInterruption', stoppedReason='Your Spot Task was interrupted.'), results.SPOT_INTERRUPTION),
+  (stopped_task(137, stopCode='ServiceSchedulerInitiated', stoppedReason='Host EC2 (instance i-0abc) terminated.'), results.INFRASTRUCTURE_ERROR),
+  (stopped_task(143, stopCode='UserInitiated', stoppedReason='Task stopped by user'), results.USER_STOPPED),
+  (stopped_task(None, stopCode='EssentialContainerExited'), results.UNKNOWN)
+])
+def test_classify_task(task, outcome):
+  assert results.classify_task(task) == outcome
+
+def test_non_essential_containers_ignored():
+  task_definition = copy.deepcopy(fixtures.OLD_TASK_DEFINITION_RESULT['taskDefinition'])
+  task_definition['containerDefinitions'].append({'name': 'sidecar', 'essential': False})
+  non_essential = results.non_essential_containers(task_definition)
+  assert non_essential == set(['sidecar'])
+  # Non-essential containers may exit with any exit code, or none if stopped before exiting
+  assert results.classify_task(with_sidecar(stopped_task(), 1), non_essential) == results.SUCCEEDED
+  assert results.classify_task(with_sidecar(stopped_task(), reason='OutOfMemoryError: Container killed'), non_essential) == results.SUCCEEDED
+  assert results.classify_task(with_sidecar(stopped_task(), 1)) == results.APPLICATION_ERROR
+
+def test_task_outcomes_summarize_failed_containers():
+  task_definition = {'containerDefinitions': [{'name': 'app'}, {'name': 'sidecar', 'essential': False}]}
+  tasks = [
+    stopped_task(stopCode='EssentialContainerExited'),
+    with_sidecar(stopped_task(2, stopCode='EssentialContainerExited', stoppedReason='Essential container in task exited', taskArn='failed'), 1),
+    stopped_task(143, stopCode='SpotInterruption', taskArn='interrupted')
+  ]
+  outcomes = results.task_outcomes(tasks, task_definition)
+  assert outcomes[0] == {'TaskArn': fixtures.PHYSICAL_RESOURCE_ID, 'Outcome': 'Succeeded', 'Retryable': False, 'StopCode': 'EssentialContainerExited', 'StoppedReason': 'Container exited'}
+  assert outcomes[1] == {
+    'TaskArn': 'failed',
+    'Outcome': 'ApplicationError',
+    'Retryable': False,
+    'StopCode': 'EssentialContainerExited',
+    'StoppedReason': 'Essential container in task exited',
+    'Containers': [{'Name': 'app', 'ExitCode': 2}]
+  }
+  assert outcomes[2]['Outcome'] == 'SpotInterruption' and outcomes[2]['Retryable']
+  assert [o['TaskArn'] for o in results.failed_outcomes(outcomes)] == ['failed', 'interrupted']
+
+def test_exit_code_reason_summarizes_outcomes():
+  from lib import EcsTaskExitCodeError
+  from lib.errors import exit_code_reason
+  tasks = [stopped_task(1, taskArn='app-%d' % i) for i in range(30)]
+  tasks += [stopped_task(137, taskArn='oom-%d' % i, containers=[{'name': 'app', 'exitCode': 137, 'reason': 'OutOfMemoryError'}]) for i in range(7)]
+  outcomes = results.task_outcomes(tasks)
+  reason = exit_code_reason(EcsTaskExitCodeError(tasks, [t['taskArn'] for t in tasks], outcomes=outcomes))
+  assert reason == 'One or more tasks failed (30 ApplicationError, 7 OutOfMemory): ' \
+    'app-0 (ApplicationError), app-1 (ApplicationError), app-2 (ApplicationError) and 34 more'
+  non_zero = exit_code_reason(EcsTaskExitCodeError(tasks[:30], [t['taskArn'] for t in tasks[:30]], outcomes=outcomes[:30]))
+  assert non_zero == "One or more containers failed with a non-zero exit code: ['app-0', 'app-1', 'app-2'] and 27 more"
+
+def test_exit_code_reason_truncates_log_lines():
+  from lib import EcsTaskExitCodeError
+  from lib.errors import exit_code_reason, CFN_REASON_BYTES
+  tasks = [stopped_task(1, taskArn='app')]
+  logs = [u'[app] line %d %s' % (i, u'é' * 100) for i in range(100)]
+  e = EcsTaskExitCodeError(tasks, ['app'], logs, results.task_outcomes(tasks))
+  assert exit_code_reason(e).endswith('\n'.join(logs))
+  reason = exit_code_reason(e, CFN_REASON_BYTES)
+  assert len(reason.encode('utf-8')) <= CFN_REASON_BYTES
+  assert '\nLast log lines:\n... (truncated)\n[app] line' in reason
+  assert reason.endswith(logs[-1])
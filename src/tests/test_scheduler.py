@@ -0,0 +1,26 @@
+import pytest
+import mock
+from lib import scheduler
+
+@pytest.fixture
+def no_jitter():
+  with mock.patch('random.uniform', side_effect=lambda a, b: b) as uniform:
+    yield uniform
+
+def test_fixed_interval():
+  assert [scheduler.poll_interval('Fixed', a, 'RUNNING', 10, 60) for a in range(5)] == [10] * 5
+
+def test_exponential_interval(no_jitter):
+  assert [scheduler.poll_interval('Exponential', a, 'RUNNING', 10, 60) for a in range(5)] == [10, 20, 40, 60, 60]
+
+def test_exponential_interval_jitter():
+  intervals = [scheduler.poll_interval('Exponential', 3, 'RUNNING', 10, 60) for _ in range(100)]
+  assert all(30 <= i <= 60 for i in intervals)
+
+def test_status_interval(no_jitter):
+  assert [scheduler.poll_interval('Status', a, 'PENDING', 10, 300) for a in range(5)] == [10] * 5
+  assert [scheduler.poll_interval('Status', a, 'RUNNING', 10, 300) for a in range(6)] == [10, 10, 20, 40, 80, 160]
+
+def test_next_attempt():
+  assert scheduler.next_attempt(0, 'PENDING', 'PENDING') == 1
+  assert scheduler.next_attempt(3, 'PENDING', 'RUNNING') == 0
@@ -0,0 +1,53 @@
+import json
+import logging
+import mock
+import pytest
+import datetime
+from decimal import Decimal
+from lib import serialization
+from constants import STOPPED_TASK_RESULT, UTC
+
+@pytest.fixture
+def backend():
+  serialization.backend = None
+  yield
+  serialization.backend = None
+
+def round_trip(data):
+  return json.loads(json.dumps(data, default=serialization.default))
+
+def test_normalize_matches_round_trip():
+  data = {'Tasks': STOPPED_TASK_RESULT['tasks'], 'Count': 2 ** 64, 'Ratio': 0.5, 'Done': True, 'Reason': None, 1: 'one'}
+  assert serialization.normalize(data) == round_trip(data)
+
+def test_normalize_converts_unsupported_values():
+  data = {'createdAt': UTC, 'values': (1, Decimal('1.5'))}
+  assert serialization.normalize(data) == {'createdAt': UTC.isoformat(), 'values': [1, '1.5']}
+
+def test_normalize_copies_structure():
+  data = {'Tasks': [{'taskArn': 'task'}]}
+  result = serialization.normalize(data)
+  result['Tasks'][0]['lastStatus'] = 'STOPPED'
+  assert data == {'Tasks': [{'taskArn': 'task'}]}
+
+def test_dumps(backend):
+  data = {'createdAt': datetime.datetime(2017, 1, 1, 12, 30), 'url': 'https://example.org/path'}
+  assert json.loads(serialization.dumps(data)) == {'createdAt': '2017-01-01T12:30:00', 'url': 'https://example.org/path'}
+  assert serialization.loads(serialization.dumps(data)) == round_trip(data)
+
+def test_json_backend(backend):
+  with mock.patch.dict('os.environ', {'JSON_BACKEND': 'json'}):
+    assert serialization.get_backend() == ('json', json)
+
+def test_fast_backend_fallback(backend):
+  with mock.patch.object(serialization, 'FAST_BACKENDS', ['missing_json_backend']):
+    assert serialization.get_backend() == ('json', json)
+
+def test_json_formatter_is_deferred():
+  log = logging.getLogger('test_serialization')
+  log.setLevel(logging.WARNING)
+  with mock.patch.object(serialization, 'dumps', return_value='{}') as dumps:
+    log.info('Task result %s', serialization.JsonFormatter({'tasks': []}))
+    assert not dumps.called
+    assert str(serialization.JsonFormatter({'tasks': []})) == '{}'
+    assert dumps.called
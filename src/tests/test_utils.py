@@ -0,0 +1,41 @@
+import mock
+from lib.utils import paginate, paginated_response
+
+def pages(count, page_size):
+  def operation(NextToken=None):
+    start = int(NextToken or 0)
+    end = start + page_size
+    response = {'taskArns': list(range(count))[start:end]}
+    if end < count:
+      response['NextToken'] = str(end)
+    return response
+  return mock.Mock(side_effect=operation)
+
+def test_paginated_response():
+  operation = pages(250, 100)
+  assert paginated_response(operation, 'taskArns') == list(range(250))
+  assert operation.call_count == 3
+
+def test_paginated_response_many_pages():
+  operation = pages(5000, 1)
+  assert paginated_response(operation, 'taskArns') == list(range(5000))
+
+def test_paginated_response_missing_key():
+  assert paginated_response(mock.Mock(return_value={}), 'taskArns') == []
+
+def test_paginate_is_lazy():
+  operation = pages(250, 100)
+  items = paginate(operation, 'taskArns')
+  assert not operation.called
+  assert next(items) == 0
+  assert operation.call_count == 1
+
+def test_paginate_max_items():
+  operation = pages(250, 100)
+  assert list(paginate(operation, 'taskArns', max_items=150)) == list(range(150))
+  assert operation.call_count == 2
+  assert operation.call_args_list[1] == mock.call(NextToken='100')
+
+def test_paginate_next_token():
+  operation = pages(250, 100)
+  assert list(paginate(operation, 'taskArns', next_token='200')) == list(range(200, 250))
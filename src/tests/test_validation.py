@@ -0,0 +1,61 @@
+import copy
+import mock
+import pytest
+from lib import validation
+from lib import validate_ecs
+from lib.errors import validation_errors
+
+OVERRIDES = {
+  'containerOverrides': [{
+    'name': 'app',
+    'command': ['manage.py', 'migrate'],
+    'environment': [{'name': 'WORKERS', 'value': 4}]
+  }]
+}
+
+def test_validators_are_cached():
+  validation.validators.clear()
+  with mock.patch('lib.validation.get_ecs_validator', wraps=validation.get_ecs_validator) as get_ecs_validator:
+    validate_ecs({'Cluster': 'cluster', 'TaskDefinition': 'family'})
+    validate_ecs({'Cluster': 'cluster', 'TaskDefinition': 'family'})
+  assert get_ecs_validator.call_count == 1
+
+def test_validated_event_is_not_validated_again():
+  event = validate_ecs({'Cluster': 'cluster', 'TaskDefinition': 'family'})
+  assert event['SchemaVersion'] == validation.get_schema_version()
+  event['Count'] = 'invalid'
+  assert validate_ecs(event) is event
+
+def test_event_with_stale_schema_version_is_validated():
+  event = {'Cluster': 'cluster', 'TaskDefinition': 'family', 'Count': 'invalid', 'SchemaVersion': 'stale'}
+  with pytest.raises(validation_errors()):
+    validate_ecs(event)
+
+def test_overrides_are_converted_to_strings():
+  overrides = copy.deepcopy(OVERRIDES)
+  result = validation.DictToString(overrides)
+  assert result['containerOverrides'][0]['environment'][0]['value'] == '4'
+  assert result['containerOverrides'][0]['command'] is overrides['containerOverrides'][0]['command']
+  assert overrides['containerOverrides'][0]['environment'][0]['value'] == 4
+
+def test_string_overrides_are_not_copied():
+  overrides = {'containerOverrides': [{'name': 'app', 'command': ['manage.py', 'migrate']}]}
+  assert validation.DictToString(overrides) is overrides
+
+def test_custom_resource_count_is_limited():
+  from lib import validate_cfn
+  assert validate_cfn({'Cluster': 'cluster', 'TaskDefinition': 'family', 'Count': 100})['Count'] == 100
+  with pytest.raises(validation_errors()):
+    validate_cfn({'Cluster': 'cluster', 'TaskDefinition': 'family', 'Count': 101})
+  graph = [{'Name': 'task-%d' % i, 'TaskDefinition': 'family', 'Count': 60} for i in range(2)]
+  with pytest.raises(validation_errors()):
+    validate_cfn({'Cluster': 'cluster', 'TaskGraph': graph, 'Timeout': 3600})
+
+def test_event_count_is_limited():
+  from lib import validate_ecs
+  assert validate_ecs({'Cluster': 'cluster', 'TaskDefinition': 'family', 'Count': 300})['Count'] == 300
+  with pytest.raises(validation_errors()):
+    validate_ecs({'Cluster': 'cluster', 'TaskDefinition': 'family', 'Count': 301})
+  specs = [{'Name': 'spec-%d' % i, 'TaskDefinition': 'family', 'Count': 200} for i in range(2)]
+  with pytest.raises(validation_errors()):
+    validate_ecs({'Cluster': 'cluster', 'TaskSpecs': specs})